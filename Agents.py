@@ -1,82 +1,272 @@
 
 import os
+import threading
 from dotenv import load_dotenv
-from crewai import Agent
-from crewai.llm import LLM
-from Tools import get_patient_history_tool
+
+# CrewAI, the LLM clients and the tools are imported inside the functions
+# below, so importing this module (for agent_registry) stays cheap and the
+# framework loads on the first analysis or warm-up instead of at startup.
 
 load_dotenv()
 
-def create_llm():
-    """Create LLM instance with Ollama configuration."""
-    # api_key = os.environ.get("OPENAI_API_KEY")
-    return LLM(
-    model="openrouter/deepseek/deepseek-chat-v3-0324:free",  
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.getenv("OPENAI_API_KEY")  # make sure this is set properly
-)
+def create_endpoint(model, base_url):
+    """Provider client for one model endpoint, behind the LLMScheduler when it is enabled."""
+    from crewai.llm import LLM
+    from LLMScheduler import ScheduledLLM, get_scheduler, SCHEDULER_ENABLED
+
+    llm = LLM(
+        model=model,
+        base_url=base_url,
+        api_key=os.getenv("OPENAI_API_KEY"),  # make sure this is set properly
+        # The scheduler owns retries, so the client must not retry on its own
+        **({"max_retries": 0} if SCHEDULER_ENABLED else {})
+    )
+    if SCHEDULER_ENABLED:
+        llm = ScheduledLLM(model=llm.model, llm=llm, scheduler=get_scheduler())
+    return llm
+
+
+def create_llm(agent=None, endpoint=create_endpoint):
+    """Create the LLM for an agent (LLMRouter.ROUTE_AGENTS) from its route, behind the response cache.
+
+    The route picks the model(s): a chain of several endpoints is served by
+    RoutedLLM (fallback, optional hedging). Provider calls go through the
+    process-wide LLMScheduler (rate limits, priorities, retries); cache hits
+    skip it. The result is wrapped in InstrumentedLLM so every call is
+    measured. `endpoint(model, base_url)` builds each endpoint's client.
+
+    LLM_MODE=fake returns the offline FakeLLM instead (tests and load runs).
+    """
+    from Instrumentation import InstrumentedLLM, install_event_handlers
+
+    install_event_handlers()
+    if os.getenv("LLM_MODE", "openrouter") == "fake":
+        from FakeLLM import FakeLLM
+        llm = FakeLLM(model="fake", latency=float(os.getenv("FAKE_LLM_LATENCY", 0)))
+        return InstrumentedLLM(model=llm.model, llm=llm)
+
+    from LLMCache import CachedLLM, get_response_cache
+    from LLMRouter import RoutedLLM, route_for
+
+    endpoints = [endpoint(model, base_url) for model, base_url in route_for(agent)]
+    llm = endpoints[0] if len(endpoints) == 1 else RoutedLLM(model=endpoints[0].model, endpoints=endpoints)
+    cache = get_response_cache()
+    if cache is not None:
+        llm = CachedLLM(model=llm.model, llm=llm, cache=cache)
+    return InstrumentedLLM(model=llm.model, llm=llm)
+
+
+# One LLM client per route and one provider client per endpoint, shared by
+# the agents using them and rebuilt only if the LLM settings change
+_shared_llms = {}
+_shared_endpoints = {}
+_shared_llm_key = None
+_shared_llm_lock = threading.Lock()
 
 
+def _shared_endpoint(model, base_url):
+    key = (model, base_url)
+    if key not in _shared_endpoints:
+        _shared_endpoints[key] = create_endpoint(model, base_url)
+    return _shared_endpoints[key]
 
-def create_symptom_extractor_agent():
+
+def get_shared_llm(agent=None):
+    """Return the process-wide LLM client for an agent's route, creating it on first use.
+
+    Agents on the same route share one client, and routes share the client
+    (and with it the HTTP connection pool) of every endpoint they have in
+    common, instead of building one each.
+    """
+    global _shared_llm_key
+    from LLMRouter import route_for
+
+    key = tuple(os.getenv(name) for name in ("LLM_MODE", "FAKE_LLM_LATENCY", "OPENAI_API_KEY"))
+    route = None if os.getenv("LLM_MODE") == "fake" else route_for(agent)
+    with _shared_llm_lock:
+        if _shared_llm_key != key:
+            _shared_llms.clear()
+            _shared_endpoints.clear()
+            _shared_llm_key = key
+        if route not in _shared_llms:
+            _shared_llms[route] = create_llm(agent, endpoint=_shared_endpoint)
+        return _shared_llms[route]
+
+
+def shared_llms():
+    """The distinct shared LLM clients of all agents."""
+    from LLMRouter import ROUTE_AGENTS
+
+    llms = []
+    for agent in ROUTE_AGENTS:
+        llm = get_shared_llm(agent)
+        if all(llm is not other for other in llms):
+            llms.append(llm)
+    return llms
+
+
+
+def create_symptom_extractor_agent(llm=None):
     """Agent 1 - Extract and structure patient information into clean JSON format"""
+    from crewai import Agent
     return Agent(
         role="Medical Data Extractor",
         goal="Extract and structure patient information into clean JSON format",
-        backstory="""You are a specialized medical data extraction agent. Your expertise is in taking raw patient 
-        information (name, age, gender, symptoms) and converting it into structured, clean JSON format. You convert 
-        patient-reported symptoms into proper medical terminology when possible. You are precise and only output 
-        valid JSON objects with standardized medical terms.""",
+        backstory=("You are a medical data extraction specialist. You turn raw patient information into clean JSON, "
+                   "converting patient-reported symptoms into standard medical terms. You only output valid JSON."),
         verbose=True,
         allow_delegation=False,
-        llm=create_llm(),
+        llm=llm or create_llm("extractor"),
         handle_tool_error=lambda error: f"Error executing tool: {str(error)}. Please try again or inform the user."
     )
 
-def create_medical_history_agent():
-    """Agent 2 - Retrieve and combine patient medical history with Agent 1's output"""
+def create_medical_history_agent(with_tools=True, llm=None):
+    """Agent 2 - Retrieve and combine patient medical history with Agent 1's output
+
+    Pass with_tools=False when the history is already given with the task
+    (prefetch pipeline), so the agent answers without a tool-calling turn.
+    With tools it can also search the record for specific entries.
+    """
+    from crewai import Agent
+    from Tools import get_patient_history_tool, search_patient_history_tool
     return Agent(
         role="Medical History Specialist",
         goal="Retrieve patient medical history and combine with structured patient data",
-        backstory="""You are a medical history specialist agent. Your expertise is in accessing patient medical 
-        records from the database and combining them with current patient information. You analyze patient metadata, 
-        symptoms, and historical data to provide comprehensive medical profiles including chronic conditions, 
-        allergies, and previous treatments. You always begin with 'Based on the previous agent's output' and only 
-        output valid JSON objects. When you encounter errors or failures, you provide detailed reasoning explaining 
-        what went wrong and why.""",
+        backstory=("You are a medical history specialist. You combine patient records with current patient "
+                   "information into a medical profile with chronic conditions, allergies and previous treatments. "
+                   "You only output valid JSON."),
         verbose=False,
         allow_delegation=False,
-        llm=create_llm(),
-        tools=[get_patient_history_tool],
+        llm=llm or create_llm("history"),
+        tools=[get_patient_history_tool, search_patient_history_tool] if with_tools else [],
         handle_tool_error=lambda error: f"Tool execution failed: {str(error)}. I attempted to use the tool but encountered this error. Please provide detailed reasoning for this failure."
     )
 
-def create_symptom_evaluator_agent():
+def create_symptom_evaluator_agent(llm=None):
     """Agent 3 - Analyze patient's data and generate clinical summary for the doctor."""
+    from crewai import Agent
     return Agent(
         role="Medical Symptom Evaluator",
         goal="Analyze patient history and current symptoms to assist doctor with insights",
-        backstory="""
-        You are a clinical evaluator agent working alongside a doctor. Your job is to read the structured output 
-        from Agent 2, including current symptoms and medical history, and provide a helpful, structured summary. 
-        You never make final diagnoses but help the doctor with possible conditions, risk levels, and suggestions.
-        You begin with: 'Based on the previous agent's output...' and you always return structured JSON only.
-        """,
+        backstory=("You are a clinical evaluator working alongside a doctor. You never make final diagnoses but "
+                   "point out possible conditions, risk levels and next steps. You only output valid JSON."),
         verbose=True,
         allow_delegation=False,
-        llm=create_llm(),  # Use your LLM setup (Ollama or OpenRouter)
+        llm=llm or create_llm("evaluator"),  # Use your LLM setup (Ollama or OpenRouter)
         handle_tool_error=lambda e: f"Tool failed: {str(e)}"
     )
 
-def create_medical_report_generator_agent():
+def create_medical_report_generator_agent(llm=None):
     """Agent 4 - Generate human-readable medical report for healthcare providers"""
+    from crewai import Agent
     return Agent(
         role="Medical Report Generator",
         goal="Generate a clean and professional HTML medical report from structured JSON assessment",
-        backstory="""You are a medical documentation assistant. Your job is to convert structured clinical 
-            summaries into clear, readable, styled HTML reports for doctors. Focus on clarity, structure, 
-            and proper medical presentation.""",
+        backstory=("You are a medical documentation assistant. You turn structured clinical summaries into "
+                   "clear, well-structured HTML reports for doctors."),
         verbose=True,
         allow_delegation=False,
-        llm=create_llm()
-    )
\ No newline at end of file
+        llm=llm or create_llm("reporter")
+    )
+
+
+AGENT_FACTORIES = {
+    "extractor": create_symptom_extractor_agent,
+    "history": create_medical_history_agent,
+    "history_no_tools": lambda llm: create_medical_history_agent(with_tools=False, llm=llm),
+    "evaluator": create_symptom_evaluator_agent,
+    "reporter": create_medical_report_generator_agent,
+}
+
+# Registry name -> the agent whose LLM route it uses
+AGENT_ROUTES = {
+    "extractor": "extractor",
+    "history": "history",
+    "history_no_tools": "history",
+    "evaluator": "evaluator",
+    "reporter": "reporter",
+}
+
+
+class AgentRegistry:
+    """Process-wide pool of ready-built agents sharing one LLM client.
+
+    CrewAI agents hold per-execution state (crew, executor), so an agent is
+    leased to one run at a time; released agents are reused by later runs
+    instead of being rebuilt. Each agent gets the shared client of its LLM
+    route. Safe to use from threads and asyncio tasks.
+    """
+
+    def __init__(self, factories=AGENT_FACTORIES):
+        self._factories = factories
+        self._idle = {name: [] for name in factories}
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def acquire(self, name):
+        llm = get_shared_llm(AGENT_ROUTES.get(name))
+        with self._lock:
+            idle = self._idle[name]
+            while idle:
+                agent = idle.pop()
+                if agent.llm is llm:
+                    return agent
+            self.created += 1
+        return self._factories[name](llm=llm)
+
+    def release(self, name, agent):
+        agent.crew = None
+        with self._lock:
+            self._idle[name].append(agent)
+
+    def warm(self, names=None):
+        """Build one idle agent of each kind so the first run finds them ready."""
+        with self.lease() as lease:
+            for name in names or self._factories:
+                lease.get(name)
+
+    def warm_in_background(self, names=None):
+        """warm() on a daemon thread, so startup is not held up by loading CrewAI."""
+        def warm():
+            try:
+                self.warm(names)
+            except Exception as e:
+                # The first analysis builds its agents itself and reports the real error
+                print(f"⚠️ Agent warm-up failed: {e}")
+
+        thread = threading.Thread(target=warm, name="agent-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def lease(self):
+        """Context manager handing out agents for one run and returning them afterwards."""
+        return AgentLease(self)
+
+    def clear(self):
+        with self._lock:
+            for idle in self._idle.values():
+                idle.clear()
+
+
+class AgentLease:
+    """Agents borrowed from an AgentRegistry for the duration of one run."""
+
+    def __init__(self, registry):
+        self._registry = registry
+        self._borrowed = []
+
+    def get(self, name):
+        agent = self._registry.acquire(name)
+        self._borrowed.append((name, agent))
+        return agent
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, agent in self._borrowed:
+            self._registry.release(name, agent)
+        self._borrowed.clear()
+
+
+agent_registry = AgentRegistry()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Headless batch analysis of patient cohorts
+
+Reads patients from CSV or JSONL (national_id and symptoms; name, age and
+gender are looked up in the database when missing), runs the Agent 1-4
+pipeline for each with bounded concurrency and an optional start-rate
+limit, and appends one JSON line per patient to the output file as soon
+as it finishes. Re-running with --resume skips patients that already
+succeeded.
+
+Usage:
+    python Batch.py patients.csv results.jsonl --concurrency 4 --rate 30 --resume
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from db import init_database, get_patient_by_national_id
+from Metrics import start_metrics_server
+from Priorities import PRIORITY_BATCH
+from Workspace import RunWorkspace, SUMMARY_FILE
+
+
+def read_patients(path):
+    """Yield patient dicts from a .csv or .jsonl file.
+
+    A JSONL line that is not a JSON object is yielded as {"line": n,
+    "parse_error": ...}, so it is reported as a failed row instead of
+    stopping the batch.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield {k.strip(): (v or "").strip() for k, v in row.items() if k}
+        else:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    patient = json.loads(line)
+                except ValueError as e:
+                    yield {"line": number, "parse_error": f"invalid JSON: {e}"}
+                    continue
+                if isinstance(patient, dict):
+                    yield patient
+                else:
+                    yield {"line": number, "parse_error": "not a JSON object"}
+
+
+def count_patients(path):
+    return sum(1 for _ in read_patients(path))
+
+
+def record_key(patient):
+    """Stable identity of an input row, used for --resume."""
+    raw = f"{patient.get('national_id', '')}|{patient.get('symptoms', '')}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def completed_keys(output_path):
+    """Keys of rows already written successfully to output_path."""
+    keys = set()
+    if not os.path.exists(output_path):
+        return keys
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # partial line from an interrupted run
+            if record.get("status") == "ok":
+                keys.add(record.get("key"))
+    return keys
+
+
+class RateLimiter:
+    """Spaces calls to acquire() at most `per_minute` times a minute."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_for = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait_for > 0:
+            time.sleep(wait_for)
+
+
+class JsonlSink:
+    """Thread-safe append-only JSONL writer that flushes every record."""
+
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class Progress:
+    """Prints throughput and ETA as patients finish."""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = self.ok = self.failed = 0
+        self.started = time.monotonic()
+
+    def update(self, ok):
+        self.done += 1
+        if ok:
+            self.ok += 1
+        else:
+            self.failed += 1
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        print(f"[{self.done}/{self.total}] ok={self.ok} failed={self.failed} "
+              f"{rate * 60:.1f}/min ETA {time.strftime('%H:%M:%S', time.gmtime(eta))}", flush=True)
+
+
+def analyze_patient(patient, mode, report_mode):
+    """Run the pipeline for one input row and return its output record."""
+    from Pipeline import run_medical_analysis
+    from ReportRenderer import extract_json_object
+    from LLMScheduler import llm_priority
+
+    national_id = str(patient.get("national_id", "")).strip()
+    record = {"key": record_key(patient), "national_id": national_id}
+    started = time.monotonic()
+    try:
+        if "parse_error" in patient:
+            record["line"] = patient["line"]
+            raise ValueError(f"line {patient['line']}: {patient['parse_error']}")
+        if not national_id or not patient.get("symptoms"):
+            raise ValueError("national_id and symptoms are required")
+        name, age, gender = patient.get("name"), patient.get("age"), patient.get("gender")
+        if not (name and age and gender):
+            stored = get_patient_by_national_id(national_id)
+            if stored is None:
+                raise ValueError(f"Patient {national_id} not found and name/age/gender not given")
+            _, name, age, gender = stored
+
+        workspace = RunWorkspace()
+        # Interactive sessions sharing the rate limit go first
+        with llm_priority(PRIORITY_BATCH):
+            run_medical_analysis(name, int(age), gender, patient["symptoms"], national_id,
+                                 mode=mode, report_mode=report_mode, workspace=workspace)
+        try:
+            assessment = extract_json_object(workspace.read(SUMMARY_FILE) or "")
+        except ValueError:
+            assessment = None
+        record.update(status="ok", run_id=workspace.run_id,
+                      report_path=workspace.report_path, assessment=assessment)
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    record["seconds"] = round(time.monotonic() - started, 3)
+    return record
+
+
+def run_batch(input_path, output_path, concurrency=4, rate_per_minute=0, resume=False,
+              mode=None, report_mode=None):
+    """Analyze every patient in input_path, streaming results to output_path."""
+    from Pipeline import DEFAULT_PIPELINE_MODE, DEFAULT_REPORT_MODE
+    mode = mode or DEFAULT_PIPELINE_MODE
+    report_mode = report_mode or DEFAULT_REPORT_MODE
+
+    skip = completed_keys(output_path) if resume else set()
+    pending = (p for p in read_patients(input_path) if record_key(p) not in skip)
+    progress = Progress(count_patients(input_path) - len(skip))
+    if skip:
+        print(f"⏭️ Resuming: {len(skip)} patients already done")
+
+    limiter = RateLimiter(rate_per_minute)
+    sink = JsonlSink(output_path)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+            in_flight = set()
+            for patient in pending:
+                # Keep a bounded window of submitted work instead of queueing the whole file
+                if len(in_flight) >= concurrency * 2:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record = future.result()
+                        sink.write(record)
+                        progress.update(record["status"] == "ok")
+                limiter.acquire()
+                in_flight.add(pool.submit(analyze_patient, patient, mode, report_mode))
+            for future in wait(in_flight).done:
+                record = future.result()
+                sink.write(record)
+                progress.update(record["status"] == "ok")
+    finally:
+        sink.close()
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch medical analysis from CSV/JSONL")
+    parser.add_argument("input", help="patients file (.csv or .jsonl)")
+    parser.add_argument("output", help="results file (.jsonl, appended to)")
+    parser.add_argument("--concurrency", type=int, default=4, help="analyses in flight at once")
+    parser.add_argument("--rate", type=float, default=0, help="max analyses started per minute (0 = unlimited)")
+    parser.add_argument("--resume", action="store_true", help="skip patients already in the output")
+    parser.add_argument("--mode", choices=("prefetch", "sequential"))
+    parser.add_argument("--report-mode", choices=("template", "llm"))
+    parser.add_argument("--fake-llm", action="store_true", help="use the offline FakeLLM")
+    args = parser.parse_args()
+
+    if args.fake_llm:
+        os.environ["LLM_MODE"] = "fake"
+    init_database()
+    start_metrics_server()
+    progress = run_batch(args.input, args.output, args.concurrency, args.rate, args.resume,
+                         args.mode, args.report_mode)
+    elapsed = time.monotonic() - progress.started
+    print(f"✅ {progress.ok} succeeded, {progress.failed} failed in {elapsed:.1f}s")
+    sys.exit(1 if progress.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
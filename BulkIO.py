@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+Bulk import and export of patients and medical history
+
+Onboards a clinic's existing records in one streaming pass. Input rows are
+validated, normalized and deduplicated, then written in chunked
+transactions with one executemany per table. Index and full-text upkeep is
+deferred for the load and rebuilt in a single pass at the end. The export
+streams the database back out in any of the import formats.
+
+Formats (chosen by file extension, or --format):
+- csv:   national_id,name,age,gender,description,timestamp; a row with
+         name/age/gender is a patient, a row with a description a history
+         entry (one row can be both)
+- jsonl: one object per line, either a patient, optionally with a
+         "history" list, or a history entry {national_id, description,
+         timestamp}
+- fhir:  .ndjson (one resource per line, as in FHIR bulk data) or a .json
+         Bundle. Patient resources, plus Condition, Observation,
+         AllergyIntolerance and Procedure resources as history entries
+
+Usage:
+    python BulkIO.py import clinic.csv [--chunk-size 5000] [--no-defer-indexes]
+    python BulkIO.py export patients.jsonl
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, timezone
+
+from db import (
+    init_database,
+    existing_patient_ids,
+    get_history_keys,
+    bulk_insert,
+    has_medical_history,
+    defer_history_indexes,
+    restore_history_indexes,
+    iter_patients_with_history
+)
+
+CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 5000))
+FORMATS = ("csv", "jsonl", "fhir")
+CSV_COLUMNS = ("national_id", "name", "age", "gender", "description", "timestamp")
+GENDERS = {"male": "Male", "m": "Male", "female": "Female", "f": "Female"}
+MAX_AGE = 150
+# FHIR Patient has a birth date, not an age; exports carry the stored age here
+AGE_EXTENSION = "urn:healthcrew:patient-age"
+FHIR_HISTORY_RESOURCES = ("Condition", "Observation", "AllergyIntolerance", "Procedure")
+
+
+_DB_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+
+
+class InvalidRecord(ValueError):
+    """An input row that cannot be imported; the message is the reason."""
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension == ".jsonl":
+        return "jsonl"
+    if extension in (".ndjson", ".json"):
+        return "fhir"
+    raise ValueError(f"Cannot tell the format of {path}; pass --format")
+
+
+# ---- reading -------------------------------------------------------------
+
+def _read_csv(f):
+    previous = None
+    for row in csv.DictReader(f):
+        row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+        # Exports repeat the patient columns on each history row; read them once
+        patient = (row.get("national_id"), row.get("name"), row.get("age"), row.get("gender"))
+        if any(patient[1:]) and patient != previous:
+            yield "patient", row
+        previous = patient
+        if row.get("description"):
+            yield "history", row
+        if not any(row.values()):
+            yield "invalid", "empty row"
+
+
+def _read_jsonl(f):
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield "invalid", "malformed JSON line"
+            continue
+        if not isinstance(record, dict):
+            yield "invalid", "not a JSON object"
+        elif "description" in record and "name" not in record:
+            yield "history", record
+        else:
+            yield "patient", record
+            for entry in record.get("history") or []:
+                if isinstance(entry, str):
+                    entry = {"description": entry}
+                yield "history", {**entry, "national_id": record.get("national_id")}
+
+
+def _fhir_age(resource):
+    for extension in resource.get("extension") or []:
+        if extension.get("url") == AGE_EXTENSION:
+            return extension.get("valueInteger")
+    born = resource.get("birthDate")
+    if not born:
+        return None
+    try:
+        born = date.fromisoformat(born[:10])
+    except ValueError:
+        return born  # rejected by validation
+    today = date.today()
+    return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+
+
+def _fhir_name(resource):
+    for name in resource.get("name") or []:
+        if name.get("text"):
+            return name["text"]
+        parts = list(name.get("given") or []) + ([name["family"]] if name.get("family") else [])
+        if parts:
+            return " ".join(parts)
+    return None
+
+
+def _fhir_text(concept):
+    concept = concept or {}
+    if concept.get("text"):
+        return concept["text"]
+    for coding in concept.get("coding") or []:
+        if coding.get("display"):
+            return coding["display"]
+    return None
+
+
+def _fhir_description(resource):
+    kind = resource["resourceType"]
+    if kind == "AllergyIntolerance":
+        substance = _fhir_text(resource.get("code"))
+        return f"Allergic to {substance}" if substance else None
+    if kind == "Observation" and resource.get("valueString"):
+        return resource["valueString"]
+    text = _fhir_text(resource.get("code"))
+    notes = [note.get("text") for note in resource.get("note") or [] if note.get("text")]
+    return ". ".join([text] + notes if text else notes) or None
+
+
+def _fhir_timestamp(resource):
+    for field in ("effectiveDateTime", "recordedDate", "onsetDateTime", "performedDateTime", "issued"):
+        if resource.get(field):
+            return resource[field]
+    return None
+
+
+def _fhir_records(resources, patient_ids):
+    """Import records from FHIR resources; patient_ids maps Patient.id to national ID."""
+    for resource in resources:
+        kind = resource.get("resourceType") if isinstance(resource, dict) else None
+        if kind == "Bundle":
+            yield from _fhir_records((entry.get("resource") for entry in resource.get("entry") or []), patient_ids)
+        elif kind == "Patient":
+            identifiers = [i.get("value") for i in resource.get("identifier") or [] if i.get("value")]
+            national_id = identifiers[0] if identifiers else resource.get("id")
+            if resource.get("id"):
+                patient_ids[resource["id"]] = national_id
+            yield "patient", {
+                "national_id": national_id,
+                "name": _fhir_name(resource),
+                "age": _fhir_age(resource),
+                "gender": resource.get("gender"),
+            }
+        elif kind in FHIR_HISTORY_RESOURCES:
+            reference = (resource.get("subject") or resource.get("patient") or {}).get("reference", "")
+            patient_id = reference.rsplit("/", 1)[-1]
+            yield "history", {
+                "national_id": patient_ids.get(patient_id, patient_id),
+                "description": _fhir_description(resource),
+                "timestamp": _fhir_timestamp(resource),
+            }
+        else:
+            yield "skipped", kind or "not a FHIR resource"
+
+
+def _read_fhir(f):
+    patient_ids = {}
+    first = f.readline()
+    try:
+        resource = json.loads(first)
+    except ValueError:
+        # A pretty-printed Bundle rather than NDJSON: it has to be read whole
+        f.seek(0)
+        yield from _fhir_records([json.load(f)], patient_ids)
+        return
+    yield from _fhir_records([resource], patient_ids)
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            resource = json.loads(line)
+        except ValueError:
+            yield "invalid", "malformed JSON line"
+            continue
+        yield from _fhir_records([resource], patient_ids)
+
+
+READERS = {"csv": _read_csv, "jsonl": _read_jsonl, "fhir": _read_fhir}
+
+
+def read_records(path, fmt=None):
+    """Yield (kind, record) pairs from path; kind is patient, history, invalid or skipped."""
+    reader = READERS[fmt or detect_format(path)]
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        yield from reader(f)
+
+
+# ---- validation ----------------------------------------------------------
+
+def _national_id(record):
+    national_id = str(record.get("national_id") or "").strip()
+    if not national_id:
+        raise InvalidRecord("missing national_id")
+    return national_id
+
+
+def clean_patient(record):
+    """(national_id, name, age, gender) for a patient record, or InvalidRecord."""
+    national_id = _national_id(record)
+    name = " ".join(str(record.get("name") or "").split())
+    if not name:
+        raise InvalidRecord("missing name")
+    try:
+        age = int(str(record.get("age")).strip())
+    except ValueError:
+        raise InvalidRecord("invalid age") from None
+    if not 0 <= age <= MAX_AGE:
+        raise InvalidRecord("invalid age")
+    gender = GENDERS.get(str(record.get("gender") or "").strip().lower(), "Other")
+    return national_id, name, age, gender
+
+
+def clean_timestamp(value):
+    """Timestamp in the database's UTC 'YYYY-MM-DD HH:MM:SS' form, or None for now."""
+    if value in (None, ""):
+        return None
+    value = str(value).strip()
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise InvalidRecord("invalid timestamp") from None
+    if _DB_TIMESTAMP.fullmatch(value):
+        return value
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def clean_history(record):
+    """(national_id, description, timestamp) for a history record, or InvalidRecord."""
+    national_id = _national_id(record)
+    description = str(record.get("description") or "").strip()
+    if not description:
+        raise InvalidRecord("empty description")
+    return national_id, description, clean_timestamp(record.get("timestamp"))
+
+
+def _history_keys(national_id, description, timestamp):
+    """Dedupe keys of an entry: (with its timestamp, with the text only).
+
+    Fixed-size digests keep the dedupe set small on large imports.
+    """
+    digest = hashlib.blake2b(f"{national_id}\0{description}\0".encode("utf-8"), digest_size=16)
+    undated = digest.digest()
+    if timestamp is None:
+        return None, undated
+    digest.update(timestamp.encode("utf-8"))
+    return digest.digest(), undated
+
+
+# ---- import --------------------------------------------------------------
+
+class ImportStats:
+    """Counts of what an import did, with progress lines as chunks land."""
+
+    def __init__(self):
+        self.rows = self.patients = self.history = 0
+        self.duplicates = Counter()
+        self.invalid = Counter()
+        self.skipped = Counter()
+        self.started = time.monotonic()
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed else 0.0
+
+    def report(self):
+        print(f"📥 {self.rows:,} rows: {self.patients:,} patients, {self.history:,} history entries, "
+              f"{sum(self.duplicates.values()):,} duplicates, {sum(self.invalid.values()):,} invalid "
+              f"({self.rows_per_second:,.0f} rows/s)", flush=True)
+
+
+class _Importer:
+    """Validates records and writes them in chunks; see import_file()."""
+
+    def __init__(self, chunk_size, stats, history_in_db):
+        self.chunk_size = chunk_size
+        self.stats = stats
+        self.history_in_db = history_in_db
+        self.patients, self.history = [], []
+        self.seen_patients = set()
+        self.known_ids = set()      # national IDs with a patient record
+        self.stored_ids = set()     # national IDs that had a patient record before the import
+        self.checked_ids = set()    # national IDs whose stored history is in seen_history
+        self.seen_history = set()
+
+    def add(self, kind, record):
+        self.stats.rows += 1
+        if kind in ("invalid", "skipped"):
+            getattr(self.stats, kind)[record] += 1
+            return
+        try:
+            row = clean_patient(record) if kind == "patient" else clean_history(record)
+        except InvalidRecord as e:
+            self.stats.invalid[f"{kind}: {e}"] += 1
+            return
+        if kind == "patient":
+            if row[0] in self.seen_patients:
+                self.stats.duplicates["patient"] += 1
+                return
+            self.seen_patients.add(row[0])
+            self.patients.append(row)
+        else:
+            self.history.append(row)
+        if len(self.patients) + len(self.history) >= self.chunk_size:
+            self.flush()
+
+    def _dedupe_history(self):
+        """Drop history rows of unknown patients and entries already stored or seen."""
+        if self.history_in_db:
+            unchecked = {row[0] for row in self.history} & self.stored_ids - self.checked_ids
+            for stored in get_history_keys(unchecked):
+                self.seen_history.update(_history_keys(*stored))
+            self.checked_ids |= unchecked
+
+        rows = []
+        for row in self.history:
+            if row[0] not in self.known_ids:
+                self.stats.invalid["history: unknown patient"] += 1
+                continue
+            # Undated entries match any stored entry with the same text
+            dated, undated = _history_keys(*row)
+            if (dated or undated) in self.seen_history:
+                self.stats.duplicates["history"] += 1
+                continue
+            self.seen_history.add(undated)
+            if dated is not None:
+                self.seen_history.add(dated)
+            rows.append(row)
+        return rows
+
+    def flush(self):
+        if not (self.patients or self.history):
+            return
+        lookup = ({row[0] for row in self.patients} | {row[0] for row in self.history}) - self.known_ids
+        existing = existing_patient_ids(lookup)
+        self.known_ids |= existing
+        self.stored_ids |= existing
+
+        patients = [row for row in self.patients if row[0] not in existing]
+        if len(patients) < len(self.patients):
+            self.stats.duplicates["patient"] += len(self.patients) - len(patients)
+        self.known_ids.update(row[0] for row in patients)
+        history = self._dedupe_history()
+
+        self.stats.patients += bulk_insert(patients, history)
+        self.stats.history += len(history)
+        self.patients, self.history = [], []
+        self.stats.report()
+
+
+def import_records(records, chunk_size=CHUNK_SIZE, defer_indexes=True):
+    """Import (kind, record) pairs as yielded by read_records(); return ImportStats.
+
+    Existing patients are never overwritten. A history entry is skipped if
+    the patient already has one with the same description and timestamp
+    (or the same description, when the entry has no timestamp).
+    """
+    init_database()
+    stats = ImportStats()
+    history_in_db = has_medical_history()
+    importer = _Importer(chunk_size, stats, history_in_db)
+    # The history index is only needed mid-import to dedupe against stored rows
+    deferred = defer_history_indexes(keep_history_index=history_in_db) if defer_indexes else None
+    try:
+        for kind, record in records:
+            importer.add(kind, record)
+        importer.flush()
+    finally:
+        if deferred is not None:
+            started = time.monotonic()
+            restore_history_indexes(deferred)
+            print(f"🗂️ Rebuilt indexes in {time.monotonic() - started:.1f}s")
+    return stats
+
+
+def import_file(path, fmt=None, chunk_size=CHUNK_SIZE, defer_indexes=True):
+    """Import a CSV, JSONL or FHIR file into the database; return ImportStats."""
+    return import_records(read_records(path, fmt), chunk_size, defer_indexes)
+
+
+# ---- export --------------------------------------------------------------
+
+def _iso(timestamp):
+    return str(timestamp).replace(" ", "T") + "Z" if timestamp else None
+
+
+def _write_csv(f, patients):
+    writer = csv.writer(f)
+    writer.writerow(CSV_COLUMNS)
+    for national_id, name, age, gender, history in patients:
+        if not history:
+            writer.writerow((national_id, name, age, gender, "", ""))
+        for description, timestamp in history:
+            writer.writerow((national_id, name, age, gender, description, timestamp))
+        yield len(history)
+
+
+def _write_jsonl(f, patients):
+    for national_id, name, age, gender, history in patients:
+        record = {
+            "national_id": national_id, "name": name, "age": age, "gender": gender,
+            "history": [{"description": d, "timestamp": t} for d, t in history],
+        }
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        yield len(history)
+
+
+def fhir_resources(national_id, name, age, gender, history):
+    """FHIR Patient and Observation resources for one exported patient."""
+    yield {
+        "resourceType": "Patient",
+        "id": national_id,
+        "identifier": [{"value": national_id}],
+        "name": [{"text": name}],
+        "gender": gender.lower() if gender in ("Male", "Female") else "other",
+        "extension": [{"url": AGE_EXTENSION, "valueInteger": age}],
+    }
+    for number, (description, timestamp) in enumerate(history, 1):
+        yield {
+            "resourceType": "Observation",
+            "id": f"{national_id}-{number}",
+            "status": "final",
+            "code": {"text": "Medical history entry"},
+            "subject": {"reference": f"Patient/{national_id}"},
+            "effectiveDateTime": _iso(timestamp),
+            "valueString": description,
+        }
+
+
+def _write_fhir(f, patients):
+    for patient in patients:
+        for resource in fhir_resources(*patient):
+            f.write(json.dumps(resource, ensure_ascii=False) + "\n")
+        yield len(patient[4])
+
+
+WRITERS = {"csv": _write_csv, "jsonl": _write_jsonl, "fhir": _write_fhir}
+
+
+def export_file(path, fmt=None):
+    """Stream every patient and their history to path; return (patients, history entries).
+
+    FHIR is written as NDJSON, one resource per line.
+    """
+    writer = WRITERS[fmt or detect_format(path)]
+    patients = entries = 0
+    started = time.monotonic()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for count in writer(f, iter_patients_with_history()):
+            patients += 1
+            entries += count
+            if patients % 10000 == 0:
+                print(f"📤 {patients:,} patients exported", flush=True)
+    elapsed = time.monotonic() - started
+    rate = (patients + entries) / elapsed if elapsed else 0.0
+    print(f"✅ Exported {patients:,} patients and {entries:,} history entries to {path} ({rate:,.0f} rows/s)")
+    return patients, entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export of patients and medical history")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="load a CSV, JSONL or FHIR file")
+    importer.add_argument("input")
+    importer.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    importer.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per transaction")
+    importer.add_argument("--no-defer-indexes", action="store_true",
+                          help="maintain indexes row by row (safe while the app is writing)")
+
+    exporter = commands.add_parser("export", help="write every patient and their history")
+    exporter.add_argument("output")
+    exporter.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        stats = import_file(args.input, args.format, args.chunk_size, not args.no_defer_indexes)
+        elapsed = time.monotonic() - stats.started
+        print(f"✅ Imported {stats.patients:,} patients and {stats.history:,} history entries "
+              f"from {stats.rows:,} rows in {elapsed:.1f}s ({stats.rows_per_second:,.0f} rows/s)")
+        for label, counts in (("Duplicates", stats.duplicates), ("Invalid", stats.invalid),
+                              ("Skipped", stats.skipped)):
+            for reason, count in counts.most_common():
+                print(f"   {label}: {reason}: {count:,}")
+        sys.exit(1 if stats.invalid else 0)
+    else:
+        init_database()
+        export_file(args.output, args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Deterministic stand-in for the OpenRouter LLM
+
+Answers each agent's task prompt with plausible canned output built from
+the prompt itself (patient fields, history lines, upstream JSON), in the
+ReAct format CrewAI expects. Agent 2 makes a real call to its history
+tool first, the way a live model would. Used for tests and load runs
+without network access: set LLM_MODE=fake. When a run streams, the answer
+is emitted in small chunks spread over the configured delay.
+"""
+
+import asyncio
+import json
+import re
+import time
+
+from crewai.llms.base_llm import BaseLLM, llm_call_context
+
+HISTORY_TOOL_NAME = "get_patient_history_tool"
+
+# Characters per streamed chunk
+CHUNK_CHARS = 4
+
+# Markers that identify which task a prompt belongs to
+EXTRACTION_MARKER = "PATIENT DATA EXTRACTION TASK"
+HISTORY_MARKER = "MEDICAL HISTORY PROCESSING TASK"
+EVALUATION_MARKER = "SYMPTOM EVALUATION TASK"
+REPORT_MARKER = "REPORT GENERATION TASK"
+
+# Text the history tool returns; its presence means the tool already ran
+TOOL_RESULT_MARKERS = ("Medical History:", "No medical history found", "Error retrieving history")
+
+# Keyword -> chronic condition
+CHRONIC_KEYWORDS = {
+    "blood pressure": "Hypertension",
+    "hypertension": "Hypertension",
+    "diabetes": "Diabetes mellitus",
+    "asthma": "Asthma",
+    "copd": "Chronic obstructive pulmonary disease",
+    "kidney": "Chronic kidney disease",
+    "thyroid": "Thyroid disorder",
+}
+
+_ALLERGY = re.compile(r"allerg(?:y|ic|ies)\s+(?:to\s+)?([A-Za-z][A-Za-z\- ]+?)(?=[.,;)\n]|$)", re.IGNORECASE)
+_HISTORY_LINE = re.compile(r"^\s*\d+\.\s+(.*?)\s+\(Date:\s*([^)]*)\)\s*$", re.MULTILINE)
+_SYMPTOM_SPLIT = re.compile(r",|;|\band\b|\bwith\b|\n", re.IGNORECASE)
+
+
+def prompt_text(messages):
+    """Flatten chat messages into one string."""
+    if isinstance(messages, str):
+        return messages
+    return "\n".join(str(message.get("content") or "") for message in messages)
+
+
+def _json_objects(text):
+    """Every parseable JSON object embedded in text, in order."""
+    decoder = json.JSONDecoder()
+    objects, index = [], text.find("{")
+    while index != -1:
+        try:
+            value, end = decoder.raw_decode(text, index)
+        except ValueError:
+            index = text.find("{", index + 1)
+            continue
+        if isinstance(value, dict):
+            objects.append(value)
+        index = text.find("{", end)
+    return objects
+
+
+def _last_object_with(text, key):
+    for value in reversed(_json_objects(text)):
+        if key in value:
+            return value
+    return {}
+
+
+def _field(text, label, default=""):
+    match = re.search(rf"-\s*{label}:\s*\"?(.*?)\"?\s*$", text, re.MULTILINE)
+    return match.group(1).strip() if match else default
+
+
+def _extract_patient(prompt):
+    symptoms = [s.strip(" .").capitalize() for s in _SYMPTOM_SPLIT.split(_field(prompt, "Symptoms"))]
+    age = _field(prompt, "Age", "0")
+    return {
+        "name": _field(prompt, "Name"),
+        "age": int(age) if age.isdigit() else 0,
+        "gender": _field(prompt, "Gender"),
+        "symptoms": [s for s in symptoms if s],
+    }
+
+
+def _agent1_output(prompt):
+    """Agent 1's JSON in the prompt, not the history tool's Action Input (which has a national_id)."""
+    for value in reversed(_json_objects(prompt)):
+        if "symptoms" in value and "national_id" not in value:
+            return value
+    return {}
+
+
+def _medical_history(prompt):
+    patient = _agent1_output(prompt)
+    entries = [{"date": date[:10], "description": description}
+               for description, date in _HISTORY_LINE.findall(prompt)]
+    text = " ".join(entry["description"] for entry in entries).lower()
+    chronic = sorted({condition for keyword, condition in CHRONIC_KEYWORDS.items() if keyword in text})
+    allergies = sorted({match.strip().capitalize() for match in _ALLERGY.findall(text)})
+    return {
+        "patient_info": {
+            "name": patient.get("name", ""),
+            "age": patient.get("age", 0),
+            "gender": patient.get("gender", ""),
+            "current_symptoms": patient.get("symptoms", []),
+        },
+        "medical_history": entries,
+        "chronic_conditions": chronic,
+        "allergies": allergies,
+    }
+
+
+def _evaluation(prompt):
+    profile = _last_object_with(prompt, "patient_info")
+    info = profile.get("patient_info", {})
+    symptoms = info.get("current_symptoms", [])
+    chronic = profile.get("chronic_conditions", [])
+    allergies = profile.get("allergies", [])
+    severity = "high" if len(symptoms) >= 4 else "moderate" if len(symptoms) >= 2 else "low"
+    return {
+        "patient_summary": {
+            "name": info.get("name", ""),
+            "age": info.get("age", 0),
+            "gender": info.get("gender", ""),
+            "current_symptoms": symptoms,
+            "medical_history_summary": [entry.get("description", "") for entry in profile.get("medical_history", [])][:5],
+        },
+        "clinical_assessment": {
+            "symptom_analysis": f"Patient presents with {', '.join(symptoms).lower() or 'no reported symptoms'}.",
+            "potential_diagnoses": [f"{symptom}-related condition" for symptom in symptoms[:3]],
+            "risk_factors": chronic,
+            "severity_assessment": severity,
+            "urgency_level": {"high": "urgent", "moderate": "routine", "low": "routine"}[severity],
+        },
+        "recommendations": {
+            "immediate_actions": ["Vital signs check"],
+            "follow_up_care": ["Review in 2 weeks"],
+            "additional_tests": ["Complete blood count"],
+            "precautions": [f"Avoid {allergy}" for allergy in allergies],
+        },
+    }
+
+
+def _report(prompt):
+    summary = _last_object_with(prompt, "clinical_assessment")
+    try:
+        from ReportRenderer import render_report
+        return render_report(summary)
+    except ValueError:
+        return "<html><body><h1>Medical Report</h1><p>No assessment available.</p></body></html>"
+
+
+def canned_answer(prompt):
+    """The final answer text a model would give for this task prompt."""
+    if EXTRACTION_MARKER in prompt:
+        return json.dumps(_extract_patient(prompt))
+    if HISTORY_MARKER in prompt:
+        return json.dumps(_medical_history(prompt))
+    if EVALUATION_MARKER in prompt:
+        return json.dumps(_evaluation(prompt))
+    if REPORT_MARKER in prompt:
+        return _report(prompt)
+    return "{}"
+
+
+def fake_completion(prompt):
+    """Full ReAct-formatted completion for prompt, calling the history tool when needed."""
+    if (HISTORY_MARKER in prompt and HISTORY_TOOL_NAME in prompt
+            and not any(marker in prompt for marker in TOOL_RESULT_MARKERS)):
+        national_id = re.search(r'national ID:\s*"([^"]*)"', prompt, re.IGNORECASE)
+        symptoms = _agent1_output(prompt).get("symptoms") or []
+        tool_input = json.dumps({"national_id": national_id.group(1) if national_id else "",
+                                 "symptoms": ", ".join(map(str, symptoms))})
+        return (f"Thought: I need the patient's medical history.\n"
+                f"Action: {HISTORY_TOOL_NAME}\nAction Input: {tool_input}")
+    return f"Thought: I now can give a great answer\nFinal Answer: {canned_answer(prompt)}"
+
+
+class FakeLLM(BaseLLM):
+    """Offline LLM returning fake_completion() after an optional delay."""
+
+    latency: float = 0.0
+
+    def _chunks(self, text):
+        return [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)] or [""]
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        text = fake_completion(prompt_text(messages))
+        if not self._effective_stream():
+            if self.latency:
+                time.sleep(self.latency)
+            return text
+        chunks = self._chunks(text)
+        with llm_call_context():
+            for chunk in chunks:
+                if self.latency:
+                    time.sleep(self.latency / len(chunks))
+                self._emit_stream_chunk_event(chunk, from_task=kwargs.get("from_task"),
+                                              from_agent=kwargs.get("from_agent"))
+        return text
+
+    async def acall(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        text = fake_completion(prompt_text(messages))
+        if not self._effective_stream():
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return text
+        chunks = self._chunks(text)
+        with llm_call_context():
+            for chunk in chunks:
+                if self.latency:
+                    await asyncio.sleep(self.latency / len(chunks))
+                self._emit_stream_chunk_event(chunk, from_task=kwargs.get("from_task"),
+                                              from_agent=kwargs.get("from_agent"))
+        return text
+
+    def supports_function_calling(self):
+        return False
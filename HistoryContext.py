@@ -0,0 +1,218 @@
+"""
+Bounded medical history context for the agents
+
+Agent 2 reads the patient's medical history, and its output carries it on to
+Agents 3 and 4, so a record with hundreds of entries would make every prompt
+grow with it. build_history_context() keeps the text within
+HISTORY_TOKEN_BUDGET however long the record is:
+
+- The newest HISTORY_WINDOW entries are read page by page and scored by
+  recency and relevance (allergies, chronic conditions, the current
+  symptoms). The best HISTORY_MAX_ENTRIES that fit the budget are listed
+  verbatim, newest first, in the "N. description (Date: ...)" lines Agent 2
+  expects.
+- Everything older is folded into a rolling summary: conditions, allergies,
+  date range and the latest notes. It is stored in the history_summaries
+  table and extended incrementally as entries age out of the window, so
+  each entry is summarized once.
+"""
+
+import asyncio
+import json
+import os
+import re
+
+from db import (
+    count_medical_history,
+    count_medical_history_through,
+    get_medical_history_page,
+    get_history_summary,
+    save_history_summary
+)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1500))
+HISTORY_MAX_ENTRIES = int(os.getenv("HISTORY_MAX_ENTRIES", 20))
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", 50))
+
+NO_HISTORY = "No medical history found for this patient."
+PAGE_SIZE = 25
+CHARS_PER_TOKEN = 4
+ENTRY_MAX_CHARS = 300
+SUMMARY_NOTES = 8
+NOTE_MAX_CHARS = 120
+SUMMARY_MAX_ALLERGIES = 15
+
+# Phrases in history notes -> the chronic condition they record
+CONDITION_KEYWORDS = {
+    "blood pressure": "Hypertension",
+    "hypertension": "Hypertension",
+    "diabetes": "Diabetes mellitus",
+    "asthma": "Asthma",
+    "copd": "Chronic obstructive pulmonary disease",
+    "kidney": "Chronic kidney disease",
+    "thyroid": "Thyroid disorder",
+    "heart failure": "Heart failure",
+    "atrial fibrillation": "Atrial fibrillation",
+    "coronary": "Coronary artery disease",
+    "epilepsy": "Epilepsy",
+    "cancer": "Cancer",
+    "arthritis": "Arthritis",
+    "depression": "Depression",
+    "cholesterol": "Hyperlipidemia",
+    "stroke": "Stroke",
+}
+
+_ALLERGY = re.compile(r"allerg(?:y|ic|ies)\s+(?:to\s+)?([A-Za-z][A-Za-z\- ]+?)(?=[.,;)\n]|$)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+_WORD = re.compile(r"[a-z]{4,}")
+
+
+def estimate_tokens(text):
+    """Rough token count of text (about four characters per token)."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _clean(description, limit):
+    text = _WHITESPACE.sub(" ", str(description)).strip()
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def _conditions(text):
+    text = text.lower()
+    return {condition for keyword, condition in CONDITION_KEYWORDS.items() if keyword in text}
+
+
+def _allergies(text):
+    return {match.strip().capitalize() for match in _ALLERGY.findall(text)}
+
+
+def _entry_line(number, description, timestamp):
+    return f"{number}. {_clean(description, ENTRY_MAX_CHARS)} (Date: {timestamp})"
+
+
+def _read_rows(national_id, offset, count):
+    """`count` history rows starting `offset` entries from the newest, read a page at a time."""
+    rows = get_medical_history_page(national_id, min(PAGE_SIZE, count), offset)
+    while rows and len(rows) < count:
+        last_id, _, last_timestamp = rows[-1]
+        page = get_medical_history_page(national_id, min(PAGE_SIZE, count - len(rows)),
+                                        before=(last_timestamp, last_id))
+        if not page:
+            break
+        rows.extend(page)
+    return rows
+
+
+def _fold(summary, rows):
+    """Add rows (newest first, all newer than what summary covers) to the summary."""
+    conditions, allergies = set(summary["conditions"]), set(summary["allergies"])
+    notes = summary["notes"]
+    for _, description, timestamp in reversed(rows):
+        date = str(timestamp)[:10]
+        summary["entries"] += 1
+        summary["first_date"] = summary["first_date"] or date
+        summary["last_date"] = date
+        conditions |= _conditions(description)
+        allergies |= _allergies(description)
+        note = _clean(description, NOTE_MAX_CHARS)
+        # Repeated notes ("routine check") keep only their latest date
+        notes = ([[date, note]] + [n for n in notes if n[1] != note])[:SUMMARY_NOTES]
+    summary["conditions"] = sorted(conditions)
+    summary["allergies"] = sorted(allergies)[:SUMMARY_MAX_ALLERGIES]
+    summary["notes"] = notes
+    return summary
+
+
+def rolling_summary(national_id, total, window=HISTORY_WINDOW):
+    """Summary of all but the newest `window` entries, or None if there are none.
+
+    The stored summary is reused while it still covers exactly the oldest
+    entries; only entries that aged out of the window since are folded in.
+    """
+    older = total - window
+    if older <= 0:
+        return None
+
+    summary = {"entries": 0, "first_date": None, "last_date": None,
+               "conditions": [], "allergies": [], "notes": []}
+    covered = 0
+    stored = get_history_summary(national_id)
+    if stored is not None:
+        text, count, last_timestamp, last_id = stored
+        # Entries back-dated before the marker would leave a hole; rebuild then
+        if count <= older and count_medical_history_through(national_id, last_timestamp, last_id) == count:
+            summary, covered = json.loads(text), count
+
+    if covered < older:
+        rows = _read_rows(national_id, window, older - covered)
+        if rows:
+            summary = _fold(summary, rows)
+            newest_id, _, newest_timestamp = rows[0]
+            save_history_summary(national_id, json.dumps(summary), covered + len(rows),
+                                 newest_timestamp, newest_id)
+    return summary
+
+
+def _summary_text(summary):
+    lines = [f"Earlier history ({summary['entries']} entries, "
+             f"{summary['first_date']} to {summary['last_date']}), summarized:"]
+    if summary["conditions"]:
+        lines.append(f"- Conditions recorded: {', '.join(summary['conditions'])}")
+    if summary["allergies"]:
+        lines.append(f"- Allergies recorded: {', '.join(summary['allergies'])}")
+    if summary["notes"]:
+        lines.append("- Latest earlier notes:")
+        lines.extend(f"  - {date}: {note}" for date, note in summary["notes"])
+    return "\n".join(lines)
+
+
+def _relevance(description, rank, symptom_words):
+    """Score of an entry: recency plus bonuses for what the agents must not miss."""
+    text = description.lower()
+    score = 1.0 / (1 + rank)
+    if _ALLERGY.search(text):
+        score += 2.0
+    if _conditions(text):
+        score += 1.0
+    if symptom_words and symptom_words & set(_WORD.findall(text)):
+        score += 1.0
+    return score
+
+
+def build_history_context(national_id, symptoms=None, budget=HISTORY_TOKEN_BUDGET,
+                          max_entries=HISTORY_MAX_ENTRIES, window=HISTORY_WINDOW):
+    """Plain-text medical history for Agent 2, bounded to about `budget` tokens."""
+    total = count_medical_history(national_id)
+    if total == 0:
+        return NO_HISTORY
+
+    rows = _read_rows(national_id, 0, min(window, total))
+    summary = rolling_summary(national_id, total, window)
+    summary_text = _summary_text(summary) if summary else ""
+
+    symptom_words = set(_WORD.findall(str(symptoms or "").lower()))
+    remaining = budget * CHARS_PER_TOKEN - len(summary_text)
+    ranked = sorted(range(len(rows)), key=lambda i: _relevance(rows[i][1], i, symptom_words), reverse=True)
+    chosen, seen = [], set()
+    for i in ranked:
+        if len(chosen) >= max_entries:
+            break
+        description = _clean(rows[i][1], ENTRY_MAX_CHARS)
+        size = len(_entry_line(len(chosen) + 1, rows[i][1], rows[i][2])) + 1
+        # An identical note adds nothing the newest copy does not already say
+        if description not in seen and size <= remaining:
+            chosen.append(i)
+            seen.add(description)
+            remaining -= size
+
+    lines = ["Medical History:"]
+    lines.extend(_entry_line(n, rows[i][1], rows[i][2]) for n, i in enumerate(sorted(chosen), 1))
+    if len(chosen) < len(rows):
+        lines.append(f"({len(rows) - len(chosen)} less relevant recent entries omitted)")
+    if summary_text:
+        lines.extend(["", summary_text])
+    return "\n".join(lines) + "\n"
+
+
+async def build_history_context_async(national_id, symptoms=None):
+    return await asyncio.to_thread(build_history_context, national_id, symptoms)
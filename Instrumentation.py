@@ -0,0 +1,136 @@
+"""
+CrewAI-side instrumentation feeding Metrics
+
+InstrumentedLLM wraps the LLM every agent uses and times each call per
+agent, along with an estimate of its input tokens (every call, so prompt
+size per stage can be tracked offline too). Token usage as counted by the
+provider, prompt-cache reads and time to first token come from the
+provider events CrewAI publishes on its event bus (LLM call started /
+first stream chunk / completed), so they are only recorded for real
+provider calls, never for cache hits or the FakeLLM.
+"""
+
+import threading
+import time
+from typing import Any
+
+from crewai.events import crewai_event_bus
+from crewai.events.types.llm_events import (
+    LLMCallCompletedEvent,
+    LLMCallFailedEvent,
+    LLMCallStartedEvent,
+    LLMStreamChunkEvent,
+)
+from crewai.llms.base_llm import BaseLLM, call_stop_override
+
+from HistoryContext import estimate_tokens
+from Metrics import observe_llm_call, observe_llm_usage
+
+
+def _agent_role(kwargs):
+    agent = kwargs.get("from_agent")
+    return getattr(agent, "role", None) or "unknown"
+
+
+def _prompt_tokens(messages):
+    """Estimated input tokens of a call's messages."""
+    if isinstance(messages, str):
+        return estimate_tokens(messages)
+    return sum(estimate_tokens(str(message.get("content") or "")) for message in messages)
+
+
+class InstrumentedLLM(BaseLLM):
+    """Wraps an LLM and records the latency and outcome of every call."""
+
+    llm: Any = None
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        started = time.perf_counter()
+        ok = False
+        try:
+            # CrewAI scopes the executor's stop words to this wrapper; pass them on
+            with call_stop_override(self.llm, self.stop_sequences):
+                response = self.llm.call(messages, tools, callbacks, available_functions, **kwargs)
+            ok = True
+            return response
+        finally:
+            observe_llm_call(_agent_role(kwargs), time.perf_counter() - started, ok,
+                             _prompt_tokens(messages))
+
+    async def acall(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        started = time.perf_counter()
+        ok = False
+        try:
+            with call_stop_override(self.llm, self.stop_sequences):
+                response = await self.llm.acall(messages, tools, callbacks, available_functions, **kwargs)
+            ok = True
+            return response
+        finally:
+            observe_llm_call(_agent_role(kwargs), time.perf_counter() - started, ok,
+                             _prompt_tokens(messages))
+
+    def supports_function_calling(self):
+        return self.llm.supports_function_calling()
+
+    def supports_stop_words(self):
+        return self.llm.supports_stop_words()
+
+    def get_context_window_size(self):
+        return self.llm.get_context_window_size()
+
+
+# call_id -> [started_at, first_token_at] for provider calls in flight
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+def _on_llm_started(source, event):
+    with _calls_lock:
+        _calls[event.call_id] = [event.timestamp, None]
+
+
+def _on_llm_chunk(source, event):
+    with _calls_lock:
+        call = _calls.get(event.call_id)
+        if call is not None and call[1] is None:
+            call[1] = event.timestamp
+
+
+def _on_llm_completed(source, event):
+    with _calls_lock:
+        call = _calls.pop(event.call_id, None)
+    ttft = None
+    if call is not None:
+        # Without streaming the first token arrives with the whole response
+        ttft = ((call[1] or event.timestamp) - call[0]).total_seconds()
+    usage = event.usage or {}
+    observe_llm_usage(
+        event.agent_role or "unknown",
+        event.model,
+        int(usage.get("prompt_tokens") or 0),
+        int(usage.get("completion_tokens") or 0),
+        ttft,
+        cached_tokens=int(usage.get("cached_prompt_tokens") or 0)
+    )
+
+
+def _on_llm_failed(source, event):
+    with _calls_lock:
+        _calls.pop(event.call_id, None)
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install_event_handlers():
+    """Subscribe the usage/TTFT handlers to CrewAI's event bus (once per process)."""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        crewai_event_bus.register_handler(LLMCallStartedEvent, _on_llm_started)
+        crewai_event_bus.register_handler(LLMStreamChunkEvent, _on_llm_chunk)
+        crewai_event_bus.register_handler(LLMCallCompletedEvent, _on_llm_completed)
+        crewai_event_bus.register_handler(LLMCallFailedEvent, _on_llm_failed)
+        _installed = True
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Background job queue for medical analyses
+
+Analyses are queued in the `jobs` table and executed by a pool of worker
+processes, so the Streamlit session only submits and polls. Job state
+lives in SQLite and survives restarts: a worker that dies mid-job stops
+heart-beating and its job is requeued by the next worker that starts.
+
+Usage:
+    python Jobs.py worker --workers 4 [--fake-llm]
+    python Jobs.py submit --name "Jane Doe" --age 40 --gender Female --national-id 123 --symptoms "cough"
+    python Jobs.py status 17
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+from db import get_db_connection, migrate_database
+from Metrics import start_metrics_server, METRICS_PORT
+from Priorities import PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from Workspace import RunWorkspace, new_run_id
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_SECONDS", 10))
+# A running job without a heartbeat for this long is considered orphaned
+STALE_AFTER = float(os.getenv("JOB_STALE_SECONDS", 60))
+POLL_INTERVAL = float(os.getenv("JOB_POLL_SECONDS", 1))
+
+JOB_COLUMNS = ("id", "status", "priority", "payload", "result", "error", "attempts",
+               "worker", "created_at", "started_at", "finished_at")
+
+
+def _row_to_job(row):
+    job = dict(zip(JOB_COLUMNS, row))
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def submit_job(patient_name, patient_age, patient_gender, symptoms, national_id,
+               mode=None, report_mode=None, priority=PRIORITY_INTERACTIVE):
+    """Queue an analysis and return its job ID."""
+    payload = {
+        "patient_name": patient_name,
+        "patient_age": patient_age,
+        "patient_gender": patient_gender,
+        "symptoms": symptoms,
+        "national_id": str(national_id),
+        "mode": mode,
+        "report_mode": report_mode,
+        "run_id": new_run_id(),
+    }
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute(
+            "INSERT INTO jobs (payload, priority) VALUES (?, ?)",
+            (json.dumps(payload), priority)
+        )
+    return cursor.lastrowid
+
+
+def get_job(job_id):
+    """Return the job as a dict, or None if it does not exist."""
+    row = get_db_connection().execute(
+        f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def claim_job(worker_id):
+    """Atomically move the next queued job to running and return it (or None)."""
+    conn = get_db_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE status = 'queued' ORDER BY priority DESC, id LIMIT 1"
+        ).fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+            "started_at = CURRENT_TIMESTAMP, heartbeat_at = ? WHERE id = ?",
+            (worker_id, time.time(), row[0])
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return get_job(row[0])
+
+
+# Updates by the worker running a job only apply while it still holds the
+# job: once requeue_stale_jobs() has taken it back, a slow worker's late
+# heartbeat, result or failure is ignored (they return False)
+def heartbeat(job_id, worker_id):
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time(), job_id, worker_id)
+        )
+    return cursor.rowcount > 0
+
+
+def complete_job(job_id, worker_id, result):
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'succeeded', result = ?, error = NULL, "
+            "finished_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running' AND worker = ?",
+            (json.dumps(result), job_id, worker_id)
+        )
+    return cursor.rowcount > 0
+
+
+def fail_job(job_id, worker_id, error):
+    """Record a failure; the job is requeued until it has used MAX_ATTEMPTS."""
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET error = ?, "
+            "status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, "
+            "finished_at = CASE WHEN attempts < ? THEN NULL ELSE CURRENT_TIMESTAMP END "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (error, MAX_ATTEMPTS, MAX_ATTEMPTS, job_id, worker_id)
+        )
+    return cursor.rowcount > 0
+
+
+def requeue_stale_jobs(stale_after=STALE_AFTER):
+    """Requeue running jobs whose worker stopped heart-beating; return how many."""
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, "
+            "finished_at = CASE WHEN attempts < ? THEN NULL ELSE CURRENT_TIMESTAMP END, "
+            "error = 'Worker stopped responding' "
+            "WHERE status = 'running' AND heartbeat_at < ?",
+            (MAX_ATTEMPTS, MAX_ATTEMPTS, time.time() - stale_after)
+        )
+    return cursor.rowcount
+
+
+def queue_counts():
+    """Number of jobs per status."""
+    rows = get_db_connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+    counts = dict.fromkeys(JOB_STATUSES, 0)
+    counts.update(rows)
+    return counts
+
+
+def execute_job(job):
+    """Run one claimed job, keeping its heartbeat fresh while the crew works."""
+    # Imported here so submitting/polling never loads CrewAI
+    from Pipeline import run_medical_analysis, DEFAULT_PIPELINE_MODE, DEFAULT_REPORT_MODE
+    from LLMScheduler import llm_priority
+
+    payload = job["payload"]
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(HEARTBEAT_INTERVAL):
+            heartbeat(job["id"], job["worker"])
+
+    beater = threading.Thread(target=beat, daemon=True)
+    beater.start()
+    try:
+        workspace = RunWorkspace(payload["run_id"])
+        with llm_priority(job["priority"]):
+            run_medical_analysis(
+                payload["patient_name"],
+                payload["patient_age"],
+                payload["patient_gender"],
+                payload["symptoms"],
+                payload["national_id"],
+                mode=payload.get("mode") or DEFAULT_PIPELINE_MODE,
+                report_mode=payload.get("report_mode") or DEFAULT_REPORT_MODE,
+                workspace=workspace
+            )
+        recorded = complete_job(job["id"], job["worker"],
+                                {"run_id": workspace.run_id, "report_path": workspace.report_path})
+    except Exception as e:
+        recorded = fail_job(job["id"], job["worker"], f"{type(e).__name__}: {e}")
+    finally:
+        done.set()
+    if not recorded:
+        print(f"⚠️ Job {job['id']} was requeued while it ran; its outcome here was discarded")
+    return recorded
+
+
+def run_worker(worker_id=None, poll_interval=POLL_INTERVAL, max_jobs=None, metrics_port=0):
+    """Claim and execute jobs until interrupted (or max_jobs have run)."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    migrate_database()
+    start_metrics_server(metrics_port)
+    # Load CrewAI and build the agents while polling rather than on the first job
+    from Agents import agent_registry
+    agent_registry.warm_in_background()
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        requeue_stale_jobs()
+        job = claim_job(worker_id)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        print(f"🔧 [{worker_id}] running job {job['id']}")
+        execute_job(job)
+        processed += 1
+
+
+def start_workers(count, poll_interval=POLL_INTERVAL, metrics_port=METRICS_PORT):
+    """Start `count` worker processes and return them.
+
+    With metrics_port set, worker i serves its metrics on metrics_port + i.
+    """
+    # spawn, not fork: children must not inherit the parent's SQLite connections
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for i in range(count):
+        process = context.Process(target=run_worker, kwargs={
+            "poll_interval": poll_interval,
+            "metrics_port": metrics_port + i if metrics_port else 0,
+        })
+        process.start()
+        workers.append(process)
+    return workers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Background job queue for medical analyses")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    worker = commands.add_parser("worker", help="run a pool of worker processes")
+    worker.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    worker.add_argument("--poll", type=float, default=POLL_INTERVAL)
+    worker.add_argument("--fake-llm", action="store_true", help="use the offline FakeLLM")
+    worker.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="serve /metrics from worker i on this port + i (0 = off)")
+
+    submit = commands.add_parser("submit", help="queue one analysis")
+    submit.add_argument("--name", required=True)
+    submit.add_argument("--age", type=int, required=True)
+    submit.add_argument("--gender", required=True)
+    submit.add_argument("--national-id", required=True)
+    submit.add_argument("--symptoms", required=True)
+    submit.add_argument("--priority", type=int, default=PRIORITY_BATCH)
+
+    status = commands.add_parser("status", help="show a job, or queue counts")
+    status.add_argument("job_id", type=int, nargs="?")
+
+    args = parser.parse_args()
+    migrate_database()
+
+    if args.command == "worker":
+        if args.fake_llm:
+            os.environ["LLM_MODE"] = "fake"  # inherited by the spawned workers
+        workers = start_workers(args.workers, args.poll, args.metrics_port)
+        print(f"🚀 Started {len(workers)} workers (Ctrl+C to stop)")
+        try:
+            for process in workers:
+                process.join()
+        except KeyboardInterrupt:
+            for process in workers:
+                process.terminate()
+    elif args.command == "submit":
+        job_id = submit_job(args.name, args.age, args.gender, args.symptoms, args.national_id,
+                            priority=args.priority)
+        print(f"✅ Queued job {job_id}")
+    elif args.job_id is not None:
+        print(json.dumps(get_job(args.job_id), indent=2))
+    else:
+        print(json.dumps(queue_counts(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
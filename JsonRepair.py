@@ -0,0 +1,175 @@
+"""
+Local repair of almost-JSON agent output
+
+Models asked for "only JSON" still wrap it in markdown fences, prefix it
+with a sentence, leave trailing commas, write Python literals or stop
+before the closing brackets. repair_json() fixes those cases locally so a
+malformed answer costs microseconds instead of another LLM round-trip.
+"""
+
+import ast
+import json
+import re
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _object_span(text):
+    """Text from the first "{" to its matching "}" (or to the end if it never closes)."""
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("No JSON object found in agent output")
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def _normalize(text):
+    """Drop comments and trailing commas, map Python literals and close open brackets."""
+    out, stack = [], []
+    i, n = 0, len(text)
+    in_string = escaped = False
+    while i < n:
+        ch = text[i]
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            elif ch == "\n":
+                out[-1] = "\\n"  # raw newline inside a string
+            i += 1
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch == "/" and text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        elif ch in "{[":
+            stack.append(_CLOSERS[ch])
+        elif ch in "}]":
+            while out and out[-1] in " \t\r\n":
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                stack.pop()
+        elif ch.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(_PY_LITERALS.get(word, word))
+            i = j
+            continue
+        out.append(ch)
+        i += 1
+    if in_string:
+        out.append('"')
+    while out and out[-1] in " \t\r\n,":
+        out.pop()
+    out.extend(reversed(stack))
+    return "".join(out)
+
+
+def repair_json(text):
+    """Parse the JSON object in text, repairing it locally if needed.
+
+    Returns (data, repaired) where repaired is False when text was already a
+    bare JSON object. Raises ValueError if no object can be recovered.
+    """
+    if isinstance(text, dict):
+        return text, False
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return data, False
+    except ValueError:
+        pass
+
+    fenced = _FENCE.search(text)
+    candidate = _object_span((fenced.group(1) if fenced else text).translate(_SMART_QUOTES))
+    for attempt in (candidate, _normalize(candidate)):
+        try:
+            data = json.loads(attempt, strict=False)
+            if isinstance(data, dict):
+                return data, True
+        except ValueError:
+            continue
+    try:
+        # Single-quoted keys and strings: a Python dict literal
+        data = ast.literal_eval(candidate)
+        if isinstance(data, dict):
+            return json.loads(json.dumps(data, default=str)), True
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        pass
+    raise ValueError("Agent output is not a recoverable JSON object")
+
+
+def partial_json(text):
+    """The members of a streamed JSON object that have fully arrived so far.
+
+    The text is cut after the last complete member and the brackets still
+    open are closed, so a half-received answer parses to the fields it
+    already holds. Returns {} until the first member is complete.
+    """
+    start = text.find("{")
+    if start == -1:
+        return {}
+    stack, cut, closers = [], None, ""
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(_CLOSERS[ch])
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            cut, closers = i + 1, "".join(reversed(stack))
+            if not stack:
+                break
+        elif ch == ",":
+            cut, closers = i, "".join(reversed(stack))
+    if cut is None:
+        return {}
+    candidate = text[start:cut] + closers
+    for attempt in (candidate, _normalize(candidate)):
+        try:
+            data = json.loads(attempt, strict=False)
+            if isinstance(data, dict):
+                return data
+        except ValueError:
+            continue
+    return {}
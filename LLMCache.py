@@ -0,0 +1,277 @@
+"""
+Content-addressed cache for LLM responses
+
+Identical prompts (same model, same normalized messages, same sampling
+parameters) are answered from a local cache instead of the network. The
+cache is two-tiered: a small in-memory LRU in front of an on-disk SQLite
+store with TTL expiry and size-bounded LRU eviction.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from crewai.llms.base_llm import BaseLLM, call_stop_override
+
+from Metrics import observe_llm_cache, llm_cache_counts
+
+# Settings read from the environment (see .env.examble)
+CACHE_ENABLED = os.getenv("LLM_CACHE", "on").lower() not in ("0", "off", "false", "no")
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 5000))
+CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", 256))
+
+# Sampling parameters that change the response and so belong in the key
+KEY_PARAMS = ("temperature", "top_p", "max_tokens", "seed", "presence_penalty",
+              "frequency_penalty", "base_url", "response_format")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_messages(messages):
+    """Return messages as a list of {role, content} with collapsed whitespace."""
+    if isinstance(messages, str):
+        messages = [{"role": "user", "content": messages}]
+    normalized = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            content = _WHITESPACE.sub(" ", content).strip()
+        normalized.append({"role": message.get("role"), "content": content})
+    return normalized
+
+
+def make_cache_key(model, messages, params=None):
+    """Hash model, normalized messages and parameters into a cache key."""
+    payload = {
+        "model": model,
+        "messages": normalize_messages(messages),
+        "params": {k: v for k, v in sorted((params or {}).items()) if v is not None},
+    }
+    blob = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Interface for response cache backends."""
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, model: str = "") -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryCache(ResponseCache):
+    """In-process LRU cache with optional TTL."""
+
+    def __init__(self, max_entries=CACHE_MEMORY_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if self.ttl and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, model=""):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache(ResponseCache):
+    """On-disk cache with TTL expiry and LRU eviction beyond max_entries."""
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        with conn:
+            if self.ttl and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, value, model=""):
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, value, now, now)
+            )
+            if self.ttl:
+                conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            overflow = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                    (overflow,)
+                )
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+
+class TieredCache(ResponseCache):
+    """Memory tier in front of a disk tier; disk hits are promoted."""
+
+    def __init__(self, memory, disk):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value, model=""):
+        self.memory.set(key, value, model)
+        self.disk.set(key, value, model)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+
+# Process-wide cache shared by every agent's LLM
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the shared response cache, or None when caching is disabled."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = TieredCache(MemoryCache(), SQLiteCache())
+        return _cache
+
+
+def cache_stats():
+    """Return hit/miss counts and hit rate for this process."""
+    return llm_cache_counts()
+
+
+class CachedLLM(BaseLLM):
+    """Wraps an LLM so repeated prompts are served from a ResponseCache.
+
+    Calls that carry tools or a response model are passed straight through,
+    since their results depend on more than the prompt text.
+    """
+
+    llm: Any = None
+    cache: Any = None
+
+    def _cache_key(self, messages):
+        params = {name: getattr(self.llm, name, None) for name in KEY_PARAMS}
+        params["stop"] = sorted(self.stop_sequences or [])
+        return make_cache_key(self.llm.model, messages, params)
+
+    def _bypass(self, tools, available_functions, kwargs):
+        return bool(tools or available_functions or kwargs.get("response_model"))
+
+    def _store(self, key, response):
+        if isinstance(response, str) and response.strip():
+            self.cache.set(key, response, self.llm.model)
+        return self._answer(response)
+
+    def _answer(self, response):
+        return self._apply_stop_words(response) if isinstance(response, str) else response
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        if self._bypass(tools, available_functions, kwargs):
+            return self.llm.call(messages, tools, callbacks, available_functions, **kwargs)
+
+        key = self._cache_key(messages)
+        response = self.cache.get(key)
+        observe_llm_cache(response is not None)
+        if response is not None:
+            # A hit is not written back: that would renew it past CACHE_TTL and cost a write
+            return self._answer(response)
+        with call_stop_override(self.llm, self.stop_sequences):
+            response = self.llm.call(messages, tools, callbacks, available_functions, **kwargs)
+        return self._store(key, response)
+
+    async def acall(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        if self._bypass(tools, available_functions, kwargs):
+            return await self.llm.acall(messages, tools, callbacks, available_functions, **kwargs)
+
+        key = self._cache_key(messages)
+        response = self.cache.get(key)
+        observe_llm_cache(response is not None)
+        if response is not None:
+            # A hit is not written back: that would renew it past CACHE_TTL and cost a write
+            return self._answer(response)
+        with call_stop_override(self.llm, self.stop_sequences):
+            response = await self.llm.acall(messages, tools, callbacks, available_functions, **kwargs)
+        return self._store(key, response)
+
+    def supports_function_calling(self):
+        return self.llm.supports_function_calling()
+
+    def supports_stop_words(self):
+        return True
+
+    def get_context_window_size(self):
+        return self.llm.get_context_window_size()
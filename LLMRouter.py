@@ -0,0 +1,302 @@
+"""
+Per-agent model routing with hedged requests and fallback
+
+Each agent can use its own model: LLM_ROUTE_EXTRACTOR, LLM_ROUTE_HISTORY,
+LLM_ROUTE_EVALUATOR and LLM_ROUTE_REPORTER, falling back to LLM_MODEL.
+A route is an ordered, comma-separated chain of endpoints, each `model` or
+`model@base_url` (LLM_BASE_URL when no base URL is given), e.g.
+
+    LLM_ROUTE_EXTRACTOR=openrouter/meta-llama/llama-3.1-8b-instruct:free,openrouter/deepseek/deepseek-chat-v3-0324:free
+
+A chain of more than one endpoint is served by RoutedLLM, which calls the
+first endpoint and
+
+- falls back to the next one when a call fails (after the scheduler's own
+  retries) or has run longer than LLM_ROUTE_TIMEOUT seconds;
+- with LLM_HEDGE=on, sends one duplicate to the next endpoint once the call
+  has run longer than that endpoint's recent latency quantile for this
+  agent (LLM_HEDGE_QUANTILE, p95 by default; LLM_HEDGE_DELAY seconds until
+  enough calls are seen). The first answer wins and the other call is
+  cancelled.
+
+Asyncio calls are cancelled outright. A blocking call already on the wire
+cannot be interrupted, so in synchronous runs the losing call is abandoned:
+it finishes on its own thread and its answer is discarded. Duplicates never
+stream, so a run's live output always follows a single call.
+
+All endpoints share OPENAI_API_KEY.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent import futures
+from typing import Any
+
+from crewai.llms.base_llm import BaseLLM, call_stop_override, call_stream_override
+
+from Metrics import observe_llm_route
+
+DEFAULT_MODEL = "openrouter/deepseek/deepseek-chat-v3-0324:free"
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Agents that can be routed, as named in LLM_ROUTE_<AGENT>
+ROUTE_AGENTS = ("extractor", "history", "evaluator", "reporter")
+
+# Settings read from the environment (see .env.examble)
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "off").lower() in ("1", "on", "true", "yes")
+HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", 0.95))
+HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", 30))
+ROUTE_TIMEOUT = float(os.getenv("LLM_ROUTE_TIMEOUT", 120))
+
+# Successful calls per (agent, endpoint) kept for the hedge threshold, and
+# how many are needed before it replaces HEDGE_DELAY
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+
+def parse_route(text, base_url=None):
+    """((model, base_url), ...) from a comma-separated `model[@base_url]` chain."""
+    base_url = base_url or os.getenv("LLM_BASE_URL", DEFAULT_BASE_URL)
+    chain = []
+    for part in text.split(","):
+        model, _, url = part.strip().partition("@")
+        if model:
+            chain.append((model, url or base_url))
+    if not chain:
+        raise ValueError(f"No model in route {text!r}")
+    return tuple(chain)
+
+
+def route_for(agent=None):
+    """The endpoint chain of an agent (one of ROUTE_AGENTS), or the default one."""
+    text = os.getenv(f"LLM_ROUTE_{agent.upper()}", "") if agent else ""
+    return parse_route(text if text.strip() else os.getenv("LLM_MODEL", DEFAULT_MODEL))
+
+
+def provider_llms(llm):
+    """The provider LLMs inside the Instrumented/Cached/Routed/Scheduled wrappers."""
+    endpoints = getattr(llm, "endpoints", None)
+    if endpoints:
+        for endpoint in endpoints:
+            yield from provider_llms(endpoint)
+    elif getattr(llm, "llm", None) is not None:
+        yield from provider_llms(llm.llm)
+    else:
+        yield llm
+
+
+def endpoint_name(llm):
+    provider = next(provider_llms(llm))
+    return f"{provider.model}@{getattr(provider, 'base_url', None) or ''}"
+
+
+# (agent, endpoint) -> recent durations of calls it answered
+_latencies = {}
+_latencies_lock = threading.Lock()
+
+
+def record_latency(agent, endpoint, seconds):
+    with _latencies_lock:
+        window = _latencies.get((agent, endpoint))
+        if window is None:
+            window = _latencies[(agent, endpoint)] = deque(maxlen=LATENCY_WINDOW)
+        window.append(seconds)
+
+
+def hedge_delay(agent, endpoint):
+    """Seconds to wait on `endpoint` before sending a duplicate of `agent`'s call."""
+    with _latencies_lock:
+        samples = sorted(_latencies.get((agent, endpoint), ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DELAY
+    return samples[min(len(samples) - 1, int(HEDGE_QUANTILE * len(samples)))]
+
+
+class _Race:
+    """The endpoints one routed call has running, and which to start next.
+
+    Shared by the thread and asyncio versions of RoutedLLM.call; a handle
+    is a concurrent.futures.Future or an asyncio.Task.
+    """
+
+    def __init__(self, endpoints, agent, hedge, timeout):
+        self.names = [endpoint_name(endpoint) for endpoint in endpoints]
+        self.agent = agent
+        self.hedge = hedge and len(endpoints) > 1
+        self.timeout = timeout
+        self.pending = {}
+        self.next = 0
+        self.error = None
+
+    def _hedge_at(self):
+        return min(started + hedge_delay(self.agent, self.names[index])
+                   for index, _, started in self.pending.values())
+
+    def _can_hedge(self):
+        return self.hedge and self.pending and self.next < len(self.names)
+
+    def launches(self, now):
+        """(index, kind) of the endpoints to start now: the first, a fallback or the hedge."""
+        if self.next >= len(self.names):
+            return []
+        if not self.pending:
+            kind = "primary" if self.next == 0 else "fallback"
+        elif self._can_hedge() and now >= self._hedge_at():
+            kind = "hedge"
+            self.hedge = False  # one duplicate per call
+        else:
+            return []
+        self.next += 1
+        return [(self.next - 1, kind)]
+
+    def started(self, handle, index, kind, now):
+        self.pending[handle] = (index, kind, now)
+
+    def wait_time(self, now):
+        """Seconds until a hedge or timeout is due (None: only a result can move the race on)."""
+        due = [started + self.timeout for _, _, started in self.pending.values()] if self.timeout else []
+        if self._can_hedge():
+            due.append(self._hedge_at())
+        return max(0.0, min(due) - now) if due else None
+
+    def finished(self, handle, error, now):
+        """Record a finished attempt; True if it answered the call."""
+        index, kind, started = self.pending.pop(handle)
+        seconds = now - started
+        if error is None:
+            record_latency(self.agent, self.names[index], seconds)
+            observe_llm_route(self.agent, self.names[index], kind, "won", seconds)
+            return True
+        observe_llm_route(self.agent, self.names[index], kind, "failed", seconds)
+        self.error = error
+        return False
+
+    def expired(self, now):
+        """Attempts running longer than the timeout, dropped from the race."""
+        handles = [handle for handle, (_, _, started) in self.pending.items()
+                   if self.timeout and now - started >= self.timeout]
+        for handle in handles:
+            index, kind, started = self.pending.pop(handle)
+            record_latency(self.agent, self.names[index], now - started)
+            observe_llm_route(self.agent, self.names[index], kind, "timeout", now - started)
+            self.error = TimeoutError(f"{self.names[index]} did not answer within {self.timeout:g}s")
+        return handles
+
+    def exhausted(self):
+        return not self.pending and self.next >= len(self.names)
+
+    def losers(self, now):
+        """Attempts still running once the call is decided, dropped from the race.
+
+        Their time so far still enters the latency window: leaving out the
+        slow calls a hedge beat would pull the quantile down and hedge more.
+        """
+        handles = list(self.pending)
+        for handle in handles:
+            index, kind, started = self.pending.pop(handle)
+            record_latency(self.agent, self.names[index], now - started)
+            observe_llm_route(self.agent, self.names[index], kind, "cancelled", now - started)
+        return handles
+
+
+class RoutedLLM(BaseLLM):
+    """Serves calls from an ordered chain of endpoints, hedging and falling back (see module doc)."""
+
+    endpoints: list = []
+    hedge: bool = HEDGE_ENABLED
+    timeout: float = ROUTE_TIMEOUT
+
+    def _race(self, kwargs):
+        agent = getattr(kwargs.get("from_agent"), "role", None) or "unknown"
+        return _Race(self.endpoints, agent, self.hedge, self.timeout)
+
+    @contextlib.contextmanager
+    def _scope(self, endpoint, kind):
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(call_stop_override(endpoint, self.stop_sequences))
+            if kind == "hedge":
+                for provider in provider_llms(endpoint):
+                    stack.enter_context(call_stream_override(provider, False))
+            yield
+
+    def _submit(self, index, kind, messages, tools, callbacks, available_functions, kwargs):
+        """Call endpoint `index` on its own thread, in a copy of the caller's context."""
+        endpoint = self.endpoints[index]
+        future = futures.Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                with self._scope(endpoint, kind):
+                    future.set_result(endpoint.call(messages, tools, callbacks, available_functions, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run,), name=f"llm-route-{kind}", daemon=True).start()
+        return future
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        race = self._race(kwargs)
+        try:
+            while True:
+                now = time.perf_counter()
+                for index, kind in race.launches(now):
+                    future = self._submit(index, kind, messages, tools, callbacks, available_functions, kwargs)
+                    race.started(future, index, kind, now)
+                done, _ = futures.wait(list(race.pending), timeout=race.wait_time(now),
+                                       return_when=futures.FIRST_COMPLETED)
+                now = time.perf_counter()
+                for future in done:
+                    if race.finished(future, future.exception(), now):
+                        return future.result()
+                for future in race.expired(now):
+                    future.cancel()
+                if race.exhausted():
+                    raise race.error
+        finally:
+            for future in race.losers(time.perf_counter()):
+                future.cancel()
+
+    async def _acall_endpoint(self, index, kind, messages, tools, callbacks, available_functions, kwargs):
+        endpoint = self.endpoints[index]
+        with self._scope(endpoint, kind):
+            return await endpoint.acall(messages, tools, callbacks, available_functions, **kwargs)
+
+    async def acall(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        race = self._race(kwargs)
+        try:
+            while True:
+                now = time.perf_counter()
+                for index, kind in race.launches(now):
+                    task = asyncio.ensure_future(self._acall_endpoint(
+                        index, kind, messages, tools, callbacks, available_functions, kwargs))
+                    race.started(task, index, kind, now)
+                done, _ = await asyncio.wait(list(race.pending), timeout=race.wait_time(now),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                now = time.perf_counter()
+                for task in done:
+                    if race.finished(task, task.exception(), now):
+                        return task.result()
+                for task in race.expired(now):
+                    task.cancel()
+                if race.exhausted():
+                    raise race.error
+        finally:
+            for task in race.losers(time.perf_counter()):
+                task.cancel()
+
+    def supports_function_calling(self):
+        return all(endpoint.supports_function_calling() for endpoint in self.endpoints)
+
+    def supports_stop_words(self):
+        return all(endpoint.supports_stop_words() for endpoint in self.endpoints)
+
+    def get_context_window_size(self):
+        return min(endpoint.get_context_window_size() for endpoint in self.endpoints)
@@ -0,0 +1,411 @@
+"""
+Rate-limit-aware scheduling of LLM requests
+
+Every provider call goes through one process-wide LLMScheduler:
+
+- A token bucket per (model, endpoint, API key) spaces requests to
+  LLM_RATE_PER_MINUTE, with bursts of up to LLM_BURST.
+- Waiting requests are served highest priority first, so interactive
+  runs jump ahead of batch runs (see llm_priority()).
+- Rate-limit (429), overload (5xx), timeout and connection errors are
+  retried up to LLM_MAX_RETRIES times with jittered exponential backoff.
+  A 429 pauses the whole bucket, honouring Retry-After, so concurrent
+  sessions back off together instead of each hitting the limit again.
+- Identical prompts already in flight are coalesced: later callers wait
+  for the first request's answer instead of sending their own.
+
+Limits are per process; with several job workers, divide the provider's
+limit between them.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any
+
+from crewai.llms.base_llm import BaseLLM, call_stop_override
+
+from LLMCache import make_cache_key, KEY_PARAMS
+from Metrics import (
+    set_llm_queue_depth,
+    observe_llm_queue_wait,
+    observe_llm_retry,
+    observe_llm_coalesced
+)
+from Priorities import PRIORITY_INTERACTIVE
+
+# Settings read from the environment (see .env.examble); a rate of 0 means unlimited
+SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER", "on").lower() not in ("0", "off", "false", "no")
+RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", 20))
+BURST = int(os.getenv("LLM_BURST", 4))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 1.0))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 60))
+
+RETRYABLE_STATUS = (408, 409, 429)
+
+_priority = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextlib.contextmanager
+def llm_priority(priority):
+    """Run the LLM calls made inside the block at `priority` (higher goes first).
+
+    Uses the job queue's scale: Priorities.PRIORITY_INTERACTIVE (the default)
+    or Priorities.PRIORITY_BATCH.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class TokenBucket:
+    """`rate` requests per second on average, up to `burst` at once."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def wait_time(self, now):
+        """Seconds until a request may start (0 if one may start now)."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate:
+            self.tokens -= 1
+
+    def pause(self, seconds, now):
+        """Start nothing for `seconds`, then one probe request and the steady rate, no burst."""
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = min(self.tokens, 1.0)
+        self.updated = max(self.updated, self.paused_until)
+
+
+def _error_chain(error):
+    """error and the exceptions it wraps, each once (chains can loop)."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def _status_code(error):
+    """HTTP status of a provider error, looking through wrapped causes."""
+    for cause in _error_chain(error):
+        status = getattr(cause, "status_code", None) or getattr(getattr(cause, "response", None), "status_code", None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def _retry_after(error):
+    """Seconds from a Retry-After header on the provider's response, if any."""
+    for cause in _error_chain(error):
+        headers = getattr(getattr(cause, "response", None), "headers", None)
+        if headers is not None:
+            try:
+                return max(0.0, float(headers.get("retry-after")))
+            except (TypeError, ValueError):
+                pass
+    return None
+
+
+def retry_reason(error):
+    """Why error is worth retrying (rate_limited, server_error, connection) or None."""
+    status = _status_code(error)
+    if status == 429:
+        return "rate_limited"
+    if status is not None and (status >= 500 or status in RETRYABLE_STATUS):
+        return "server_error"
+    if any(isinstance(cause, (ConnectionError, TimeoutError)) for cause in _error_chain(error)):
+        return "connection"
+    return None
+
+
+class _LeaderCancelled(Exception):
+    """Set on a coalesced request whose leading call was cancelled; its followers send their own."""
+
+
+class LLMScheduler:
+    """Process-wide gate in front of provider calls: rate limits, priorities, retries, coalescing."""
+
+    def __init__(self, rate_per_minute=RATE_PER_MINUTE, burst=BURST, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cond = threading.Condition()
+        self._buckets = {}
+        self._queues = {}   # limit key -> heap of (-priority, seq, wake)
+        self._seq = itertools.count()
+        self._dispatcher = None
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    # ---- admission -------------------------------------------------------
+
+    def _enqueue(self, limit_key, priority, wake):
+        with self._cond:
+            if limit_key not in self._buckets:
+                self._buckets[limit_key] = TokenBucket(self.rate, self.burst)
+                self._queues[limit_key] = []
+            heapq.heappush(self._queues[limit_key], (-priority, next(self._seq), wake))
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="llm-scheduler", daemon=True)
+                self._dispatcher.start()
+            self._cond.notify()
+
+    def _dispatch(self):
+        """Wake queued requests as their buckets allow, highest priority first."""
+        with self._cond:
+            while True:
+                timeout = None
+                now = time.monotonic()
+                depths = {}
+                for limit_key, queue in self._queues.items():
+                    bucket = self._buckets[limit_key]
+                    while queue:
+                        wait = bucket.wait_time(now)
+                        if wait > 0:
+                            timeout = wait if timeout is None else min(timeout, wait)
+                            break
+                        bucket.take()
+                        wake = heapq.heappop(queue)[2]
+                        try:
+                            wake()
+                        except Exception as e:
+                            # e.g. the waiter's event loop already closed; the others must still be woken
+                            print(f"⚠️ Could not wake a queued LLM call: {type(e).__name__}: {e}")
+                    depths[limit_key[0]] = depths.get(limit_key[0], 0) + len(queue)
+                for model, depth in depths.items():
+                    set_llm_queue_depth(model, depth)
+                self._cond.wait(timeout)
+
+    def acquire(self, limit_key, priority):
+        """Block until a request under limit_key may start."""
+        started = time.monotonic()
+        ready = threading.Event()
+        self._enqueue(limit_key, priority, ready.set)
+        ready.wait()
+        observe_llm_queue_wait(limit_key[0], priority, time.monotonic() - started)
+
+    async def acquire_async(self, limit_key, priority):
+        """Wait, without blocking the event loop, until a request under limit_key may start."""
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: ready.done() or ready.set_result(None))
+
+        self._enqueue(limit_key, priority, wake)
+        await ready
+        observe_llm_queue_wait(limit_key[0], priority, time.monotonic() - started)
+
+    # ---- retries ---------------------------------------------------------
+
+    def _backoff(self, limit_key, error, attempt):
+        """(reason, delay) before retrying after error, or None to give up."""
+        reason = retry_reason(error)
+        if reason is None or attempt >= self.max_retries:
+            return None
+        # Full jitter keeps retrying clients from arriving in lockstep
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if reason == "rate_limited":
+            delay = _retry_after(error) or delay
+            with self._cond:
+                self._buckets[limit_key].pause(delay, time.monotonic())
+                self._cond.notify()
+        observe_llm_retry(limit_key[0], reason, delay)
+        return reason, delay
+
+    def run(self, limit_key, func, priority=None):
+        """Call func() once admitted under limit_key, retrying retryable errors."""
+        priority = current_priority() if priority is None else priority
+        for attempt in itertools.count():
+            self.acquire(limit_key, priority)
+            try:
+                return func()
+            except Exception as e:
+                retry = self._backoff(limit_key, e, attempt)
+                if retry is None:
+                    raise
+            # A 429 paused the bucket, so the next acquire() already waits
+            if retry[0] != "rate_limited":
+                time.sleep(retry[1])
+
+    async def run_async(self, limit_key, func, priority=None):
+        """Await func() once admitted under limit_key, retrying retryable errors."""
+        priority = current_priority() if priority is None else priority
+        for attempt in itertools.count():
+            await self.acquire_async(limit_key, priority)
+            try:
+                return await func()
+            except Exception as e:
+                retry = self._backoff(limit_key, e, attempt)
+                if retry is None:
+                    raise
+            if retry[0] != "rate_limited":
+                await asyncio.sleep(retry[1])
+
+    # ---- coalescing ------------------------------------------------------
+
+    def _join(self, key):
+        """(future, is_leader) for the in-flight request with this key."""
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _settle(self, key, future, result=None, error=None):
+        with self._inflight_lock:
+            self._inflight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def call(self, limit_key, func, coalesce_key=None, priority=None):
+        """run() with identical in-flight requests (same coalesce_key) sharing one call."""
+        if coalesce_key is None:
+            return self.run(limit_key, func, priority)
+        while True:
+            future, leader = self._join(coalesce_key)
+            if leader:
+                break
+            observe_llm_coalesced(limit_key[0])
+            try:
+                return future.result()
+            except _LeaderCancelled:
+                continue
+        try:
+            result = self.run(limit_key, func, priority)
+        except BaseException as e:
+            self._settle(coalesce_key, future, error=e)
+            raise
+        self._settle(coalesce_key, future, result)
+        return result
+
+    async def acall(self, limit_key, func, coalesce_key=None, priority=None):
+        """run_async() with identical in-flight requests sharing one call."""
+        if coalesce_key is None:
+            return await self.run_async(limit_key, func, priority)
+        while True:
+            future, leader = self._join(coalesce_key)
+            if leader:
+                break
+            observe_llm_coalesced(limit_key[0])
+            try:
+                # Shielded: a follower giving up must not cancel the shared answer
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _LeaderCancelled:
+                continue
+        try:
+            result = await self.run_async(limit_key, func, priority)
+        except asyncio.CancelledError:
+            self._settle(coalesce_key, future, error=_LeaderCancelled())
+            raise
+        except BaseException as e:
+            self._settle(coalesce_key, future, error=e)
+            raise
+        self._settle(coalesce_key, future, result)
+        return result
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The process-wide LLMScheduler."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
+
+
+def rate_limit_key(llm):
+    """Rate-limit identity of an LLM client: model, endpoint and a digest of its API key."""
+    api_key = getattr(llm, "api_key", None) or ""
+    digest = hashlib.sha256(str(api_key).encode("utf-8")).hexdigest()[:12]
+    return llm.model, getattr(llm, "base_url", None), digest
+
+
+class ScheduledLLM(BaseLLM):
+    """Wraps a provider LLM so every call goes through an LLMScheduler.
+
+    Calls with tools or a response model are never coalesced, since their
+    results depend on more than the prompt text. CrewAI's own rate-limit
+    retry still wraps the outermost LLM, so a 429 that outlasts the
+    scheduler's retries is queued again a couple of times before failing.
+    """
+
+    llm: Any = None
+    scheduler: Any = None
+
+    def _coalesce_key(self, messages, tools, available_functions, kwargs):
+        if tools or available_functions or kwargs.get("response_model"):
+            return None
+        params = {name: getattr(self.llm, name, None) for name in KEY_PARAMS}
+        params["stop"] = sorted(self.stop_sequences or [])
+        # Per endpoint, so a hedged duplicate is not merged into the call it races
+        params["base_url"] = getattr(self.llm, "base_url", None)
+        return make_cache_key(self.llm.model, messages, params)
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        stop = self.stop_sequences
+
+        def send():
+            with call_stop_override(self.llm, stop):
+                return self.llm.call(messages, tools, callbacks, available_functions, **kwargs)
+
+        return self.scheduler.call(rate_limit_key(self.llm), send,
+                                   self._coalesce_key(messages, tools, available_functions, kwargs))
+
+    async def acall(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        stop = self.stop_sequences
+
+        async def send():
+            with call_stop_override(self.llm, stop):
+                return await self.llm.acall(messages, tools, callbacks, available_functions, **kwargs)
+
+        return await self.scheduler.acall(rate_limit_key(self.llm), send,
+                                          self._coalesce_key(messages, tools, available_functions, kwargs))
+
+    def supports_function_calling(self):
+        return self.llm.supports_function_calling()
+
+    def supports_stop_words(self):
+        return self.llm.supports_stop_words()
+
+    def get_context_window_size(self):
+        return self.llm.get_context_window_size()
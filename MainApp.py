@@ -4,6 +4,7 @@ from datetime import datetime
 import json
 import os
 import sys
+import time
 
 # Add the current directory to Python path to import local modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -14,28 +15,46 @@ from db import (
     check_patient_by_national_id,
     create_patient,
     add_medical_history,
-    get_patient_medical_history
+    get_patient_medical_history,
+    search_patients_by_history,
+    search_medical_history
 )
 
-from Agents import (
-    create_symptom_extractor_agent,
-    create_medical_history_agent,
-    create_symptom_evaluator_agent,
-    create_medical_report_generator_agent
+from Agents import agent_registry
+from Pipeline import (
+    run_medical_analysis,
+    stream_medical_analysis,
+    PIPELINE_MODES,
+    DEFAULT_PIPELINE_MODE,
+    REPORT_MODES,
+    DEFAULT_REPORT_MODE
 )
-
-from Tasks import (
-    create_symptom_extraction_task,
-    create_medical_history_task,
-    create_symptom_evaluation_task,
-    create_medical_report_task
+from Metrics import (
+    start_metrics_server,
+    structured_output_counts,
+    db_cache_counts,
+    llm_cache_counts,
+    METRICS_PORT
 )
+from Workspace import RunWorkspace, REPORT_FILE
+from Jobs import submit_job, get_job, queue_counts
+
+# Seconds between status checks while a background job runs
+JOB_REFRESH_SECONDS = 2
 
-from crewai import Crew
-from crewai.crew import Process
+# Trailing characters of an agent's live output shown while it streams
+LIVE_OUTPUT_CHARS = 1500
+
+@st.cache_resource(show_spinner="Starting up...")
+def init_backend():
+    """Once per server process, not on every rerun: database, /metrics and agents."""
+    init_database()
+    # Prometheus-style /metrics endpoint (only when METRICS_PORT is set)
+    start_metrics_server()
+    # CrewAI loads and the agents are built in the background while the form is drawn
+    agent_registry.warm_in_background()
+    return True
 
-# Initialize database
-init_database()
 
 # Streamlit page configuration
 st.set_page_config(
@@ -45,6 +64,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+init_backend()
+
 # Custom CSS for better styling
 st.markdown("""
 <style>
@@ -100,6 +121,10 @@ if 'analysis_complete' not in st.session_state:
     st.session_state.analysis_complete = False
 if 'crew_results' not in st.session_state:
     st.session_state.crew_results = None
+if 'run_id' not in st.session_state:
+    st.session_state.run_id = None
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
 
 # Sidebar for system information
 with st.sidebar:
@@ -112,60 +137,143 @@ with st.sidebar:
     4. **Report Generator** - Creates final medical report
     """)
 
+    st.markdown("### ⚙️ Analysis Settings")
+    st.selectbox(
+        "Pipeline mode",
+        PIPELINE_MODES,
+        index=PIPELINE_MODES.index(DEFAULT_PIPELINE_MODE),
+        key="pipeline_mode",
+        help="prefetch: history is loaded from the database while Agent 1 runs. "
+             "sequential: Agent 2 fetches history with its database tool."
+    )
+    st.selectbox(
+        "Report mode",
+        REPORT_MODES,
+        index=REPORT_MODES.index(DEFAULT_REPORT_MODE),
+        key="report_mode",
+        help="template: the HTML report is rendered locally from Agent 3's output. "
+             "llm: Agent 4 writes the report."
+    )
+
+    st.checkbox(
+        "Run in background worker",
+        value=os.getenv("JOB_QUEUE", "off") == "on",
+        key="use_job_queue",
+        help="Queue the analysis for a worker process (python Jobs.py worker). "
+             "The run continues if the browser disconnects."
+    )
+    st.checkbox(
+        "Stream agent output",
+        value=os.getenv("STREAM_OUTPUT", "on") == "on",
+        key="stream_output",
+        help="Show each agent's output, the assessment and the report as they are written "
+             "instead of waiting for the whole analysis."
+    )
+    if st.session_state.use_job_queue:
+        jobs = queue_counts()
+        st.caption(f"Job queue: {jobs['queued']} queued, {jobs['running']} running")
+
+    st.markdown("### ⚡ LLM Response Cache")
+    llm_cache = llm_cache_counts()
+    st.caption(f"Hit rate: {llm_cache['hit_rate']:.0%} "
+               f"({llm_cache['hits']} hits / {llm_cache['misses']} misses)")
+    db_cache = db_cache_counts()
+    st.caption(f"Patient lookups: {db_cache['hit']} cached, {db_cache['miss']} from the database")
+    outputs = structured_output_counts()
+    st.caption(f"Structured output: {outputs['valid']} valid, {outputs['repaired']} repaired, "
+               f"{outputs['rejected']} re-asked")
+    if METRICS_PORT:
+        st.caption(f"📈 Metrics: http://localhost:{METRICS_PORT}/metrics")
+
 
 # Main content area
+def show_assessment(fields):
+    """Agent 3's assessment fields received so far."""
+    st.markdown("#### 🩺 Assessment so far")
+    for section, values in fields.items():
+        st.markdown(f"**{section.replace('_', ' ').capitalize()}**")
+        if not isinstance(values, dict):
+            values = {"": values}
+        for name, value in values.items():
+            if isinstance(value, list):
+                value = ", ".join(str(item) for item in value) or "None"
+            label = f"{name.replace('_', ' ').capitalize()}: " if name else ""
+            st.markdown(f"- {label}{value}")
+
+
+def stream_medical_crew_analysis(patient_name, patient_age, patient_gender, symptoms, national_id):
+    """Run the analysis, showing agent output, the assessment and the report as they arrive"""
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    live_output = st.empty()
+    assessment_box = st.empty()
+    report_box = st.empty()
+
+    workspace = RunWorkspace()
+    st.session_state.run_id = workspace.run_id
+    stream = stream_medical_analysis(
+        patient_name, patient_age, patient_gender, symptoms, national_id,
+        mode=st.session_state.pipeline_mode,
+        report_mode=st.session_state.report_mode,
+        workspace=workspace
+    )
+    for event in stream:
+        if event.kind == "progress":
+            fraction, label = event.data
+            progress_bar.progress(int(fraction * 100))
+            status_text.text(label)
+        elif event.kind == "text":
+            live_output.code(event.data[-LIVE_OUTPUT_CHARS:], language=None)
+        elif event.kind == "fields":
+            with assessment_box.container():
+                show_assessment(event.data)
+        elif event.kind == "report" and event.data:
+            with report_box:
+                st.components.v1.html(event.data, height=600, scrolling=True)
+        elif event.kind == "done":
+            return str(event.data)
+        elif event.kind == "error":
+            st.error(f"Error during analysis: {str(event.data)}")
+            return None
+
+
 def run_medical_crew_analysis(patient_name, patient_age, patient_gender, symptoms, national_id):
     """Run the 4-agent medical analysis system"""
 
+    if st.session_state.use_job_queue:
+        # Hand the run to a worker process; the job panel below polls it
+        st.session_state.job_id = submit_job(
+            patient_name, patient_age, patient_gender, symptoms, national_id,
+            mode=st.session_state.pipeline_mode,
+            report_mode=st.session_state.report_mode
+        )
+        st.query_params["job"] = str(st.session_state.job_id)
+        return None
+
+    if st.session_state.stream_output:
+        return stream_medical_crew_analysis(patient_name, patient_age, patient_gender, symptoms, national_id)
+
     with st.spinner("🔄 Running AI Medical Analysis..."):
         progress_bar = st.progress(0)
         status_text = st.empty()
 
-        try:
-            # Create agents
-            agent1_extractor = create_symptom_extractor_agent()
-            agent2_history = create_medical_history_agent()
-            agent3_evaluator = create_symptom_evaluator_agent()
-            agent4_reporter = create_medical_report_generator_agent()
-
-            # Create tasks
-            task1 = create_symptom_extraction_task(
-                patient_name=patient_name,
-                patient_age=patient_age,
-                patient_gender=patient_gender,
-                symptoms=symptoms,
-                agent=agent1_extractor
-            )
-            progress_bar.progress(20)
-            status_text.text("Creating medical history task...")
+        def show_progress(fraction, label):
+            progress_bar.progress(int(fraction * 100))
+            status_text.text(label)
 
-            task2 = create_medical_history_task(
-                national_id=national_id,
-                agent=agent2_history
-            )
-            progress_bar.progress(40)
-            status_text.text("Creating symptom evaluation task...")
-
-            task3 = create_symptom_evaluation_task(agent3_evaluator)
-            progress_bar.progress(60)
-            status_text.text("Creating report generation task...")
-
-            task4 = create_medical_report_task(agent4_reporter)
-            progress_bar.progress(80)
-            status_text.text("Running AI analysis...")
-
-            # Create and run crew
-            crew = Crew(
-                agents=[agent1_extractor, agent2_history, agent3_evaluator, agent4_reporter],
-                tasks=[task1, task2, task3, task4],
-                verbose=False,
-                process=Process.sequential
+        try:
+            # Each run gets its own output directory so sessions don't clobber each other
+            workspace = RunWorkspace()
+            st.session_state.run_id = workspace.run_id
+
+            result = run_medical_analysis(
+                patient_name, patient_age, patient_gender, symptoms, national_id,
+                mode=st.session_state.pipeline_mode,
+                report_mode=st.session_state.report_mode,
+                workspace=workspace,
+                on_progress=show_progress
             )
 
-            result = crew.kickoff()
-            progress_bar.progress(100)
-            status_text.text("Analysis complete!")
-
             return str(result)
 
         except Exception as e:
@@ -214,6 +322,8 @@ if submit_button:
                 st.session_state.crew_results = crew_result
                 st.session_state.analysis_complete = True
                 st.rerun()
+            elif st.session_state.job_id:
+                st.rerun()
         else:
             # New patient - show registration form
             st.session_state.show_medical_history_form = True
@@ -287,6 +397,9 @@ if st.session_state.show_medical_history_form:
                     st.session_state.analysis_complete = True
                     st.session_state.show_medical_history_form = False
                     st.rerun()
+                elif st.session_state.job_id:
+                    st.session_state.show_medical_history_form = False
+                    st.rerun()
             else:
                 st.error("❌ Error registering patient. National ID may already exist.")
         else:
@@ -296,6 +409,35 @@ if st.session_state.show_medical_history_form:
         st.session_state.show_medical_history_form = False
         st.rerun()
 
+# Restore a background job after the browser reconnects
+if st.session_state.job_id is None and "job" in st.query_params:
+    if st.query_params["job"].isdigit():
+        st.session_state.job_id = int(st.query_params["job"])
+    else:
+        # Hand-edited or stale URL: forget it rather than fail the page
+        st.query_params.pop("job", None)
+
+# Poll the background job until a worker finishes it
+if st.session_state.job_id is not None:
+    job = get_job(st.session_state.job_id)
+    if job is None or job['status'] == 'failed':
+        if job:
+            st.error(f"❌ Analysis job {job['id']} failed: {job['error']}")
+        st.session_state.job_id = None
+        st.query_params.pop("job", None)
+    elif job['status'] == 'succeeded':
+        st.session_state.run_id = job['result']['run_id']
+        st.session_state.crew_results = RunWorkspace(st.session_state.run_id).read(REPORT_FILE)
+        st.session_state.analysis_complete = True
+        st.session_state.job_id = None
+        st.query_params.pop("job", None)
+    else:
+        st.markdown(f'<div class="info-box">⏳ Analysis job #{job["id"]} is {job["status"]}. '
+                    'This page refreshes automatically, and you can close it and come back later.</div>',
+                    unsafe_allow_html=True)
+        time.sleep(JOB_REFRESH_SECONDS)
+        st.rerun()
+
 # Display analysis results
 if st.session_state.analysis_complete and st.session_state.crew_results:
     st.markdown('<h2 class="section-header">🎯 AI Analysis Results</h2>', unsafe_allow_html=True)
@@ -306,8 +448,8 @@ if st.session_state.analysis_complete and st.session_state.crew_results:
 
     # Try to extract and display the HTML report if it exists
     try:
-        # Check if final report file exists
-        report_file_path = "Output/final_report.html"
+        # Check if this session's report file exists
+        report_file_path = RunWorkspace(st.session_state.run_id).report_path
         if os.path.exists(report_file_path):
             with open(report_file_path, 'r', encoding='utf-8') as f:
                 html_content = f.read()
@@ -349,6 +491,32 @@ if st.session_state.analysis_complete and st.session_state.crew_results:
                 else:
                     st.info("No medical history found.")
 
+# Search across every patient's medical history (full-text index)
+st.markdown('<h2 class="section-header">Search Medical Histories</h2>', unsafe_allow_html=True)
+
+with st.form("history_search_form"):
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        search_query = st.text_input("🔎 Find patients whose history mentions",
+                                     placeholder="e.g. penicillin, asthma")
+    with col2:
+        match_all = st.checkbox("Match all words", value=True)
+    search_button = st.form_submit_button("Search", use_container_width=True)
+
+if search_button and search_query.strip():
+    matching_patients = search_patients_by_history(search_query, match_all=match_all)
+    if not matching_patients:
+        st.info("No medical history mentions that.")
+    else:
+        st.caption(f"{len(matching_patients)} patient(s) found")
+        for found_id, name, age, gender, matches, latest in matching_patients:
+            label = "entry" if matches == 1 else "entries"
+            with st.expander(f"{name or 'Unknown'} ({found_id}), {age}, {gender}: {matches} matching {label}"):
+                entries = search_medical_history(search_query, national_id=found_id,
+                                                 limit=20, match_all=match_all)
+                for _, _, _, timestamp, snippet in entries:
+                    st.markdown(f"**{timestamp}**: {snippet}")
+
 # Footer
 st.markdown("---")
 st.markdown(
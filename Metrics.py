@@ -0,0 +1,497 @@
+"""
+Process-wide metrics, structured logs and per-run progress
+
+Counters and histograms are kept in memory and exposed in the Prometheus
+text format (render_metrics(), or over HTTP with start_metrics_server()).
+Every measured event is also written as one JSON line to the
+"healthcrew.metrics" logger (to the METRICS_LOG file, stderr if unset, or
+nowhere with METRICS_LOG=off).
+
+Standard library only, so db.py and the job queue can import it without
+loading CrewAI.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_LOG = os.getenv("METRICS_LOG", "")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Loopback only unless set (e.g. 0.0.0.0 for a scraper on another host)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# USD per 1,000 tokens, for cost estimates (the default OpenRouter model is free)
+PROMPT_COST_PER_1K = float(os.getenv("LLM_PROMPT_COST_PER_1K", 0))
+COMPLETION_COST_PER_1K = float(os.getenv("LLM_COMPLETION_COST_PER_1K", 0))
+
+# Histogram buckets in seconds, from fast DB queries to slow LLM calls
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+logger = logging.getLogger("healthcrew.metrics")
+
+
+def _configure_logger():
+    if logger.handlers:
+        return
+    if METRICS_LOG.lower() == "off":
+        handler = logging.NullHandler()
+    elif METRICS_LOG:
+        handler = logging.FileHandler(METRICS_LOG, encoding="utf-8")
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+_configure_logger()
+
+
+def log_event(event, **fields):
+    """Write one JSON log line for event."""
+    record = {"ts": round(time.time(), 3), "event": event}
+    run = current_run.get()
+    if run is not None:
+        record["run_id"] = run.run_id
+    record.update(fields)
+    logger.info(json.dumps(record, default=str, ensure_ascii=False))
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Value that goes up and down, with labels."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def count(self, **labels):
+        series = self._series.get(tuple(sorted(labels.items())))
+        return series[1] if series else 0
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, (buckets, count, total) in self._series.items():
+                for bound, n in zip(self.buckets, buckets):
+                    out.append((f"{self.name}_bucket", key + (("le", bound),), n))
+                out.append((f"{self.name}_bucket", key + (("le", "+Inf"),), count))
+                out.append((f"{self.name}_count", key, count))
+                out.append((f"{self.name}_sum", key, round(total, 6)))
+        return out
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text)
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text=""):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text=""):
+        return self._get(Histogram, name, help_text)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+TASK_SECONDS = registry.histogram("healthcrew_task_seconds", "Wall time of each pipeline stage")
+LLM_CALL_SECONDS = registry.histogram("healthcrew_llm_call_seconds", "LLM call latency, cache hits included")
+LLM_TTFT_SECONDS = registry.histogram("healthcrew_llm_ttft_seconds", "Time to first token of provider calls")
+LLM_TOKENS = registry.counter("healthcrew_llm_tokens_total", "Prompt and completion tokens")
+PROMPT_TOKENS = registry.counter(
+    "healthcrew_prompt_tokens_estimated_total",
+    "Estimated input tokens of LLM calls by pipeline stage (about four characters per token), cache hits included"
+)
+LLM_COST = registry.counter("healthcrew_llm_cost_usd_total", "Estimated LLM spend in USD")
+LLM_FAILURES = registry.counter("healthcrew_llm_failed_attempts_total", "LLM attempts that raised (each is retried or fails the task)")
+TOOL_SECONDS = registry.histogram("healthcrew_tool_seconds", "Agent tool call duration")
+DB_QUERY_SECONDS = registry.histogram("healthcrew_db_query_seconds", "Database call duration")
+LLM_QUEUE_DEPTH = registry.gauge("healthcrew_llm_queue_depth", "LLM requests waiting for the rate limiter")
+LLM_QUEUE_WAIT_SECONDS = registry.histogram(
+    "healthcrew_llm_queue_wait_seconds", "Time LLM requests waited for the rate limiter, by priority"
+)
+LLM_RETRIES = registry.counter("healthcrew_llm_retries_total", "LLM requests retried after a retryable error")
+LLM_COALESCED = registry.counter(
+    "healthcrew_llm_coalesced_total", "LLM requests answered by an identical request already in flight"
+)
+LLM_ROUTE_ATTEMPTS = registry.counter(
+    "healthcrew_llm_route_attempts_total",
+    "Attempts of routed LLM calls by agent, endpoint, kind (primary, hedge, fallback) "
+    "and outcome (won, failed, timeout, cancelled)"
+)
+STRUCTURED_OUTPUTS = registry.counter(
+    "healthcrew_structured_output_total",
+    "Task outputs checked against their schema, by outcome (valid, repaired, rejected, llm_converted)"
+)
+STAGE_REUSES = registry.counter(
+    "healthcrew_stage_reused_total",
+    "Pipeline stages answered from stored results because their inputs were unchanged"
+)
+LLM_CACHE = registry.counter(
+    "healthcrew_llm_cache_total",
+    "LLM calls looked up in the response cache, by outcome (hit, miss)"
+)
+DB_CACHE = registry.counter(
+    "healthcrew_db_cache_total",
+    "Patient and history reads by kind and outcome (hit: served from the read cache, miss: queried)"
+)
+LOCAL_EXTRACTIONS = registry.counter(
+    "healthcrew_local_extraction_total",
+    "Agent 1 extractions by who did them (local normalizer or llm fallback)"
+)
+SEMANTIC_CACHE = registry.counter(
+    "healthcrew_semantic_cache_total",
+    "Agent 3 assessments looked up in the near-duplicate cache, by outcome (hit, miss)"
+)
+
+
+def render_metrics():
+    return registry.render()
+
+
+def observe_db(query, seconds):
+    DB_QUERY_SECONDS.observe(seconds, query=query)
+
+
+def set_llm_queue_depth(model, depth):
+    LLM_QUEUE_DEPTH.set(depth, model=model)
+
+
+def observe_llm_queue_wait(model, priority, seconds):
+    LLM_QUEUE_WAIT_SECONDS.observe(seconds, model=model, priority=priority)
+
+
+def observe_llm_retry(model, reason, delay):
+    LLM_RETRIES.inc(model=model, reason=reason)
+    log_event("llm_retry", model=model, reason=reason, delay=round(delay, 3))
+
+
+def observe_llm_coalesced(model):
+    LLM_COALESCED.inc(model=model)
+
+
+def observe_llm_route(agent, endpoint, kind, outcome, seconds):
+    LLM_ROUTE_ATTEMPTS.inc(agent=agent, endpoint=endpoint, kind=kind, outcome=outcome)
+    log_event("llm_route", agent=agent, endpoint=endpoint, kind=kind, outcome=outcome,
+              seconds=round(seconds, 4))
+
+
+def llm_route_counts():
+    """Routed attempts per (kind, outcome), across agents and endpoints."""
+    counts = {}
+    for _, labels, value in LLM_ROUTE_ATTEMPTS.samples():
+        labels = dict(labels)
+        key = (labels["kind"], labels["outcome"])
+        counts[key] = counts.get(key, 0) + value
+    return counts
+
+
+def observe_llm_cache(hit):
+    LLM_CACHE.inc(outcome="hit" if hit else "miss")
+
+
+def llm_cache_counts():
+    """LLM response cache hits, misses and hit rate in this process."""
+    counts = {"hit": 0, "miss": 0}
+    for _, labels, value in LLM_CACHE.samples():
+        counts[dict(labels)["outcome"]] += value
+    total = counts["hit"] + counts["miss"]
+    return {"hits": counts["hit"], "misses": counts["miss"],
+            "hit_rate": round(counts["hit"] / total, 4) if total else 0.0}
+
+
+def observe_db_cache(kind, hit):
+    DB_CACHE.inc(kind=kind, outcome="hit" if hit else "miss")
+
+
+def db_cache_counts():
+    """Read cache hits and misses across all kinds."""
+    counts = {"hit": 0, "miss": 0}
+    for _, labels, value in DB_CACHE.samples():
+        outcome = dict(labels)["outcome"]
+        counts[outcome] += value
+    return counts
+
+
+def observe_tool(tool, seconds, ok=True):
+    TOOL_SECONDS.observe(seconds, tool=tool)
+    log_event("tool_call", tool=tool, seconds=round(seconds, 4), ok=ok)
+
+
+def observe_structured_output(schema, outcome, error=None):
+    """Count a schema check outcome.
+
+    valid: parsed as produced; repaired: fixed locally; rejected: the agent
+    is asked again; llm_converted: CrewAI's LLM converter had to step in.
+    """
+    STRUCTURED_OUTPUTS.inc(schema=schema, outcome=outcome)
+    log_event("structured_output", schema=schema, outcome=outcome, error=error)
+
+
+def structured_output_counts():
+    """Totals per outcome across all schemas."""
+    counts = {"valid": 0, "repaired": 0, "rejected": 0, "llm_converted": 0}
+    for _, labels, value in STRUCTURED_OUTPUTS.samples():
+        outcome = dict(labels)["outcome"]
+        counts[outcome] = counts.get(outcome, 0) + value
+    return counts
+
+
+def observe_stage_reuse(stage):
+    STAGE_REUSES.inc(stage=stage)
+    log_event("stage_reused", stage=stage)
+
+
+def observe_local_extraction(outcome, confidence):
+    LOCAL_EXTRACTIONS.inc(outcome=outcome)
+    log_event("local_extraction", outcome=outcome, confidence=round(confidence, 3))
+
+
+def observe_semantic_cache(outcome, similarity):
+    SEMANTIC_CACHE.inc(outcome=outcome)
+    log_event("semantic_cache", outcome=outcome, similarity=round(similarity, 4))
+
+
+def semantic_cache_counts():
+    """Near-duplicate assessment cache hits, misses and hit rate in this process."""
+    counts = {"hit": 0, "miss": 0}
+    for _, labels, value in SEMANTIC_CACHE.samples():
+        counts[dict(labels)["outcome"]] += value
+    total = counts["hit"] + counts["miss"]
+    return {"hits": counts["hit"], "misses": counts["miss"],
+            "hit_rate": round(counts["hit"] / total, 4) if total else 0.0}
+
+
+def observe_llm_call(agent, seconds, ok=True, prompt_tokens=0):
+    """Record one LLM call; prompt_tokens is the estimated size of its input."""
+    LLM_CALL_SECONDS.observe(seconds, agent=agent)
+    if not ok:
+        LLM_FAILURES.inc(agent=agent)
+    run = current_run.get()
+    stage = run.stage if run is not None else None
+    PROMPT_TOKENS.inc(prompt_tokens, stage=stage or "none")
+    if run is not None:
+        run.llm_call(ok, prompt_tokens)
+    log_event("llm_call", agent=agent, stage=stage, seconds=round(seconds, 4), ok=ok,
+              prompt_tokens=prompt_tokens)
+
+
+def prompt_token_counts():
+    """Estimated input tokens sent per stage in this process."""
+    counts = {}
+    for _, labels, value in PROMPT_TOKENS.samples():
+        stage = dict(labels)["stage"]
+        counts[stage] = counts.get(stage, 0) + value
+    return counts
+
+
+def observe_llm_usage(agent, model, prompt_tokens, completion_tokens, ttft=None, cached_tokens=0):
+    """Record tokens, estimated cost and time to first token of one provider call.
+
+    cached_tokens is the part of prompt_tokens the provider served from its
+    prompt cache, when it reports it.
+    """
+    LLM_TOKENS.inc(prompt_tokens, agent=agent, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, agent=agent, kind="completion")
+    if cached_tokens:
+        LLM_TOKENS.inc(cached_tokens, agent=agent, kind="cached_prompt")
+    cost = (prompt_tokens * PROMPT_COST_PER_1K + completion_tokens * COMPLETION_COST_PER_1K) / 1000
+    if cost:
+        LLM_COST.inc(cost, agent=agent)
+    if ttft is not None:
+        LLM_TTFT_SECONDS.observe(ttft, agent=agent)
+    log_event("llm_usage", agent=agent, model=model, prompt_tokens=prompt_tokens,
+              cached_prompt_tokens=cached_tokens, completion_tokens=completion_tokens, cost_usd=round(cost, 6),
+              ttft=round(ttft, 4) if ttft is not None else None)
+
+
+# The RunTracker of the analysis running in this thread / asyncio task
+current_run = ContextVar("current_run", default=None)
+
+
+class RunTracker:
+    """Stage-by-stage progress and timings for one analysis run.
+
+    `stages` is the ordered list of (name, label) the run goes through. Each
+    stage starts when the previous one finishes; `on_progress(fraction,
+    label)` is called on every transition, from the thread running the crew.
+    """
+
+    def __init__(self, run_id, stages, on_progress=None):
+        self.run_id = run_id
+        self.stages = list(stages)
+        self.on_progress = on_progress
+        self.timings = {}
+        self.prompt_tokens = {}
+        self._index = -1
+        self._started = None
+        self._llm_calls = self._failures = 0
+
+    def __enter__(self):
+        self._token = current_run.set(self)
+        self._advance()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_run.reset(self._token)
+        if exc_type is None:
+            self._notify(1.0, "Analysis complete")
+        log_event("run_finished", run_id=self.run_id, ok=exc_type is None, stages=self.timings,
+                  prompt_tokens=self.prompt_tokens)
+
+    def _notify(self, fraction, label):
+        if self.on_progress is not None:
+            self.on_progress(fraction, label)
+
+    def _advance(self):
+        self._index += 1
+        self._started = time.perf_counter()
+        self._llm_calls = self._failures = 0
+        if self._index < len(self.stages):
+            self._notify(self._index / len(self.stages), self.stages[self._index][1])
+
+    @property
+    def stage(self):
+        return self.stages[self._index][0] if 0 <= self._index < len(self.stages) else None
+
+    def llm_call(self, ok, prompt_tokens=0):
+        self._llm_calls += 1
+        if not ok:
+            self._failures += 1
+        if self.stage is not None:
+            self.prompt_tokens[self.stage] = self.prompt_tokens.get(self.stage, 0) + prompt_tokens
+
+    def finish_stage(self, name):
+        """Mark stage `name` done and start the next one."""
+        if name != self.stage:
+            return
+        seconds = time.perf_counter() - self._started
+        TASK_SECONDS.observe(seconds, stage=name)
+        self.timings[name] = round(seconds, 4)
+        log_event("task_finished", run_id=self.run_id, stage=name, seconds=round(seconds, 4),
+                  llm_calls=self._llm_calls, retries=self._failures,
+                  prompt_tokens=self.prompt_tokens.get(name, 0))
+        self._advance()
+
+    def stage_callback(self, name, callback=None):
+        """Task callback finishing stage `name`, then running `callback`."""
+        def finished(output):
+            if callback is not None:
+                callback(output)
+            self.finish_stage(name)
+        return finished
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve /metrics on port in a daemon thread (once per process); return the server."""
+    global _server
+    with _server_lock:
+        if _server is None and port:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True, name="metrics-http").start()
+            print(f"📈 Metrics at http://{host}:{port}/metrics")
+        return _server
@@ -0,0 +1,465 @@
+"""
+Medical analysis pipeline
+
+Leases the four agents from the process-wide AgentRegistry (built once, on
+the shared LLM client of each agent's model route), builds fresh tasks for
+each run and runs them with CrewAI.
+
+Pipeline modes:
+- "sequential": one crew, Agent 2 fetches history through its database tool
+- "prefetch":   the history is read from the database while Agent 1 runs and
+                is handed to Agent 2 directly, so Agent 2 needs no tool turn
+
+Agent 1 is skipped when SymptomNormalizer recognizes every symptom locally;
+its PatientDataOutput is then handed to Agent 2 like a prefetched history.
+
+Stage outputs are stored by StageResults under a hash of their inputs; a
+rerun for a returning patient reuses every stage whose inputs (symptoms,
+medical history) did not change and only runs the agents after that.
+
+With SEMANTIC_CACHE=on, Agent 2 finishes on its own crew and Agent 3 is
+skipped when SemanticCache holds the assessment of a near-duplicate patient
+(same background, similar standardized symptoms).
+
+Report modes:
+- "template": the HTML report is rendered locally from Agent 3's JSON
+              (ReportRenderer); Agent 4 only runs if rendering fails
+- "llm":      Agent 4 writes the HTML report
+
+Every run writes its outputs into its own RunWorkspace (Output/runs/<run_id>/).
+
+run_medical_analysis() is the blocking entry point. stream_medical_analysis()
+runs it in the background and streams tokens, Agent 3's fields and the
+report as they arrive (see Streaming). analyze_patient_async()
+runs the same pipeline on asyncio (native async crew kickoff, async LLM and
+database calls), and analyze_patients_async() fans it out over many patients
+with a semaphore bounding how many are in flight. Both entry points drive
+the one description of the stages in _analysis(); only how each step runs
+(blocking or awaited) differs.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from jinja2 import TemplateError
+
+# CrewAI, the task builders (Tasks), Streaming and SemanticCache (NumPy) are
+# imported where they are used, so importing this module for its modes and
+# defaults does not load the agent framework; it loads on the first analysis.
+from Agents import agent_registry, shared_llms
+from SymptomNormalizer import extract_patient_data
+from db import get_stage_results, get_stage_results_async
+from HistoryContext import build_history_context_async
+from StageResults import StageResults
+from Tools import format_patient_history
+from ReportRenderer import render_report
+from Metrics import RunTracker
+from Workspace import (
+    RunWorkspace,
+    cleanup_runs,
+    PATIENT_DATA_FILE,
+    HISTORY_FILE,
+    SUMMARY_FILE,
+    REPORT_FILE
+)
+
+PIPELINE_MODES = ("prefetch", "sequential")
+DEFAULT_PIPELINE_MODE = os.getenv("PIPELINE_MODE", "prefetch")
+
+REPORT_MODES = ("template", "llm")
+DEFAULT_REPORT_MODE = os.getenv("REPORT_MODE", "template")
+
+# Patient analyses in flight at once in analyze_patients_async()
+DEFAULT_ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", 24))
+
+# Background threads for database prefetches (each uses its own connection)
+_prefetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="history-prefetch")
+
+
+def _prefetch_history(national_id, symptoms=None):
+    """Read the patient's history the way the database tool would."""
+    try:
+        return format_patient_history(national_id, symptoms)
+    except Exception as e:
+        return f"Error retrieving history: {str(e)}"
+
+
+async def _prefetch_history_async(national_id, symptoms=None):
+    """Async counterpart of _prefetch_history."""
+    try:
+        return await build_history_context_async(national_id, symptoms)
+    except Exception as e:
+        return f"Error retrieving history: {str(e)}"
+
+
+def _crew(agents, tasks):
+    from crewai import Crew
+    from crewai.crew import Process
+    # Each agent needs only the output right before it, not all earlier ones
+    for previous, task in zip(tasks, tasks[1:]):
+        task.context = [previous]
+    return Crew(
+        agents=agents,
+        tasks=tasks,
+        verbose=False,
+        process=Process.sequential
+    )
+
+
+def _kickoff(agents, tasks):
+    """Run tasks in order with a sequential crew and return its output."""
+    return _crew(agents, tasks).kickoff()
+
+
+async def _akickoff(agents, tasks):
+    """Async _kickoff: native async execution where CrewAI provides it."""
+    crew = _crew(agents, tasks)
+    if hasattr(crew, "akickoff"):
+        return await crew.akickoff()
+    return await crew.kickoff_async()
+
+
+def _check_modes(mode, report_mode):
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode '{mode}', expected one of {PIPELINE_MODES}")
+    if report_mode not in REPORT_MODES:
+        raise ValueError(f"Unknown report mode '{report_mode}', expected one of {REPORT_MODES}")
+
+
+def _stage_labels(mode, report_mode):
+    """Ordered (stage, progress label) pairs a run goes through."""
+    report_label = "Writing report (Agent 4)" if report_mode == "llm" else "Rendering report"
+    history_label = "Combining medical history (Agent 2)" if mode == "prefetch" else "Retrieving medical history (Agent 2)"
+    return [
+        ("extraction", "Extracting patient data (Agent 1)"),
+        ("history", history_label),
+        ("evaluation", "Evaluating symptoms (Agent 3)"),
+        ("report", report_label),
+    ]
+
+
+def _bind(task, stage, file_name, workspace, tracker, results):
+    """Save the task's output to the workspace and stage results, and advance the tracker when it finishes."""
+    task.callback = tracker.stage_callback(stage, results.saver(stage, workspace.saver(file_name)))
+
+
+def _local_extraction(patient_name, patient_age, patient_gender, symptoms, workspace, tracker, results):
+    """Agent 1's JSON built without an LLM call, or None if the normalizer is unsure."""
+    patient = extract_patient_data(patient_name, patient_age, patient_gender, symptoms)
+    if patient is None:
+        return None
+    patient_data = patient.model_dump_json()
+    workspace.write(PATIENT_DATA_FILE, patient_data)
+    results.store("extraction", patient_data)
+    tracker.finish_stage("extraction")
+    return patient_data
+
+
+def _extraction_stage(patient_name, patient_age, patient_gender, symptoms, workspace, lease, tracker,
+                      results, patient_data=None):
+    """Agent 1 and its task, as the lists to put at the head of a crew.
+
+    Both lists are empty and patient_data is set when the extraction was
+    reused (patient_data given) or done locally; returns (agents, tasks, patient_data).
+    """
+    if patient_data is None:
+        patient_data = _local_extraction(patient_name, patient_age, patient_gender, symptoms,
+                                         workspace, tracker, results)
+    if patient_data is not None:
+        return [], [], patient_data
+
+    from Tasks import create_symptom_extraction_task
+
+    agent1_extractor = lease.get("extractor")
+    # Task outputs are saved atomically by callbacks, not by CrewAI's output_file
+    task1 = create_symptom_extraction_task(
+        patient_name=patient_name,
+        patient_age=patient_age,
+        patient_gender=patient_gender,
+        symptoms=symptoms,
+        agent=agent1_extractor,
+        output_dir=None
+    )
+    _bind(task1, "extraction", PATIENT_DATA_FILE, workspace, tracker, results)
+    return [agent1_extractor], [task1], None
+
+
+def _history_stage(national_id, workspace, lease, tracker, results, patient_history=None, patient_data=None):
+    """Agent 2 and its task; with patient_history given the agent gets no tools."""
+    from Tasks import create_medical_history_task
+
+    agent2_history = lease.get("history" if patient_history is None else "history_no_tools")
+    task2 = create_medical_history_task(
+        national_id=national_id,
+        agent=agent2_history,
+        patient_history=patient_history,
+        patient_data=patient_data,
+        output_dir=None
+    )
+    _bind(task2, "history", HISTORY_FILE, workspace, tracker, results)
+    return agent2_history, task2
+
+
+def _tail_stages(report_mode, workspace, lease, tracker, results, history=None, semantic=None):
+    """Agents and tasks that follow Agent 2 in the crew (history: Agent 2's output, when known).
+
+    With a SemanticCache and history given, Agent 3's assessment is indexed for later runs.
+    """
+    from Tasks import create_symptom_evaluation_task, create_medical_report_task
+
+    agent3_evaluator = lease.get("evaluator")
+    task3 = create_symptom_evaluation_task(agent3_evaluator, history=history, output_dir=None)
+    _bind(task3, "evaluation", SUMMARY_FILE, workspace, tracker, results)
+    if semantic is not None and history is not None:
+        task3.callback = semantic.saver(history, task3.callback)
+
+    tail_agents, tail_tasks = [agent3_evaluator], [task3]
+    if report_mode == "llm":
+        agent4_reporter = lease.get("reporter")
+        task4 = create_medical_report_task(agent4_reporter, output_dir=None)
+        _bind(task4, "report", REPORT_FILE, workspace, tracker, results)
+        tail_agents.append(agent4_reporter)
+        tail_tasks.append(task4)
+    return tail_agents, tail_tasks
+
+
+def _similar_assessment(semantic, history, workspace, tracker, results):
+    """Agent 3's JSON reused from a near-duplicate patient, or None to run Agent 3."""
+    if semantic is None:
+        return None
+    summary = semantic.lookup(history)
+    if summary is not None:
+        workspace.write(SUMMARY_FILE, summary)
+        results.store("evaluation", summary)
+        tracker.finish_stage("evaluation")
+    return summary
+
+
+def _report_agent(summary, workspace, lease, tracker, results):
+    """Agent 4 on its own crew, writing the report for Agent 3's summary."""
+    from Tasks import create_medical_report_task
+
+    agent4_reporter = lease.get("reporter")
+    task4 = create_medical_report_task(agent4_reporter, summary=summary, output_dir=None)
+    _bind(task4, "report", REPORT_FILE, workspace, tracker, results)
+    return _kickoff([agent4_reporter], [task4]).raw
+
+
+def _render_report(summary, workspace, lease, tracker, results):
+    """Render the report locally, falling back to Agent 4 if that fails."""
+    try:
+        html = render_report(summary)
+    except (ValueError, TemplateError) as e:
+        print(f"⚠️ Template report failed ({e}), falling back to the report agent")
+        return _report_agent(summary, workspace, lease, tracker, results)
+
+    workspace.write(REPORT_FILE, html)
+    tracker.finish_stage("report")
+    return html
+
+
+def _report(summary, report_mode, workspace, lease, tracker, results):
+    """The final report for a reused Agent 3 summary."""
+    if report_mode == "llm":
+        return _report_agent(summary, workspace, lease, tracker, results)
+    return _render_report(summary, workspace, lease, tracker, results)
+
+
+def _finish(output, report_mode, workspace, lease, tracker, results):
+    """Return the final report for the crew's last output."""
+    if report_mode == "llm":
+        return output.raw
+    return _render_report(output.raw, workspace, lease, tracker, results)
+
+
+# What _analysis() asks its driver for; the driver sends back the result
+_HISTORY = "history"    # (_HISTORY,): the prefetched history text
+_STORED = "stored"      # (_STORED, keys): get_stage_results(keys)
+_KICKOFF = "kickoff"    # (_KICKOFF, agents, tasks): the crew's output
+_BLOCKING = "blocking"  # (_BLOCKING, func, *args): func(*args), off the event loop in async runs
+
+
+def _analysis(patient_name, patient_age, patient_gender, symptoms, national_id, mode, report_mode,
+              workspace, lease, tracker):
+    """The stages of one run, shared by the blocking and asyncio entry points.
+
+    A generator: it yields the steps above, is sent each one's result by
+    _run_steps() or _arun_steps(), and returns the final report.
+    """
+    results = StageResults.for_run(patient_name, patient_age, patient_gender, symptoms, national_id,
+                                   report_mode)
+    reused = {}
+    if results.keys:
+        reused = results.reuse(workspace, tracker, (yield _STORED, tuple(results.keys.values())))
+        if "extraction" in reused:
+            # Later stages may be stored too; their keys need the history
+            results.add_history((yield _HISTORY,))
+            reused = results.reuse(workspace, tracker, (yield _STORED, tuple(results.keys.values())))
+    if "report" in reused:
+        return reused["report"]
+    if "evaluation" in reused:
+        return (yield _BLOCKING, _report, reused["evaluation"], report_mode, workspace, lease, tracker, results)
+
+    from SemanticCache import get_semantic_cache
+
+    semantic = get_semantic_cache()
+    history = reused.get("history")
+    if history is None:
+        head_agents, head_tasks, patient_data = _extraction_stage(
+            patient_name, patient_age, patient_gender, symptoms, workspace, lease, tracker,
+            results, patient_data=reused.get("extraction")
+        )
+        if mode == "sequential":
+            if results.needs_history():
+                results.add_history((yield _HISTORY,))
+            agent2_history, task2 = _history_stage(national_id, workspace, lease, tracker, results,
+                                                   patient_data=patient_data)
+            agents, tasks = head_agents + [agent2_history], head_tasks + [task2]
+        else:
+            if patient_data is None:
+                patient_data = (yield _KICKOFF, head_agents, head_tasks).raw
+            patient_history = yield _HISTORY,
+            results.add_history(patient_history)
+            agent2_history, task2 = _history_stage(
+                national_id, workspace, lease, tracker, results,
+                patient_history=patient_history,
+                patient_data=patient_data
+            )
+            agents, tasks = [agent2_history], [task2]
+        if semantic is None:
+            tail_agents, tail_tasks = _tail_stages(report_mode, workspace, lease, tracker, results)
+            output = yield _KICKOFF, agents + tail_agents, tasks + tail_tasks
+            return (yield _BLOCKING, _finish, output, report_mode, workspace, lease, tracker, results)
+        # Agent 2 finishes on its own crew so a near-duplicate can skip Agent 3
+        history = (yield _KICKOFF, agents, tasks).raw
+
+    summary = yield _BLOCKING, _similar_assessment, semantic, history, workspace, tracker, results
+    if summary is not None:
+        return (yield _BLOCKING, _report, summary, report_mode, workspace, lease, tracker, results)
+    tail_agents, tail_tasks = _tail_stages(report_mode, workspace, lease, tracker, results,
+                                           history=history, semantic=semantic)
+    output = yield _KICKOFF, tail_agents, tail_tasks
+    return (yield _BLOCKING, _finish, output, report_mode, workspace, lease, tracker, results)
+
+
+def _run_steps(steps, history_future):
+    """Carry out _analysis() steps on this thread and return the report."""
+    result = None
+    while True:
+        try:
+            step = steps.send(result)
+        except StopIteration as done:
+            return done.value
+        kind, args = step[0], step[1:]
+        if kind == _HISTORY:
+            result = history_future.result()
+        elif kind == _STORED:
+            result = get_stage_results(*args)
+        elif kind == _KICKOFF:
+            result = _kickoff(*args)
+        else:
+            result = args[0](*args[1:])
+
+
+async def _arun_steps(steps, history_task):
+    """Carry out _analysis() steps on the event loop and return the report."""
+    result = None
+    while True:
+        try:
+            step = steps.send(result)
+        except StopIteration as done:
+            return done.value
+        kind, args = step[0], step[1:]
+        if kind == _HISTORY:
+            result = await history_task
+        elif kind == _STORED:
+            result = await get_stage_results_async(*args)
+        elif kind == _KICKOFF:
+            result = await _akickoff(*args)
+        else:
+            # Report stages may call Agent 4 synchronously; keep them off the loop
+            result = await asyncio.to_thread(*args)
+
+
+def run_medical_analysis(patient_name, patient_age, patient_gender, symptoms, national_id,
+                         mode=DEFAULT_PIPELINE_MODE, report_mode=DEFAULT_REPORT_MODE,
+                         workspace=None, on_progress=None):
+    """Run the medical analysis and return the final HTML report.
+
+    Outputs are written to `workspace` (a new RunWorkspace if not given).
+    `on_progress(fraction, label)` is called as each stage starts. Stages
+    whose inputs match an earlier run are reused instead of rerun.
+    """
+    _check_modes(mode, report_mode)
+
+    # Start the database read now: it keys the stored results after the
+    # extraction, and in prefetch mode it is handed to Agent 2 directly
+    history_future = _prefetch_pool.submit(_prefetch_history, national_id, symptoms)
+
+    cleanup_runs()
+    workspace = workspace or RunWorkspace()
+
+    # Agents come ready-built from the registry; only the tasks are new per run
+    with agent_registry.lease() as lease, \
+            RunTracker(workspace.run_id, _stage_labels(mode, report_mode), on_progress) as tracker:
+        steps = _analysis(patient_name, patient_age, patient_gender, symptoms, national_id, mode, report_mode,
+                          workspace, lease, tracker)
+        return _run_steps(steps, history_future)
+
+
+def stream_medical_analysis(patient_name, patient_age, patient_gender, symptoms, national_id,
+                            mode=DEFAULT_PIPELINE_MODE, report_mode=DEFAULT_REPORT_MODE, workspace=None):
+    """Start run_medical_analysis on a background thread and return its RunStream.
+
+    Iterate the stream for StreamEvents (progress, LLM tokens, Agent 3's
+    fields as they parse, the report so far); the last one is "done" with
+    the report HTML, or "error" with the exception the run raised.
+    """
+    from Streaming import RunStream
+
+    _check_modes(mode, report_mode)
+    stream = RunStream(report_mode)
+    workspace = workspace or RunWorkspace()
+    workspace.on_write = stream.file_written
+    return stream.start(
+        shared_llms(), run_medical_analysis,
+        patient_name, patient_age, patient_gender, symptoms, national_id,
+        mode=mode, report_mode=report_mode, workspace=workspace, on_progress=stream.progress
+    )
+
+
+async def analyze_patient_async(patient_name, patient_age, patient_gender, symptoms, national_id,
+                                mode=DEFAULT_PIPELINE_MODE, report_mode=DEFAULT_REPORT_MODE,
+                                workspace=None, semaphore=None, on_progress=None):
+    """Async run_medical_analysis; `semaphore` optionally bounds concurrent runs."""
+    _check_modes(mode, report_mode)
+
+    async with semaphore or nullcontext():
+        history_task = asyncio.create_task(_prefetch_history_async(national_id, symptoms))
+
+        workspace = workspace or RunWorkspace()
+
+        with agent_registry.lease() as lease, \
+                RunTracker(workspace.run_id, _stage_labels(mode, report_mode), on_progress) as tracker:
+            steps = _analysis(patient_name, patient_age, patient_gender, symptoms, national_id, mode,
+                              report_mode, workspace, lease, tracker)
+            return await _arun_steps(steps, history_task)
+
+
+async def analyze_patients_async(patients, max_concurrency=DEFAULT_ASYNC_CONCURRENCY,
+                                 mode=DEFAULT_PIPELINE_MODE, report_mode=DEFAULT_REPORT_MODE):
+    """Analyze many patients concurrently, at most max_concurrency at a time.
+
+    `patients` is an iterable of dicts with patient_name, patient_age,
+    patient_gender, symptoms and national_id. Returns one entry per patient,
+    in order: the report HTML, or the exception that run raised.
+    """
+    cleanup_runs()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    runs = [
+        analyze_patient_async(**patient, mode=mode, report_mode=report_mode, semaphore=semaphore)
+        for patient in patients
+    ]
+    return await asyncio.gather(*runs, return_exceptions=True)
@@ -0,0 +1,10 @@
+"""
+Priority scale shared by the job queue (Jobs) and the LLM scheduler (LLMScheduler)
+
+Higher values go first, both when workers claim jobs and when queued LLM
+calls are dispatched.
+"""
+
+# Jobs submitted from the UI and interactive runs go before batch work
+PRIORITY_INTERACTIVE = 10
+PRIORITY_BATCH = 0
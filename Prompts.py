@@ -0,0 +1,82 @@
+"""
+Task instructions and the per-run data passed with them
+
+The instructions of every task are static: the same, byte for byte, for
+every patient. What changes from run to run (patient fields, national ID,
+medical history, earlier agents' JSON) is built by the *_data() functions
+and given to the task as context, which CrewAI places after the
+description, expected output and output schema. Everything before it is
+then one stable prefix that providers with prompt caching can reuse.
+
+JSON passed between agents is minified with compact_json().
+"""
+
+import json
+
+from JsonRepair import repair_json
+
+EXTRACTION = """PATIENT DATA EXTRACTION TASK
+Turn the patient info in the context below into one JSON object:
+1. name, age and gender exactly as given.
+2. symptoms: the reported symptoms as a list of separate, clean medical terms.
+Output only the JSON object: no explanation, markdown or comments."""
+
+_HISTORY_INTRO = """MEDICAL HISTORY PROCESSING TASK
+Combine Agent 1's JSON (name, age, gender, symptoms) in the context below with the patient's medical history."""
+
+_HISTORY_FROM_TOOLS = """1. Fetch the history with the patient history tool, passing the national ID from the context and the symptoms from Agent 1's JSON.
+To check something specific in a long record (e.g. an allergy), the history search tool returns only the entries that mention it."""
+
+_HISTORY_GIVEN = """1. The history is in the context, already retrieved from the database. Do not call any tools."""
+
+_HISTORY_STEPS = """2. From the history, extract medical events with their dates, chronic conditions (e.g. high blood pressure → Hypertension) and allergies.
+3. Answer with this JSON object, using empty lists when nothing is found:
+{"patient_info":{"name":"...","age":...,"gender":"...","current_symptoms":["..."]},"medical_history":[{"date":"YYYY-MM-DD","description":"..."}],"chronic_conditions":["..."],"allergies":["..."]}
+Output only the JSON object: no explanation or markdown."""
+
+HISTORY_WITH_TOOLS = "\n".join((_HISTORY_INTRO, _HISTORY_FROM_TOOLS, _HISTORY_STEPS))
+HISTORY_GIVEN = "\n".join((_HISTORY_INTRO, _HISTORY_GIVEN, _HISTORY_STEPS))
+
+EVALUATION = """SYMPTOM EVALUATION TASK
+Agent 2's JSON in the context below holds the patient info, dated medical history, chronic conditions and allergies.
+1. Analyze the current symptoms in light of the history.
+2. List possible (never confirmed) diagnoses and the risk factors.
+3. Assess severity (low, moderate, high) and urgency (routine, urgent, emergent).
+4. Recommend immediate actions, follow-up care, additional tests and precautions based on history and allergies.
+Summarize key history events in one sentence each.
+Output only the JSON object described by the schema below: no explanation or markdown."""
+
+REPORT = """REPORT GENERATION TASK
+Convert Agent 3's JSON assessment in the context below into a complete HTML document for doctors.
+Include the sections Patient Summary, Clinical Assessment and Recommendations, with headings, bold labels and paragraphs.
+Keep the styling minimal and clean, inline or in a <style> tag.
+Output only the HTML: no markdown or plain text."""
+
+
+def compact_json(text):
+    """The JSON object in text, minified; text itself (stripped) if it holds none."""
+    try:
+        data, _ = repair_json(text)
+    except ValueError:
+        return text.strip()
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def extraction_data(patient_name, patient_age, patient_gender, symptoms):
+    return (f"PATIENT INFO:\n- Name: {patient_name}\n- Age: {patient_age}\n"
+            f"- Gender: {patient_gender}\n- Symptoms: \"{symptoms}\"")
+
+
+def history_data(national_id, patient_history=None, patient_data=None):
+    """Agent 2's data; patient_data is Agent 1's JSON when it ran in another crew."""
+    parts = [f"- National ID: \"{national_id}\""]
+    if patient_history is not None:
+        parts.append(patient_history.strip())
+    if patient_data is not None:
+        parts.append(f"AGENT 1 OUTPUT:\n{compact_json(patient_data)}")
+    return "\n\n".join(parts)
+
+
+def upstream_data(agent, output):
+    """An earlier agent's output passed in directly rather than by the crew."""
+    return f"{agent} OUTPUT:\n{compact_json(output)}"
@@ -0,0 +1,56 @@
+"""
+Local HTML report renderer
+
+Turns Agent 3's structured JSON (the agentSummary.json schema) into the
+final HTML report with a Jinja template, without an LLM call.
+"""
+
+import os
+from datetime import datetime
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from JsonRepair import repair_json
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+REPORT_TEMPLATE = "medical_report.html"
+
+# Badge colours understood by the template
+KNOWN_LEVELS = ("low", "moderate", "high", "routine", "urgent", "emergent")
+
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(["html"]),
+)
+
+
+def extract_json_object(text):
+    """Parse the JSON object in an agent's output, tolerating fences and preamble."""
+    return repair_json(text)[0]
+
+
+def _level_class(value):
+    value = str(value or "").strip().lower()
+    return value if value in KNOWN_LEVELS else "unknown"
+
+
+def render_report(summary):
+    """Render the HTML report from Agent 3's output (JSON text or dict).
+
+    Raises ValueError when the output has none of the expected sections.
+    """
+    data = extract_json_object(summary)
+    if not any(key in data for key in ("patient_summary", "clinical_assessment", "recommendations")):
+        raise ValueError("Agent 3 output does not follow the summary schema")
+
+    patient = data.get("patient_summary") or {}
+    assessment = data.get("clinical_assessment") or {}
+    recommendations = data.get("recommendations") or {}
+    return _env.get_template(REPORT_TEMPLATE).render(
+        patient=patient,
+        assessment=assessment,
+        recommendations=recommendations,
+        severity_class=_level_class(assessment.get("severity_assessment")),
+        urgency_class=_level_class(assessment.get("urgency_level")),
+        generated_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
+    )
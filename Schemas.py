@@ -0,0 +1,58 @@
+"""
+Output schemas of the agents' tasks
+
+Plain Pydantic models with no CrewAI dependency, so code that only builds
+or validates agent output (SymptomNormalizer) can import them without
+loading the agent framework. Tasks.py re-exports them.
+"""
+
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any
+
+class PatientDataOutput(BaseModel):
+    """Output Json for agent1_extractor Agent 1"""
+
+    name: str = Field(..., title="Patient full name")
+    age: int = Field(..., title="Patient age in years")
+    gender: str = Field(..., title="Patient gender")
+    symptoms: List[str] = Field(..., title="List of standardized medical symptoms")
+
+class MedicalHistoryOutput(BaseModel):
+    """Output schema for Agent 2"""
+    patient_info: Dict[str, Any] = Field(..., title="Patient basic information from Agent 1")
+    medical_history: List[Dict[str, str]] = Field(..., title="Historical medical records")
+    chronic_conditions: List[str] = Field(default=[], title="Identified chronic conditions")
+    allergies: List[str] = Field(default=[], title="Known allergies")
+
+class PatientSummary(BaseModel):
+    """Patient part of Agent 3's summary"""
+    name: str = Field(..., title="Patient full name")
+    age: int = Field(..., title="Patient age in years")
+    gender: str = Field(..., title="Patient gender")
+    current_symptoms: List[str] = Field(default=[], title="Current symptoms")
+    medical_history_summary: List[str] = Field(default=[], title="Key historical events, one sentence each")
+
+class ClinicalAssessment(BaseModel):
+    """Clinical part of Agent 3's summary"""
+    symptom_analysis: str = Field(..., title="Explanation of current symptoms")
+    potential_diagnoses: List[str] = Field(default=[], title="Possible (not confirmed) diagnoses")
+    risk_factors: List[str] = Field(default=[], title="Risk factors")
+    severity_assessment: str = Field(..., title="low | moderate | high")
+    urgency_level: str = Field(..., title="routine | urgent | emergent")
+
+class Recommendations(BaseModel):
+    """Recommendations part of Agent 3's summary"""
+    immediate_actions: List[str] = Field(default=[], title="Immediate actions")
+    follow_up_care: List[str] = Field(default=[], title="Follow-up steps")
+    additional_tests: List[str] = Field(default=[], title="Suggested tests")
+    precautions: List[str] = Field(default=[], title="Precautions based on history and allergies")
+
+class SymptomEvaluationOutput(BaseModel):
+    """Output schema for Agent 3"""
+    patient_summary: PatientSummary
+    clinical_assessment: ClinicalAssessment
+    recommendations: Recommendations
+
+class InputData_for_tools(BaseModel):
+    """Input schema for tools"""
+    national_id: str = Field(..., title="Patient national ID")
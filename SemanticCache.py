@@ -0,0 +1,329 @@
+"""
+Near-duplicate cache of Agent 3's assessments
+
+Intakes worded differently ("bad cough and hard to breathe", "persistent
+cough, shortness of breath") mostly reach Agent 3 as the same standardized
+symptoms. For a patient with the same background, an earlier
+clinical_assessment and recommendations are reused instead of asking the
+LLM again.
+
+Each assessment is indexed by two things:
+
+- a fingerprint: the patient's chronic conditions and allergies, gender,
+  age group and the evaluating model. Only entries with the same
+  fingerprint are compared, so an assessment never reaches a patient with
+  a different background.
+- a symptom vector: the current symptoms in Agent 2's output (Agent 1's
+  PatientDataOutput symptoms). Each one is normalized by SymptomNormalizer,
+  then its base term and, at lower weight, its modifiers ("mild",
+  "persistent") are feature-hashed into DIMENSIONS floats. The vector is
+  L2-normalized.
+
+A lookup is one matrix-vector product over the fingerprint's vectors, which
+gives their cosine similarity. If the nearest entry reaches
+SEMANTIC_CACHE_THRESHOLD, it is reused. The patient summary is rebuilt from
+this patient's own Agent 2 output. Assessments are stored with the
+patient's name (whole words only) replaced by NAME_PLACEHOLDER, which is
+filled in with the new patient's name when one is reused.
+
+Entries are kept in a SQLite file (SEMANTIC_CACHE_PATH), with the vectors as
+float16 blobs. Each process holds the vectors in NumPy matrices and picks up
+rows that other processes add. The cache is off by default. A reused
+assessment was written for another patient, so check the threshold against
+your own intakes before enabling it.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from JsonRepair import repair_json
+from Metrics import observe_semantic_cache
+from Schemas import SymptomEvaluationOutput
+from SymptomNormalizer import MODIFIERS, normalize_symptoms
+
+# Settings read from the environment (see .env.examble)
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "off").lower() in ("1", "on", "true", "yes")
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "semantic_cache.db")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 20000))
+
+# Bump when the features, the fingerprint or the stored text change, so old entries stop matching
+INDEX_VERSION = 3
+DIMENSIONS = 256
+MODIFIER_WEIGHT = 0.3
+# Stands for the patient's name in stored assessments
+NAME_PLACEHOLDER = "{patient_name}"
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _age_group(age):
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return "unknown"
+    return "child" if age < 18 else "adult" if age < 65 else "older"
+
+
+def _normalized(values):
+    return sorted({" ".join(str(value).lower().split()) for value in values or [] if str(value).strip()})
+
+
+def fingerprint(profile):
+    """Hash of what must match exactly for an assessment to be reused, from Agent 2's output."""
+    from LLMRouter import route_for
+
+    info = profile.get("patient_info") or {}
+    # Agent 3's model route, resolved the way StageResults keys the evaluation
+    model = [os.getenv("LLM_MODE"), route_for("evaluator")]
+    blob = json.dumps([
+        INDEX_VERSION, model,
+        _normalized(profile.get("chronic_conditions")), _normalized(profile.get("allergies")),
+        str(info.get("gender", "")).strip().lower()[:1], _age_group(info.get("age"))
+    ], ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _features(symptom):
+    """{feature: weight} of one symptom: its standardized base terms and their modifiers."""
+    terms, confidence = normalize_symptoms(symptom)
+    if confidence < 1.0:
+        # Partly understood: keep the words as they are rather than drop the rest
+        terms = [symptom]
+    features = {}
+    for term in terms:
+        words = _WORD.findall(term.lower())
+        base = " ".join(word for word in words if word not in MODIFIERS)
+        if base:
+            features[f"term:{base}"] = 1.0
+        for word in words:
+            if word in MODIFIERS:
+                features.setdefault(f"modifier:{word}", MODIFIER_WEIGHT)
+    return features
+
+
+def symptom_vector(symptoms):
+    """L2-normalized, feature-hashed vector of a symptom list (all zeros when empty)."""
+    features = {}
+    for symptom in symptoms:
+        for feature, weight in _features(str(symptom)).items():
+            features[feature] = max(weight, features.get(feature, 0.0))
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for feature, weight in features.items():
+        value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        # Signed hashing: colliding features cancel out instead of piling up
+        vector[value % DIMENSIONS] += weight if value >> 63 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _profile(history):
+    """Agent 2's output as a dict, or None if it holds no patient_info."""
+    try:
+        data, _ = repair_json(history)
+    except ValueError:
+        return None
+    return data if isinstance(data.get("patient_info"), dict) else None
+
+
+def _map_strings(value, replace):
+    if isinstance(value, str):
+        return replace(value)
+    if isinstance(value, list):
+        return [_map_strings(item, replace) for item in value]
+    if isinstance(value, dict):
+        return {key: _map_strings(item, replace) for key, item in value.items()}
+    return value
+
+
+def strip_name(assessment, name):
+    """The assessment with whole-word mentions of `name` replaced by NAME_PLACEHOLDER."""
+    name = " ".join(str(name or "").split())
+    if not name:
+        return assessment
+    # Whole words only: a name like "Al" must not touch "Albumin"
+    pattern = re.compile(r"(?<!\w)" + r"\s+".join(map(re.escape, name.split())) + r"(?!\w)")
+    return _map_strings(assessment, lambda text: pattern.sub(NAME_PLACEHOLDER, text))
+
+
+def adapt(assessment, profile):
+    """Agent 3's JSON for this patient from a stored assessment, or None if it does not fit."""
+    info = profile["patient_info"]
+    name = str(info.get("name", "")).strip()
+    assessment = _map_strings(assessment, lambda text: text.replace(NAME_PLACEHOLDER, name or "the patient"))
+    summary = {
+        "patient_summary": {
+            "name": name,
+            "age": info.get("age"),
+            "gender": info.get("gender"),
+            "current_symptoms": list(info.get("current_symptoms") or []),
+            "medical_history_summary": [entry["description"] for entry in profile.get("medical_history") or []
+                                        if isinstance(entry, dict) and entry.get("description")],
+        },
+        **assessment
+    }
+    try:
+        return SymptomEvaluationOutput.model_validate(summary).model_dump_json()
+    except ValueError:
+        return None
+
+
+class SemanticCache:
+    """Agent 3 assessments indexed by symptom vector within each fingerprint."""
+
+    def __init__(self, path=SEMANTIC_CACHE_PATH, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # fingerprint -> (row ids, float32 matrix of their vectors); rows up to _last_id are loaded
+        self._groups = {}
+        self._loaded = 0
+        self._last_id = 0
+        with self._connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS assessments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    fingerprint TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    patient_name TEXT NOT NULL,
+                    assessment TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _refresh(self):
+        """Load the rows added since the last refresh, by this or another process (hold _lock)."""
+        if self._loaded > self.max_entries * 1.25:
+            # Rows evicted on disk are still in memory; start over
+            self._groups, self._loaded, self._last_id = {}, 0, 0
+        rows = self._connection().execute(
+            "SELECT id, fingerprint, vector FROM assessments WHERE id > ? ORDER BY id", (self._last_id,)
+        ).fetchall()
+        added = {}
+        for row_id, key, blob in rows:
+            ids, vectors = added.setdefault(key, ([], []))
+            ids.append(row_id)
+            vectors.append(np.frombuffer(blob, dtype=np.float16))
+        for key, (ids, vectors) in added.items():
+            ids, vectors = np.array(ids, dtype=np.int64), np.vstack(vectors).astype(np.float32)
+            if key in self._groups:
+                old_ids, old_vectors = self._groups[key]
+                ids, vectors = np.concatenate((old_ids, ids)), np.vstack((old_vectors, vectors))
+            self._groups[key] = (ids, vectors)
+        if rows:
+            self._loaded += len(rows)
+            self._last_id = rows[-1][0]
+
+    def nearest(self, key, vector):
+        """(row id, cosine similarity) of the entry nearest to vector under fingerprint key."""
+        with self._lock:
+            self._refresh()
+            group = self._groups.get(key)
+        if group is None:
+            return None, 0.0
+        ids, vectors = group
+        scores = vectors @ vector
+        best = int(np.argmax(scores))
+        return int(ids[best]), float(scores[best])
+
+    def lookup(self, history):
+        """Agent 3's JSON for Agent 2's output `history`, from a near-duplicate; None on a miss."""
+        profile = _profile(history)
+        if profile is None:
+            return None
+        vector = symptom_vector(profile["patient_info"].get("current_symptoms") or [])
+        if not vector.any():
+            return None
+        summary, similarity = None, 0.0
+        try:
+            row_id, similarity = self.nearest(fingerprint(profile), vector)
+            if row_id is not None and similarity >= self.threshold:
+                row = self._connection().execute(
+                    "SELECT assessment FROM assessments WHERE id = ?", (row_id,)
+                ).fetchone()
+                if row is not None:
+                    summary = adapt(json.loads(row[0]), profile)
+        except sqlite3.Error as e:
+            print(f"⚠️ Semantic cache lookup failed: {e}")
+        observe_semantic_cache("hit" if summary is not None else "miss", similarity)
+        return summary
+
+    def add(self, history, summary):
+        """Index Agent 3's JSON `summary`, written for Agent 2's output `history`."""
+        profile = _profile(history)
+        try:
+            data, _ = repair_json(summary)
+            evaluation = SymptomEvaluationOutput.model_validate(data)
+        except ValueError:
+            return
+        if profile is None:
+            return
+        vector = symptom_vector(profile["patient_info"].get("current_symptoms") or [])
+        if not vector.any():
+            return
+        name = evaluation.patient_summary.name
+        assessment = strip_name(evaluation.model_dump(include={"clinical_assessment", "recommendations"}), name)
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT INTO assessments (fingerprint, vector, patient_name, assessment, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (fingerprint(profile), vector.astype(np.float16).tobytes(), name,
+                     json.dumps(assessment, ensure_ascii=False), time.time())
+                )
+                overflow = conn.execute("SELECT COUNT(*) FROM assessments").fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    conn.execute(
+                        "DELETE FROM assessments WHERE id IN (SELECT id FROM assessments ORDER BY id LIMIT ?)",
+                        (overflow,)
+                    )
+        except sqlite3.Error as e:
+            # Losing an entry only costs an Agent 3 call later
+            print(f"⚠️ Could not index assessment: {e}")
+
+    def saver(self, history, callback=None):
+        """Task callback that runs `callback`, then indexes Agent 3's output for `history`."""
+        def save(output):
+            if callback is not None:
+                callback(output)
+            self.add(history, output.raw)
+        return save
+
+    def clear(self):
+        with self._lock, self._connection() as conn:
+            conn.execute("DELETE FROM assessments")
+            self._groups, self._loaded, self._last_id = {}, 0, 0
+
+
+# Process-wide cache shared by every run
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Return the shared semantic cache, or None when it is disabled."""
+    global _cache
+    if not SEMANTIC_CACHE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache()
+        return _cache
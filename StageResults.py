@@ -0,0 +1,168 @@
+"""
+Incremental re-analysis: stage outputs reused across runs
+
+Each pipeline stage's output is stored in the stage_results table under a
+hash of everything that went into it. The key chains the previous stage's
+key with the stage's own new input and the model route of the agent that
+serves it (LLM_ROUTE_*, see LLMRouter):
+
+- extraction: name, age, gender and symptoms
+- history:    the patient's medical_history entries
+- evaluation: nothing new (Agent 2's output only)
+- report:     nothing new (LLM report mode only; templates render locally)
+
+A returning patient with the same symptoms and no new add_medical_history()
+entries gets every stage back from the database without an LLM call. A new
+history entry reruns Agent 2 onwards; changed symptoms rerun everything.
+Symptoms the normalizer fully recognizes are keyed by their standardized
+terms, so "Cough, fever" and "fever and a cough" count as unchanged.
+
+Only the extraction key is known when a run starts. The others wait for
+add_history(), so the database read can run alongside Agent 1; they are
+only needed once a stored extraction is found or Agent 2 is about to run.
+
+Changed inputs leave the old rows behind, so every store also drops rows
+older than STAGE_RESULTS_MAX_AGE_DAYS and the oldest beyond
+STAGE_RESULTS_MAX_ENTRIES.
+
+Bump RESULTS_VERSION when a task prompt or output schema changes.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from db import get_stage_results, save_stage_result, prune_stage_results
+from Metrics import observe_stage_reuse
+from SymptomNormalizer import normalize_symptoms
+from Workspace import PATIENT_DATA_FILE, HISTORY_FILE, SUMMARY_FILE, REPORT_FILE
+
+STAGE_REUSE = os.getenv("STAGE_REUSE", "on") == "on"
+# Stored results are dropped after this many days, and the oldest beyond the cap (0 = keep)
+STAGE_RESULTS_MAX_AGE_DAYS = float(os.getenv("STAGE_RESULTS_MAX_AGE_DAYS", 30))
+STAGE_RESULTS_MAX_ENTRIES = int(os.getenv("STAGE_RESULTS_MAX_ENTRIES", 50000))
+RESULTS_VERSION = 4
+
+STAGES = ("extraction", "history", "evaluation", "report")
+STAGE_FILES = {
+    "extraction": PATIENT_DATA_FILE,
+    "history": HISTORY_FILE,
+    "evaluation": SUMMARY_FILE,
+    "report": REPORT_FILE,
+}
+
+# The agent (LLMRouter.ROUTE_AGENTS) whose model route serves each stage
+STAGE_AGENTS = {
+    "extraction": "extractor",
+    "history": "history",
+    "evaluation": "evaluator",
+    "report": "reporter",
+}
+
+
+def _hash(*parts):
+    blob = json.dumps(parts, default=str, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _model(stage):
+    """The model route that serves a stage, so a route change reruns it."""
+    from LLMRouter import route_for
+
+    return [os.getenv("LLM_MODE"), route_for(STAGE_AGENTS[stage])]
+
+
+def symptoms_key(symptoms):
+    """Symptoms ignoring case, spacing and order where every one was recognized."""
+    terms, confidence = normalize_symptoms(symptoms)
+    if terms and confidence >= 1.0:
+        return sorted(term.lower() for term in terms)
+    return " ".join(str(symptoms).lower().split())
+
+
+class StageResults:
+    """Input-hash keys of one run's stages, and access to their stored outputs.
+
+    With no keys (STAGE_REUSE=off) nothing is looked up or stored.
+    """
+
+    def __init__(self, national_id, keys=None, report_mode=None):
+        self.national_id = str(national_id)
+        self.keys = keys or {}
+        self.report_mode = report_mode
+        self.reused = {}
+        self._skipped = 0
+
+    @classmethod
+    def for_run(cls, patient_name, patient_age, patient_gender, symptoms, national_id,
+                report_mode, enabled=STAGE_REUSE):
+        """Keys of a run, up to the extraction (see add_history for the rest)."""
+        if not enabled:
+            return cls(national_id)
+        key = _hash(
+            RESULTS_VERSION, "extraction", _model("extraction"),
+            str(patient_name).strip(), str(patient_age).strip(), str(patient_gender).strip(),
+            symptoms_key(symptoms)
+        )
+        return cls(national_id, {"extraction": key}, report_mode)
+
+    def needs_history(self):
+        """True while the stages after the extraction wait for add_history()."""
+        return "extraction" in self.keys and "history" not in self.keys
+
+    def add_history(self, history_text):
+        """Key the stages after the extraction from the patient's medical history."""
+        if not self.needs_history():
+            return
+        keys = self.keys
+        keys["history"] = _hash(keys["extraction"], "history", _model("history"),
+                                self.national_id, history_text)
+        keys["evaluation"] = _hash(keys["history"], "evaluation", _model("evaluation"))
+        if self.report_mode == "llm":
+            keys["report"] = _hash(keys["evaluation"], "report", _model("report"))
+
+    def reuse(self, workspace, tracker, stored=None):
+        """Outputs of the stages this run can skip, as {stage: output}.
+
+        Those are the stages up to the last keyed one with a stored result.
+        Their outputs are written to `workspace` and `tracker` is advanced
+        past them. Called again after add_history(), it carries on from the
+        stages already skipped. `stored` is a prefetched get_stage_results()
+        answer.
+        """
+        if not self.keys:
+            return {}
+        if stored is None:
+            stored = get_stage_results(self.keys.values())
+        last = max((i for i, stage in enumerate(STAGES) if self.keys.get(stage) in stored), default=-1)
+
+        for stage in STAGES[self._skipped:last + 1]:
+            output = stored.get(self.keys[stage])
+            if output is not None:
+                workspace.write(STAGE_FILES[stage], output)
+                self.reused[stage] = output
+                observe_stage_reuse(stage)
+            tracker.finish_stage(stage)
+        self._skipped = max(self._skipped, last + 1)
+        return dict(self.reused)
+
+    def store(self, stage, output):
+        """Remember a stage's output for later runs with the same inputs."""
+        key = self.keys.get(stage)
+        if key is None or not output:
+            return
+        try:
+            save_stage_result(key, self.national_id, stage, output)
+            prune_stage_results(STAGE_RESULTS_MAX_AGE_DAYS, STAGE_RESULTS_MAX_ENTRIES)
+        except sqlite3.Error as e:
+            # Losing a stored result only costs a recomputation later
+            print(f"⚠️ Could not store {stage} result: {e}")
+
+    def saver(self, stage, callback=None):
+        """Task callback that stores the task's output for `stage`, then runs `callback`."""
+        def save(output):
+            if callback is not None:
+                callback(output)
+            self.store(stage, output.raw)
+        return save
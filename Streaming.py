@@ -0,0 +1,202 @@
+"""
+Live output of an analysis run for the UI
+
+Pipeline.stream_medical_analysis() runs an analysis on a background thread
+and returns its RunStream. Iterating the stream yields StreamEvents as the
+run goes:
+
+- progress: (fraction, label) as each stage starts
+- text:     what the stage's current LLM call has written so far
+- fields:   Agent 3's assessment fields that have fully arrived (a dict)
+- report:   the report so far: rendered from the partial assessment in
+            template mode, Agent 4's HTML as it is written in llm mode
+- stage:    a stage's final output, once it is saved to the workspace
+- done:     the final report HTML (or error: the exception the run raised)
+
+Tokens come from the LLMStreamChunkEvent CrewAI emits on the thread making
+the call, so the run's stream and current stage are found through context
+variables and concurrent runs never mix. Streaming is switched on for the
+run's calls only (call_stream_override); the shared clients stay
+non-streaming for everyone else. Cache hits and coalesced calls produce no
+tokens; their stage shows up whole when it finishes. Tokens that still
+arrive for a finished stage (from a hedged call that lost the race) are
+dropped.
+"""
+
+import contextlib
+import queue
+import threading
+import time
+from contextvars import ContextVar
+
+from crewai.events import crewai_event_bus
+from crewai.events.types.llm_events import LLMStreamChunkEvent
+from crewai.llms.base_llm import call_stream_override
+from jinja2 import TemplateError
+
+from JsonRepair import partial_json
+from LLMRouter import provider_llms
+from Metrics import current_run
+from ReportRenderer import render_report
+from StageResults import STAGE_FILES
+
+FILE_STAGES = {name: stage for stage, name in STAGE_FILES.items()}
+
+# Updates where only the latest one matters; older ones still queued are dropped
+SUPERSEDED = ("text", "fields", "report")
+
+current_stream = ContextVar("current_stream", default=None)
+
+
+class StreamEvent:
+    """One update from a streaming run."""
+
+    __slots__ = ("kind", "stage", "data")
+
+    def __init__(self, kind, stage=None, data=None):
+        self.kind = kind
+        self.stage = stage
+        self.data = data
+
+    def __repr__(self):
+        return f"StreamEvent({self.kind!r}, {self.stage!r})"
+
+
+def report_preview(text):
+    """The HTML part of Agent 4's answer so far."""
+    marker = text.rfind("Final Answer:")
+    if marker != -1:
+        text = text[marker + len("Final Answer:"):]
+    start = text.find("<")
+    return text[start:] if start != -1 else ""
+
+
+class RunStream:
+    """Events of one analysis run, passed from the crew's thread to the reader.
+
+    `first_output` and `first_fields` are the seconds from the start of the
+    run to its first token (or stage output) and to Agent 3's first field.
+    """
+
+    def __init__(self, report_mode="template"):
+        self.report_mode = report_mode
+        self.started = time.perf_counter()
+        self.first_output = None
+        self.first_fields = None
+        self._events = queue.Queue()
+        self._calls = {}
+        self._call_stages = {}
+        self._finished = set()
+        self._text = {}
+        self._fields = None
+
+    def _put(self, kind, stage=None, data=None):
+        if self.first_output is None and kind != "progress":
+            self.first_output = time.perf_counter() - self.started
+        self._events.put(StreamEvent(kind, stage, data))
+
+    def progress(self, fraction, label):
+        """on_progress hook for run_medical_analysis()."""
+        self._put("progress", data=(fraction, label))
+
+    def chunk(self, stage, call_id, text):
+        """A token of `stage`'s LLM call; a new call_id starts the text over."""
+        # A call belongs to the stage it started in, even if it outlives it
+        stage = self._call_stages.setdefault(call_id, stage)
+        if stage in self._finished:
+            return
+        if self._calls.get(stage) != call_id:
+            self._calls[stage] = call_id
+            self._text[stage] = ""
+        self._text[stage] += text
+        so_far = self._text[stage]
+        self._put("text", stage, so_far)
+        if stage == "evaluation":
+            self._assessment(so_far)
+        elif stage == "report" and self.report_mode == "llm":
+            self._put("report", "report", report_preview(so_far))
+
+    def _assessment(self, text):
+        fields = partial_json(text)
+        if not fields or fields == self._fields:
+            return
+        if self.first_fields is None:
+            self.first_fields = time.perf_counter() - self.started
+        self._fields = fields
+        self._put("fields", "evaluation", fields)
+        if self.report_mode == "template":
+            try:
+                self._put("report", "report", render_report(fields))
+            except (ValueError, TemplateError):
+                pass  # no report section has arrived yet
+
+    def file_written(self, name, text):
+        """RunWorkspace on_write hook: a stage's output is final."""
+        stage = FILE_STAGES.get(name)
+        if stage is None:
+            return
+        self._finished.add(stage)
+        if stage == "evaluation":
+            self._assessment(text)
+        self._put("stage", stage, text)
+        if stage == "report":
+            self._put("report", "report", text)
+
+    def start(self, llms, target, *args, **kwargs):
+        """Run target(*args, **kwargs) on a daemon thread with every provider inside `llms` streaming."""
+        def run():
+            token = current_stream.set(self)
+            try:
+                with contextlib.ExitStack() as stack:
+                    for llm in llms:
+                        for provider in provider_llms(llm):
+                            stack.enter_context(call_stream_override(provider, True))
+                    result = target(*args, **kwargs)
+            except Exception as e:
+                self._put("error", data=e)
+            else:
+                self._put("done", data=result)
+            finally:
+                current_stream.reset(token)
+
+        install_stream_handler()
+        threading.Thread(target=run, name="analysis-stream", daemon=True).start()
+        return self
+
+    def __iter__(self):
+        """Events until the run ends, skipping updates already superseded in the queue."""
+        while True:
+            batch = [self._events.get()]
+            while True:
+                try:
+                    batch.append(self._events.get_nowait())
+                except queue.Empty:
+                    break
+            latest = {(event.kind, event.stage): i for i, event in enumerate(batch)}
+            for i, event in enumerate(batch):
+                if event.kind in SUPERSEDED and latest[(event.kind, event.stage)] != i:
+                    continue
+                yield event
+                if event.kind in ("done", "error"):
+                    return
+
+
+def _on_stream_chunk(source, event):
+    stream = current_stream.get()
+    tracker = current_run.get()
+    if stream is None or tracker is None or tracker.stage is None or not event.chunk:
+        return
+    stream.chunk(tracker.stage, event.call_id, event.chunk)
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install_stream_handler():
+    """Subscribe the token handler to CrewAI's event bus (once per process)."""
+    global _installed
+    with _install_lock:
+        if not _installed:
+            crewai_event_bus.register_handler(LLMStreamChunkEvent, _on_stream_chunk)
+            _installed = True
@@ -0,0 +1,217 @@
+"""
+Local symptom normalizer for Agent 1
+
+Most intakes are a name, age and gender copied from the form plus a short
+list of everyday complaints ("tummy ache, threw up, running a temperature").
+extract_patient_data() turns those into a PatientDataOutput without an LLM
+call: the symptom text is split into fragments and every fragment is matched
+word by word against a trie of lay phrases mapping to standardized terms.
+
+The match comes with a confidence, the share of meaningful words that were
+understood. Anything below LOCAL_EXTRACTION_MIN_CONFIDENCE (by default, any
+word not understood, and any negation such as "no fever") returns None so
+the pipeline runs Agent 1 as before.
+"""
+
+import os
+import re
+
+from Metrics import observe_local_extraction
+from Schemas import PatientDataOutput
+
+LOCAL_EXTRACTION = os.getenv("LOCAL_EXTRACTION", "on") == "on"
+MIN_CONFIDENCE = float(os.getenv("LOCAL_EXTRACTION_MIN_CONFIDENCE", 1.0))
+
+# Standardized term -> lay phrases that mean it (the term itself always matches).
+# Only phrases with the same clinical meaning: ones that would lose it
+# ("weakness", "feeling faint", "angina", "migraine") are left to Agent 1
+SYMPTOM_SYNONYMS = {
+    "Fever": ["temperature", "high temperature", "running a temperature", "febrile", "pyrexia",
+              "feverish", "feeling hot"],
+    "Chills": ["shivering", "shivers", "rigors", "feeling cold", "cold sweats"],
+    "Cough": ["coughing", "dry cough", "hacking cough"],
+    "Productive cough": ["wet cough", "chesty cough", "coughing up phlegm", "coughing up mucus",
+                         "phlegm", "mucus", "sputum"],
+    "Coughing up blood": ["hemoptysis", "haemoptysis", "blood in sputum", "blood in phlegm"],
+    "Sore throat": ["throat pain", "painful throat", "scratchy throat", "pharyngitis",
+                    "pain when swallowing", "painful swallowing"],
+    "Runny nose": ["rhinorrhea", "rhinorrhoea", "running nose", "nose running"],
+    "Nasal congestion": ["stuffy nose", "blocked nose", "stuffed nose", "congestion", "congested"],
+    "Sneezing": ["sneezes", "sneeze"],
+    "Shortness of breath": ["breathlessness", "breathless", "dyspnea", "dyspnoea", "out of breath",
+                            "short of breath", "difficulty breathing", "trouble breathing",
+                            "hard to breathe", "cant breathe", "cannot breathe", "sob"],
+    "Wheezing": ["wheeze", "wheezy", "whistling breath"],
+    "Chest pain": ["pain in chest", "chest ache", "chest hurts", "chest tightness", "tight chest"],
+    "Palpitations": ["racing heart", "heart racing", "pounding heart", "heart pounding",
+                     "fluttering heart", "irregular heartbeat", "skipped beats"],
+    "Headache": ["head ache", "head pain", "head hurts", "cephalgia"],
+    "Dizziness": ["dizzy", "lightheaded", "light headed", "lightheadedness", "vertigo",
+                  "room spinning", "giddy"],
+    "Fainting": ["fainted", "syncope", "passed out", "blacked out", "loss of consciousness"],
+    "Confusion": ["confused", "disoriented", "disorientation"],
+    "Fatigue": ["tired", "tiredness", "exhausted", "exhaustion", "no energy", "lack of energy",
+                "lethargy", "lethargic", "malaise", "worn out"],
+    "Muscle pain": ["myalgia", "body aches", "body ache", "aching muscles", "muscle aches",
+                    "sore muscles", "aches"],
+    "Joint pain": ["arthralgia", "aching joints", "sore joints", "joint ache", "joints hurt"],
+    "Back pain": ["backache", "back ache", "lower back pain", "back hurts"],
+    "Neck stiffness": ["stiff neck", "neck pain"],
+    "Abdominal pain": ["stomach ache", "stomachache", "tummy ache", "belly ache", "bellyache",
+                       "stomach pain", "belly pain", "tummy pain", "abdominal cramps",
+                       "stomach cramps", "cramps"],
+    "Nausea": ["nauseous", "nauseated", "feeling sick", "queasy", "sick to my stomach"],
+    "Vomiting": ["vomit", "vomited", "throwing up", "threw up", "throw up", "emesis", "being sick"],
+    "Diarrhea": ["diarrhoea", "loose stools", "loose stool", "watery stools"],
+    "Constipation": ["constipated", "cant poop", "hard stools"],
+    "Heartburn": ["acid reflux", "reflux", "indigestion", "dyspepsia"],
+    "Bloating": ["bloated", "swollen belly", "gas", "flatulence"],
+    "Loss of appetite": ["no appetite", "poor appetite", "not hungry", "anorexia", "appetite loss"],
+    "Weight loss": ["losing weight", "lost weight"],
+    "Blood in stool": ["bloody stool", "bloody stools", "rectal bleeding", "black stools",
+                       "melena"],
+    "Painful urination": ["burning urination", "burning when urinating", "burning when peeing",
+                          "dysuria", "pain when urinating", "pain when peeing", "stinging urine"],
+    "Frequent urination": ["peeing a lot", "urinating often", "polyuria", "frequency"],
+    "Blood in urine": ["hematuria", "haematuria", "bloody urine", "red urine"],
+    "Excessive thirst": ["very thirsty", "always thirsty", "polydipsia", "thirst"],
+    "Rash": ["skin rash", "spots", "hives", "red spots", "blotches", "urticaria"],
+    "Itching": ["itchy", "itch", "itchiness", "pruritus"],
+    "Swelling": ["swollen", "edema", "oedema", "puffiness"],
+    "Leg swelling": ["swollen legs", "swollen ankles", "ankle swelling", "swollen feet"],
+    "Numbness": ["numb", "pins and needles", "tingling", "loss of feeling"],
+    "Blurred vision": ["blurry vision", "vision blurred", "cant see clearly", "double vision"],
+    "Ear pain": ["earache", "ear ache", "ear hurts", "otalgia"],
+    "Loss of smell": ["anosmia", "cant smell"],
+    "Loss of taste": ["ageusia", "cant taste"],
+    "Night sweats": ["sweating at night", "sweats at night"],
+    "Sweating": ["sweaty", "sweats", "diaphoresis", "perspiring"],
+    "Insomnia": ["cant sleep", "trouble sleeping", "sleeplessness", "poor sleep"],
+    "Anxiety": ["anxious", "nervous", "panic", "worried"],
+    "Low mood": ["depressed", "feeling down", "sad", "depression"],
+    "High blood pressure": ["hypertension", "raised blood pressure", "elevated blood pressure"],
+}
+
+# Words that qualify the next symptom ("mild fever" -> "Mild fever")
+MODIFIERS = {
+    "mild", "slight", "moderate", "severe", "bad", "terrible", "extreme", "intense",
+    "persistent", "constant", "chronic", "acute", "intermittent", "recurrent", "occasional",
+    "sudden", "sharp", "dull", "throbbing", "burning", "high", "low", "worsening", "frequent",
+}
+
+# Words that carry no symptom meaning (duration, connectives, pronouns)
+FILLER = {
+    "a", "an", "the", "my", "i", "im", "ive", "have", "has", "had", "having", "got", "getting",
+    "some", "little", "bit", "of", "very", "really", "quite", "also", "feel", "feeling", "feels",
+    "since", "for", "about", "around", "past", "last", "this", "these", "days", "day", "weeks",
+    "week", "months", "month", "hours", "hour", "yesterday", "today", "morning", "night",
+    "nights", "ago", "couple", "few", "several", "on", "off", "at", "times", "sometimes",
+    "patient", "reports", "complains", "c", "o", "is", "am", "are", "been", "was", "lot",
+    "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+}
+
+# Negated symptoms must not end up in the list; leave those to the LLM
+NEGATIONS = {"no", "not", "without", "denies", "deny", "denied", "never", "none", "nor", "negative"}
+
+_FRAGMENT_SPLIT = re.compile(r"[,;/\n+&]|\band\b|\bwith\b|\bplus\b|\balso\b|\bbut\b")
+_WORD = re.compile(r"[a-z0-9]+")
+_END = "$"
+
+
+def _words(text):
+    return _WORD.findall(text.lower().replace("'", "").replace("’", ""))
+
+
+def _build_trie(synonyms):
+    """Word-level trie: nested dicts keyed by word, _END holding the standardized term."""
+    trie = {}
+    for term, phrases in synonyms.items():
+        for phrase in [term] + phrases:
+            node = trie
+            for word in _words(phrase):
+                node = node.setdefault(word, {})
+            node[_END] = term
+    return trie
+
+
+_TRIE = _build_trie(SYMPTOM_SYNONYMS)
+
+
+def _longest_match(words, start):
+    """(term, end) for the longest phrase in the trie starting at words[start], or (None, start)."""
+    node, match = _TRIE, (None, start)
+    for i in range(start, len(words)):
+        node = node.get(words[i])
+        if node is None:
+            break
+        if _END in node:
+            match = (node[_END], i + 1)
+    return match
+
+
+def _qualified(modifiers, term):
+    if not modifiers:
+        return term
+    return f"{' '.join(modifiers).capitalize()} {term[0].lower()}{term[1:]}"
+
+
+def normalize_symptoms(text):
+    """Standardized symptom terms for a free-text symptom list, and the match confidence.
+
+    Confidence is the share of meaningful words (not filler) that were part
+    of a recognized phrase or qualified one; it is 0.0 when nothing matched
+    or the text negates a symptom.
+    """
+    terms, understood, unknown = [], 0, 0
+    for fragment in _FRAGMENT_SPLIT.split(text or ""):
+        words = _words(fragment)
+        modifiers, i = [], 0
+        while i < len(words):
+            word = words[i]
+            # Phrases first: "no appetite" is a symptom, "no fever" is not
+            term, end = _longest_match(words, i)
+            if term is not None:
+                terms.append(_qualified(modifiers, term))
+                understood += end - i + len(modifiers)
+                modifiers, i = [], end
+                continue
+            if word in NEGATIONS:
+                return [], 0.0
+            if word in MODIFIERS:
+                modifiers.append(word)
+            elif word not in FILLER and not word.isdigit():
+                unknown += 1
+            i += 1
+        if modifiers:
+            if terms:
+                terms[-1] = _qualified(modifiers, terms[-1])  # "headache, severe"
+                understood += len(modifiers)
+            else:
+                unknown += len(modifiers)  # "severe" on its own qualifies nothing
+
+    terms = list(dict.fromkeys(terms))
+    if not terms:
+        return [], 0.0
+    return terms, understood / (understood + unknown)
+
+
+def extract_patient_data(patient_name, patient_age, patient_gender, symptoms,
+                         min_confidence=MIN_CONFIDENCE):
+    """Agent 1's output built locally, or None when the LLM should do it."""
+    if not LOCAL_EXTRACTION or not str(patient_name).strip() or not str(patient_gender).strip():
+        return None
+    try:
+        age = int(patient_age)
+    except (TypeError, ValueError):
+        return None
+    terms, confidence = normalize_symptoms(symptoms)
+    if confidence < min_confidence:
+        observe_local_extraction("llm", confidence)
+        return None
+    observe_local_extraction("local", confidence)
+    return PatientDataOutput(
+        name=str(patient_name).strip(),
+        age=age,
+        gender=str(patient_gender).strip(),
+        symptoms=terms
+    )
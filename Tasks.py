@@ -1,192 +1,160 @@
+import os
 from crewai import Task
-from openpyxl.styles.builtins import output
-from pydantic import BaseModel, Field
-from typing import List, Dict, Any
-
-class PatientDataOutput(BaseModel):
-    """Output Json for agent1_extractor Agent 1"""
-
-    name: str = Field(..., title="Patient full name")
-    age: int = Field(..., title="Patient age in years")
-    gender: str = Field(..., title="Patient gender")
-    symptoms: List[str] = Field(..., title="List of standardized medical symptoms")
-
-class MedicalHistoryOutput(BaseModel):
-    """Output schema for Agent 2"""
-    patient_info: Dict[str, Any] = Field(..., title="Patient basic information from Agent 1")
-    medical_history: List[Dict[str, str]] = Field(..., title="Historical medical records")
-    chronic_conditions: List[str] = Field(default=[], title="Identified chronic conditions")
-    allergies: List[str] = Field(default=[], title="Known allergies")
-class InputData_for_tools(BaseModel):
-    """Input schema for tools"""
-    national_id: str = Field(..., title="Patient national ID")
+from crewai.utilities.converter import Converter
+from pydantic import ValidationError
+from typing import Any, Tuple
+from JsonRepair import repair_json
+from Metrics import observe_structured_output
+import Prompts
+from Schemas import (
+    PatientDataOutput,
+    MedicalHistoryOutput,
+    PatientSummary,
+    ClinicalAssessment,
+    Recommendations,
+    SymptomEvaluationOutput,
+    InputData_for_tools
+)
+
+def schema_guardrail(model):
+    """Task guardrail that validates the output against a Pydantic schema.
+
+    Fences, preamble, trailing commas and similar slips are repaired locally
+    and the task output is replaced by the clean JSON, so downstream agents
+    and the saved files see exactly the schema. Only output that cannot be
+    repaired is rejected, which makes CrewAI ask the agent again.
+    """
+    schema = model.__name__
+
+    def guardrail(output) -> Tuple[bool, Any]:
+        try:
+            data, repaired = repair_json(output.raw)
+            clean = model.model_validate(data).model_dump_json()
+        except (ValueError, ValidationError) as e:
+            observe_structured_output(schema, "rejected", str(e)[:500])
+            return False, f"Output must be a single JSON object matching the {schema} schema: {e}"
+        observe_structured_output(schema, "repaired" if repaired else "valid")
+        return True, clean
+
+    return guardrail
+
+class RepairingConverter(Converter):
+    """Converts task output to its schema locally, asking the LLM only as a last resort.
+
+    CrewAI's own converter sends anything that is not bare JSON back to the
+    LLM with conversion instructions; this one tries repair_json() first.
+    """
+
+    def _convert_locally(self):
+        data, _ = repair_json(self.text)
+        return self.model.model_validate(data)
+
+    def to_pydantic(self, current_attempt=1):
+        try:
+            return self._convert_locally()
+        except (ValueError, ValidationError):
+            observe_structured_output(self.model.__name__, "llm_converted")
+            return super().to_pydantic(current_attempt)
+
+    async def ato_pydantic(self, current_attempt=1):
+        try:
+            return self._convert_locally()
+        except (ValueError, ValidationError):
+            observe_structured_output(self.model.__name__, "llm_converted")
+            return await super().ato_pydantic(current_attempt)
+
+class ContextTask(Task):
+    """Task whose per-run data is given as context, after all of its instructions.
+
+    CrewAI builds the prompt as description, expected output, output schema
+    and then the context (earlier tasks' output). With the description kept
+    static (Prompts) and `data` joined to the context, every prompt of a
+    task starts with the same text whatever the patient, so providers can
+    serve that prefix from their prompt cache.
+    """
+
+    data: str | None = None
+
+    def _with_data(self, context):
+        return "\n\n".join(part for part in (self.data, context) if part) or None
+
+    def execute_sync(self, agent=None, context=None, tools=None):
+        return super().execute_sync(agent, self._with_data(context), tools)
+
+    def execute_async(self, agent=None, context=None, tools=None):
+        return super().execute_async(agent, self._with_data(context), tools)
+
+    async def aexecute_sync(self, agent=None, context=None, tools=None):
+        return await super().aexecute_sync(agent, self._with_data(context), tools)
+
+def _output_file(output_dir, name):
+    """Path CrewAI should write a task's output to (None disables the write)."""
+    return os.path.join(output_dir, name) if output_dir else None
+
 def create_symptom_extraction_task(patient_name: str, patient_age: int, 
-                                 patient_gender: str, symptoms: str, agent):
+                                 patient_gender: str, symptoms: str, agent,
+                                 output_dir: str = "Output"):
     """Simplified task: extract and save basic patient data and symptoms."""
-    return Task(
-        description=f"""
-        PATIENT DATA EXTRACTION TASK
-
-        PATIENT INFO:
-        - Name: {patient_name}
-        - Age: {patient_age}
-        - Gender: {patient_gender}
-        - Symptoms: "{symptoms}"
-
-        YOUR TASK:
-        1. Extract the name, age, and gender exactly as given.
-        2. Analyze the symptoms and return them as a list of clean, medically phrased terms.
-        3. Ensure the final output is a valid JSON object with the following structure:
-
-        {{
-          "name": "{patient_name}",
-          "age": {patient_age},
-          "gender": "{patient_gender}",
-          "symptoms": ["Symptom 1", "Symptom 2", "Symptom 3"]
-        }}
-
-        RULES:
-        - Only output a single JSON object.
-        - No explanation, no markdown, no comments — just JSON.
-        - Symptoms must be clearly written and separated.
-        """,
+    return ContextTask(
+        description=Prompts.EXTRACTION,
+        data=Prompts.extraction_data(patient_name, patient_age, patient_gender, symptoms),
         agent=agent,
         expected_output="A single JSON object with patient name, age, gender, and symptoms",
-        output_file="Output/PatientData.json"
+        output_pydantic=PatientDataOutput,
+        guardrail=schema_guardrail(PatientDataOutput),
+        converter_cls=RepairingConverter,
+        output_file=_output_file(output_dir, "PatientData.json")
     )
 
-def create_medical_history_task(national_id: str, agent):
-    """Agent 2 Task: Use Agent 1 output + database tool to generate full medical history profile"""
-    return Task(
-        description=f"""
-    MEDICAL HISTORY PROCESSING TASK
-
-    You are given:
-    1. Patient data from a previous agent in structured JSON format.
-    2. Access to a tool called `get_patient_history` that accepts a national ID and returns plain text.
-
-    Your steps:
-    1. Parse the previous agent's JSON output to extract: name, age, gender, and symptoms.
-    2. Use the tool `get_patient_history` with national ID: "{national_id}" to fetch historical medical notes.
-    3. From the plain text tool response, extract:
-       - Medical events and dates
-       - Chronic conditions (e.g., high blood pressure → Hypertension)
-       - Allergies (if mentioned)
-    4. Combine both Agent 1 data and tool results into this JSON format:
-
-    {{
-      "patient_info": {{
-        "name": "...",
-        "age": ...,
-        "gender": "...",
-        "current_symptoms": ["...", "..."]
-      }},
-      "medical_history": [
-        {{
-          "date": "YYYY-MM-DD",
-          "description": "event details"
-        }}
-      ],
-      "chronic_conditions": ["condition1", "condition2"],
-      "allergies": ["allergy1", "allergy2"]
-    }}
-
-    Rules:
-    - If no medical history is found, use empty lists or "None"
-    - Only output the final JSON object — no explanation or markdown
-    - Always start from the structured JSON provided by Agent 1
-    """,
+def create_medical_history_task(national_id: str, agent, patient_history: str = None,
+                                patient_data: str = None, output_dir: str = "Output"):
+    """Agent 2 Task: Use Agent 1 output + database tool to generate full medical history profile
+
+    When patient_history is given (prefetched from the database) it is passed
+    with the task and the tool step is skipped. patient_data carries Agent
+    1's JSON when it ran in a separate crew.
+    """
+    return ContextTask(
+        description=Prompts.HISTORY_WITH_TOOLS if patient_history is None else Prompts.HISTORY_GIVEN,
+        data=Prompts.history_data(national_id, patient_history, patient_data),
         agent=agent,
         expected_output="A single clean JSON object combining Agent 1 data with patient medical history",
-        output_file="Output/agentHistory.json"
+        output_pydantic=MedicalHistoryOutput,
+        guardrail=schema_guardrail(MedicalHistoryOutput),
+        converter_cls=RepairingConverter,
+        output_file=_output_file(output_dir, "agentHistory.json")
     )
 
 
 
 
-def create_symptom_evaluation_task(agent):
-    """Agent 3 Task: Auto-uses Agent 2's output to generate clinical summary"""
-    return Task(
-        description="""
-        SYMPTOM EVALUATION TASK - AGENT 3
-
-        CONTEXT:
-        You are the third agent in a multi-agent medical system.
-        You receive the output from the previous agent (Agent 2) in structured JSON format, containing:
-        - Patient info (name, age, gender, symptoms)
-        - Medical history (events with dates and descriptions)
-        - Chronic conditions
-        - Allergies
-
-        YOUR TASK:
-        1. Read the previous JSON output
-        2. Analyze current symptoms in light of the history
-        3. Identify possible (not confirmed) diagnoses
-        4. Assess severity and urgency level
-        5. Provide recommendations for the doctor:
-           - Follow-up actions
-           - Suggested tests
-           - Precautions based on history/allergies
-
-        OUTPUT FORMAT:
-        Return ONLY this valid JSON structure:
-
-        {
-          "patient_summary": {
-            "name": "...",
-            "age": ...,
-            "gender": "...",
-            "current_symptoms": [...],
-            "medical_history_summary": [
-              "Short summary of key historical events (1 sentence each)"
-            ]
-          },
-          "clinical_assessment": {
-            "symptom_analysis": "Detailed explanation of current symptoms",
-            "potential_diagnoses": ["Possible diagnosis 1", "2"],
-            "risk_factors": ["Risk 1", "2"],
-            "severity_assessment": "low | moderate | high",
-            "urgency_level": "routine | urgent | emergent"
-          },
-          "recommendations": {
-            "immediate_actions": ["Action 1", "2"],
-            "follow_up_care": ["Follow-up steps"],
-            "additional_tests": ["Test 1", "Test 2"],
-            "precautions": ["Avoid x due to allergy y"]
-          }
-        }
-
-        RULES:
-        - Do NOT provide confirmed diagnoses
-        - Do NOT output markdown or extra explanation — only JSON
-        - Start with: "Based on the previous agent's output..."
-        """,
+def create_symptom_evaluation_task(agent, history: str = None, output_dir: str = "Output"):
+    """Agent 3 Task: Auto-uses Agent 2's output to generate clinical summary
+
+    history carries Agent 2's JSON when it did not run in the same crew
+    (reused from an earlier run).
+    """
+    return ContextTask(
+        description=Prompts.EVALUATION,
+        data=Prompts.upstream_data("AGENT 2", history) if history is not None else None,
         agent=agent,
         expected_output="Final structured JSON with clinical evaluation and guidance",
-        output_file="Output/agentSummary.json"
+        output_pydantic=SymptomEvaluationOutput,
+        guardrail=schema_guardrail(SymptomEvaluationOutput),
+        converter_cls=RepairingConverter,
+        output_file=_output_file(output_dir, "agentSummary.json")
     )
 
-def create_medical_report_task(agent):
-    """Agent 4 Task: Generate human-readable medical report"""
-    return Task(
-        description="""
-            REPORT GENERATION TASK - AGENT 4
-
-            INSTRUCTIONS:
-            1. You will receive the complete output from Agent 3.
-            2. Convert the structured JSON into a complete and styled HTML document.
-            3. The HTML must include the following sections:
-               - Patient Summary
-               - Clinical Assessment
-               - Recommendations
-            4. Use HTML headings, bold labels, and paragraphs.
-            5. Apply minimal but clean styling: use CSS inline or inside <style> tag.
-            6. Avoid markdown or plain text — output only HTML.
-
-            OUTPUT FORMAT:
-            Output ONLY the final HTML string.
-            """,
+def create_medical_report_task(agent, summary: str = None, output_dir: str = "Output"):
+    """Agent 4 Task: Generate human-readable medical report
+
+    summary carries Agent 3's output when it ran in a separate crew
+    (template report mode falling back to this agent).
+    """
+    return ContextTask(
+        description=Prompts.REPORT,
+        data=Prompts.upstream_data("AGENT 3", summary) if summary is not None else None,
         agent=agent,
         expected_output="A full HTML report styled and organized based on Agent 3's output",
-        output_file="Output/final_report.html"
+        output_file=_output_file(output_dir, "final_report.html")
     )
@@ -1,33 +1,92 @@
-from crewai.tools import tool
-from db import get_patient_medical_history, get_patient_by_national_id
-import json
-from datetime import datetime
+"""
+Agent tools and the history text they return
 
-@tool
-def get_patient_history_tool(national_id: str) -> str:
+get_patient_history_tool and search_patient_history_tool are CrewAI tools,
+built on first access (module __getattr__) so that importing Tools for
+format_patient_history() does not load CrewAI.
+"""
+
+from db import search_medical_history
+import threading
+import time
+from Metrics import observe_tool
+from HistoryContext import build_history_context
+
+def format_patient_history(national_id: str, symptoms: str = None) -> str:
+    """Plain-text medical history for a patient, as shown to Agent 2.
+
+    Long records are bounded by HistoryContext: the most relevant recent
+    entries plus a rolling summary of older ones.
+    """
+    return build_history_context(national_id, symptoms)
+
+def _get_patient_history_tool(national_id: str, symptoms: str = "") -> str:
     """    
-    Get complete medical history for a patient using their national ID.
+    Get the medical history for a patient using their national ID: the most
+    relevant recent entries and a summary of older ones.
     
     Args:
         national_id: The patient's national ID as a string
+        symptoms: The patient's current symptoms, comma-separated; entries
+            related to them are kept first when the record is long
         
     Returns:
         str: Plain text medical history descriptions or error message"""
+    started = time.perf_counter()
     try:
-        # Get patient medical history
-        history_entries = get_patient_medical_history(national_id)
-        
-        if not history_entries:
-            return "No medical history found for this patient."
-        
-        # Format history entries as plain text
-        history_text = "Medical History:\n"
-        for i, (description, timestamp) in enumerate(history_entries, 1):
-            history_text += f"{i}. {description} (Date: {timestamp})\n"
-        
-        return history_text
+        history = format_patient_history(national_id, symptoms)
+        observe_tool("get_patient_history_tool", time.perf_counter() - started)
+        return history
         
     except Exception as e:
+        observe_tool("get_patient_history_tool", time.perf_counter() - started, ok=False)
         return f"Error retrieving history: {str(e)}"
 
+# Most entries search_patient_history_tool returns
+SEARCH_TOOL_LIMIT = 20
+
+def _search_patient_history_tool(national_id: str, query: str) -> str:
+    """
+    Search a patient's medical history for entries mentioning some words
+    (e.g. "penicillin", "asthma inhaler") instead of reading the whole record.
+
+    Args:
+        national_id: The patient's national ID as a string
+        query: Words to look for; entries mentioning any of them are returned
+
+    Returns:
+        str: Matching entries with dates, best matches first, matched words in [brackets]"""
+    started = time.perf_counter()
+    try:
+        rows = search_medical_history(query, national_id=national_id,
+                                      limit=SEARCH_TOOL_LIMIT, match_all=False)
+        observe_tool("search_patient_history_tool", time.perf_counter() - started)
+        if not rows:
+            return f"No medical history entries mention: {query}"
+        lines = [f"Entries mentioning {query}:"]
+        lines.extend(f"{i}. {snippet} (Date: {timestamp})"
+                     for i, (_, _, _, timestamp, snippet) in enumerate(rows, 1))
+        return "\n".join(lines)
+
+    except Exception as e:
+        observe_tool("search_patient_history_tool", time.perf_counter() - started, ok=False)
+        return f"Error searching history: {str(e)}"
+
+
+# Tool name -> function the CrewAI tool is built from on first access
+_TOOL_FUNCTIONS = {
+    "get_patient_history_tool": _get_patient_history_tool,
+    "search_patient_history_tool": _search_patient_history_tool,
+}
+_tools_lock = threading.Lock()
+
 
+def __getattr__(name):
+    func = _TOOL_FUNCTIONS.get(name)
+    if func is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from crewai.tools import tool
+    with _tools_lock:
+        if name not in globals():
+            globals()[name] = tool(name)(func)
+    return globals()[name]
@@ -0,0 +1,102 @@
+"""
+Per-run output workspaces
+
+Each analysis writes its agent outputs into its own directory,
+Output/runs/<run_id>/, so concurrent runs never overwrite each other.
+Files are written atomically (temp file + rename) so readers never see a
+partial report, and old run directories are removed after a retention
+period.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+OUTPUT_ROOT = os.getenv("OUTPUT_ROOT", "Output")
+RUNS_DIR = os.path.join(OUTPUT_ROOT, "runs")
+RETENTION_HOURS = float(os.getenv("OUTPUT_RETENTION_HOURS", 24))
+
+# File names written by each stage
+PATIENT_DATA_FILE = "PatientData.json"
+HISTORY_FILE = "agentHistory.json"
+SUMMARY_FILE = "agentSummary.json"
+REPORT_FILE = "final_report.html"
+
+
+def new_run_id():
+    """Return a sortable, collision-free run ID."""
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+def write_atomic(path, text):
+    """Write text to path so readers see either the old or the new file, never a partial one."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class RunWorkspace:
+    """Output directory for a single analysis run.
+
+    `on_write(name, text)`, if set, is called after each file is written.
+    """
+
+    def __init__(self, run_id=None, root=RUNS_DIR, on_write=None):
+        self.run_id = run_id or new_run_id()
+        self.path = os.path.join(root, self.run_id)
+        self.on_write = on_write
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def write(self, name, text):
+        path = self.file(name)
+        write_atomic(path, text)
+        if self.on_write is not None:
+            self.on_write(name, text)
+        return path
+
+    def read(self, name):
+        """Return the file's text, or None if it has not been written."""
+        try:
+            with open(self.file(name), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def saver(self, name):
+        """Task callback that stores a task's raw output in this workspace."""
+        return lambda output: self.write(name, output.raw)
+
+    @property
+    def report_path(self):
+        return self.file(REPORT_FILE)
+
+
+def cleanup_runs(root=RUNS_DIR, retention_hours=RETENTION_HOURS):
+    """Delete run directories untouched for longer than retention_hours; return how many."""
+    if not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - retention_hours * 3600
+    removed = 0
+    for entry in os.scandir(root):
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except FileNotFoundError:
+            continue  # removed concurrently by another worker
+    return removed
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark patient lookups: one connection per call vs pooled connections
+
+Usage: python benchmarks/bench_db.py [--patients 5000] [--lookups 20000] [--threads 4]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+# Time SQLite itself, not the in-process read cache in front of it
+db.READ_CACHE = False
+
+
+def seed(patients):
+    """Create the schema and insert synthetic patients and history."""
+    db.init_database()
+    conn = db.get_db_connection()
+    with conn:
+        conn.executemany(
+            db.INSERT_PATIENT_SQL,
+            ((f"ID{i:08d}", f"Patient {i}", 20 + i % 60, "Male" if i % 2 else "Female") for i in range(patients))
+        )
+        conn.executemany(
+            db.INSERT_HISTORY_SQL,
+            ((f"ID{i:08d}", f"Routine checkup #{i}") for i in range(patients))
+        )
+
+
+def legacy_lookup(national_id):
+    """The original data-layer pattern: connect, query, close."""
+    conn = sqlite3.connect(db.DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute(db.SELECT_PATIENT_SQL, (str(national_id),))
+    patient = cursor.fetchone()
+    conn.close()
+    return patient
+
+
+def run(lookup, ids, threads):
+    """Return lookups per second for `lookup` spread over `threads` threads."""
+    chunk = len(ids) // threads
+
+    def worker(part):
+        for national_id in part:
+            lookup(national_id)
+        db.close_db_connections()
+
+    workers = [threading.Thread(target=worker, args=(ids[i * chunk:(i + 1) * chunk],)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return chunk * threads / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--patients", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        seed(args.patients)
+        ids = [f"ID{random.randrange(args.patients):08d}" for _ in range(args.lookups)]
+
+        print(f"{args.lookups} lookups over {args.patients} patients")
+        for threads in sorted({1, args.threads}):
+            before = run(legacy_lookup, ids, threads)
+            after = run(db.check_patient_by_national_id, ids, threads)
+            print(f"  threads={threads:<3} connect-per-call: {before:>10,.0f}/s   "
+                  f"pooled: {after:>10,.0f}/s   speedup: {after / before:.1f}x")
+        db.close_db_connections()
+
+
+if __name__ == "__main__":
+    main()
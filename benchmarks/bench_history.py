@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark get_patient_medical_history as the history table grows
+
+Seeds synthetic databases of increasing size and times the per-patient
+history query with the migration-2 index and, for contrast, without it.
+With the index the cost tracks the patient's own row count, not the table.
+
+Usage: python benchmarks/bench_history.py [--sizes 10000 100000 1000000] [--per-patient 20]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+# Time SQLite itself, not the in-process read cache in front of it
+db.READ_CACHE = False
+
+HISTORY_INDEX = "idx_medical_history_patient_time"
+
+
+def seed(rows, per_patient):
+    """Create a migrated database holding `rows` history entries."""
+    db.init_database()
+    patients = max(1, rows // per_patient)
+    conn = db.get_db_connection()
+    with conn:
+        conn.executemany(
+            db.INSERT_PATIENT_SQL,
+            ((f"ID{i:08d}", f"Patient {i}", 20 + i % 60, "Female") for i in range(patients))
+        )
+        conn.executemany(
+            "INSERT INTO medical_history (national_id, description, timestamp) VALUES (?, ?, ?)",
+            ((f"ID{random.randrange(patients):08d}", "Follow-up visit, blood pressure reviewed",
+              f"20{10 + i % 15:02d}-{1 + i % 12:02d}-{1 + i % 28:02d} 10:00:00") for i in range(rows))
+        )
+    return patients
+
+
+def time_queries(patients, queries):
+    """Return mean milliseconds per history query."""
+    ids = [f"ID{random.randrange(patients):08d}" for _ in range(queries)]
+    start = time.perf_counter()
+    for national_id in ids:
+        db.get_patient_medical_history(national_id)
+    return (time.perf_counter() - start) * 1000 / queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--per-patient", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--scan-queries", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'indexed ms':>11} {'scan ms':>9}  plan")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db.DB_PATH = os.path.join(tmp, "bench.db")
+            patients = seed(size, args.per_patient)
+            conn = db.get_db_connection()
+            plan = conn.execute("EXPLAIN QUERY PLAN " + db.SELECT_HISTORY_SQL, ("ID0",)).fetchone()[3]
+            indexed = time_queries(patients, args.queries)
+
+            conn.execute(f"DROP INDEX {HISTORY_INDEX}")
+            scan = time_queries(patients, args.scan_queries)
+            db.close_db_connections()
+        print(f"{size:>10,} {indexed:>11.3f} {scan:>9.3f}  {plan}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark the bounded history context against the full history text
+
+For patients with increasingly long records, compares the size of the full
+history (what Agent 2 used to receive) with build_history_context(), and
+times building the context cold (rolling summary computed), warm (summary
+reused) and after one new entry (summary extended incrementally).
+
+Usage: python benchmarks/bench_history_context.py [--lengths 10 100 1000 10000] [--budget 1500]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+# Time SQLite itself, not the in-process read cache in front of it
+db.READ_CACHE = False
+from HistoryContext import build_history_context, estimate_tokens
+
+NOTES = (
+    "Follow-up visit, blood pressure reviewed",
+    "Routine check, all normal",
+    "Seasonal asthma, inhaler refilled",
+    "Lab work: HbA1c within target range",
+    "Allergic to penicillin, documented after rash",
+)
+
+
+def seed(national_id, length):
+    db.create_patient(f"Patient {length}", national_id, 60, "Female")
+    conn = db.get_db_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO medical_history (national_id, description, timestamp) "
+            "VALUES (?, ?, datetime('now', ?))",
+            ((national_id, f"{NOTES[i % len(NOTES)]} (visit {i})", f"-{length - i} days") for i in range(length))
+        )
+
+
+def full_history_text(national_id):
+    rows = db.get_patient_medical_history(national_id)
+    return "\n".join(f"{i}. {description} (Date: {timestamp})" for i, (description, timestamp) in enumerate(rows, 1))
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--budget", type=int, default=1500, help="context token budget")
+    args = parser.parse_args()
+
+    print(f"{'entries':>8} {'full tokens':>12} {'context tokens':>15} {'cold ms':>9} {'warm ms':>9} {'+1 entry ms':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        db.init_database()
+        for length in args.lengths:
+            national_id = f"CTX{length}"
+            seed(national_id, length)
+            full = full_history_text(national_id)
+            context, cold = timed(build_history_context, national_id, "cough", args.budget)
+            _, warm = timed(build_history_context, national_id, "cough", args.budget)
+            db.add_medical_history(national_id, "New visit: persistent cough")
+            _, incremental = timed(build_history_context, national_id, "cough", args.budget)
+            print(f"{length:>8,} {estimate_tokens(full):>12,} {estimate_tokens(context):>15,} "
+                  f"{cold:>9.2f} {warm:>9.2f} {incremental:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
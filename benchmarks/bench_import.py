@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark bulk import against row-by-row inserts
+
+Loads the same synthetic clinic (patients with a few history entries each)
+three ways: create_patient()/add_medical_history() per row, BulkIO with
+index upkeep per row, and BulkIO with index upkeep deferred to the end.
+
+Usage: python benchmarks/bench_import.py [--patients 1000 10000 50000] [--entries 5]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from BulkIO import import_records
+
+NOTES = (
+    "Follow-up visit, blood pressure reviewed",
+    "Routine check, all normal",
+    "Seasonal asthma, inhaler refilled",
+    "Allergic to penicillin, documented after rash",
+)
+
+
+def records(patients, entries):
+    for i in range(patients):
+        national_id = f"ID{i:08d}"
+        yield "patient", {"national_id": national_id, "name": f"Patient {i}", "age": 20 + i % 60, "gender": "Female"}
+        for j in range(entries):
+            yield "history", {"national_id": national_id, "description": f"{NOTES[j % len(NOTES)]} ({j})",
+                              "timestamp": f"2020-{1 + j % 12:02d}-01"}
+
+
+def row_by_row(patients, entries):
+    for kind, record in records(patients, entries):
+        if kind == "patient":
+            db.create_patient(record["name"], record["national_id"], record["age"], record["gender"])
+        else:
+            db.add_medical_history(record["national_id"], record["description"])
+
+
+def timed_load(load, patients, entries):
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            db.init_database()
+            started = time.perf_counter()
+            load(patients, entries)
+            elapsed = time.perf_counter() - started
+        db.close_db_connections()
+    return patients * (entries + 1) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--patients", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--entries", type=int, default=5, help="history entries per patient")
+    args = parser.parse_args()
+
+    loads = {
+        "row by row": row_by_row,
+        "bulk": lambda p, e: import_records(records(p, e), defer_indexes=False),
+        "bulk, deferred": lambda p, e: import_records(records(p, e)),
+    }
+    print(f"{'patients':>9} " + " ".join(f"{name + ' rows/s':>22}" for name in loads))
+    for patients in args.patients:
+        rates = [timed_load(load, patients, args.entries) for load in loads.values()]
+        print(f"{patients:>9,} " + " ".join(f"{rate:>22,.0f}" for rate in rates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+End-to-end pipeline benchmark against the local mock LLM server
+
+Runs the real pipeline (CrewAI, agents, database, report rendering) against
+benchmarks/mock_llm_server.py, so results depend only on the code and the
+configured mock latency. It covers five scenarios for each pipeline mode:
+
+- single:     runs one after another
+- concurrent: runs in a thread pool
+- async:      analyze_patients_async()
+- batch:      Batch.run_batch()
+- stream:     stream_medical_analysis(), one after another
+
+For each scenario it reports latency percentiles, throughput and the mean
+time of each stage; the stream scenario also reports the time to the first
+streamed output and to Agent 3's first assessment field. Results are saved as JSON in benchmarks/results/.
+Pass --compare to diff against an earlier result file.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--runs 8] [--concurrency 4] [--latency 0.2]
+        [--tokens-per-sec 200] [--modes prefetch sequential] [--compare results/<file>.json]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SCENARIOS = ("single", "concurrent", "async", "batch", "stream")
+
+sys.path.insert(0, ROOT)
+
+
+def configure_environment(base_url, workdir):
+    """Point the app at the mock server and a scratch directory before it is imported."""
+    os.environ.update({
+        "LLM_MODE": "openrouter",
+        "LLM_MODEL": "openai/mock",
+        "LLM_BASE_URL": base_url,
+        "OPENAI_API_KEY": "mock",
+        "LLM_CACHE": "off",
+        "STAGE_REUSE": "off",
+        # Every run goes through Agent 1, not the local symptom normalizer
+        "LOCAL_EXTRACTION": "off",
+        # Measure the pipeline, not the provider rate limit
+        "LLM_RATE_PER_MINUTE": "0",
+        "METRICS_LOG": "off",
+        "OUTPUT_ROOT": os.path.join(workdir, "Output"),
+    })
+    import db
+    db.DB_PATH = os.path.join(workdir, "bench.db")
+    db.init_database()
+
+
+def seed_patients(count):
+    import db
+    patients = []
+    for i in range(count):
+        national_id = f"BENCH{i:05d}"
+        db.create_patient(f"Patient {i}", national_id, 30 + i % 50, "Female" if i % 2 else "Male")
+        db.add_medical_history(national_id, "Diagnosed with high blood pressure. Allergic to penicillin.")
+        db.add_medical_history(national_id, "Seasonal asthma, uses inhaler.")
+        patients.append({
+            "patient_name": f"Patient {i}",
+            "patient_age": 30 + i % 50,
+            "patient_gender": "Female" if i % 2 else "Male",
+            "symptoms": "persistent cough, mild fever and fatigue",
+            "national_id": national_id,
+        })
+    return patients
+
+
+class StageClock:
+    """on_progress hook that turns stage transitions into per-stage durations."""
+
+    def __init__(self):
+        self.stages = {}
+        self._label, self._at = None, None
+
+    def __call__(self, fraction, label):
+        now = time.perf_counter()
+        if self._label is not None:
+            self.stages[self._label] = now - self._at
+        self._label, self._at = label, now
+
+
+def summarize(latencies, wall, stage_runs):
+    latencies = sorted(latencies)
+    stages = {}
+    for clock in stage_runs:
+        for label, seconds in clock.stages.items():
+            stages.setdefault(label, []).append(seconds)
+    return {
+        "runs": len(latencies),
+        "wall_seconds": round(wall, 3),
+        "throughput_per_min": round(len(latencies) / wall * 60, 2) if wall else 0.0,
+        "latency_mean": round(statistics.mean(latencies), 4),
+        "latency_p50": round(latencies[len(latencies) // 2], 4),
+        "latency_p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 4),
+        "stages_mean": {label: round(statistics.mean(values), 4) for label, values in stages.items()},
+    }
+
+
+def timed_run(patient, mode):
+    from Pipeline import run_medical_analysis
+    clock = StageClock()
+    started = time.perf_counter()
+    run_medical_analysis(**patient, mode=mode, on_progress=clock)
+    return time.perf_counter() - started, clock
+
+
+def scenario_single(patients, mode, concurrency):
+    started = time.perf_counter()
+    results = [timed_run(patient, mode) for patient in patients]
+    return summarize([r[0] for r in results], time.perf_counter() - started, [r[1] for r in results])
+
+
+def scenario_concurrent(patients, mode, concurrency):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda patient: timed_run(patient, mode), patients))
+    return summarize([r[0] for r in results], time.perf_counter() - started, [r[1] for r in results])
+
+
+def scenario_async(patients, mode, concurrency):
+    from Pipeline import analyze_patient_async
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(patient):
+            clock = StageClock()
+            async with semaphore:
+                started = time.perf_counter()
+                await analyze_patient_async(**patient, mode=mode, on_progress=clock)
+                return time.perf_counter() - started, clock
+
+        return await asyncio.gather(*(one(patient) for patient in patients))
+
+    started = time.perf_counter()
+    results = asyncio.run(run_all())
+    return summarize([r[0] for r in results], time.perf_counter() - started, [r[1] for r in results])
+
+
+def scenario_batch(patients, mode, concurrency):
+    from Batch import run_batch
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path, output_path = os.path.join(tmp, "in.jsonl"), os.path.join(tmp, "out.jsonl")
+        with open(input_path, "w", encoding="utf-8") as f:
+            for patient in patients:
+                f.write(json.dumps({"national_id": patient["national_id"], "symptoms": patient["symptoms"]}) + "\n")
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_batch(input_path, output_path, concurrency=concurrency, mode=mode)
+        wall = time.perf_counter() - started
+        with open(output_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+    failed = [r for r in records if r["status"] != "ok"]
+    if failed:
+        raise RuntimeError(f"{len(failed)} batch runs failed, first: {failed[0]['error']}")
+    return summarize([r["seconds"] for r in records], wall, [])
+
+
+def scenario_stream(patients, mode, concurrency):
+    from Pipeline import stream_medical_analysis
+    latencies, clocks, first_output, first_fields = [], [], [], []
+    started = time.perf_counter()
+    for patient in patients:
+        clock = StageClock()
+        run_started = time.perf_counter()
+        stream = stream_medical_analysis(**patient, mode=mode)
+        for event in stream:
+            if event.kind == "progress":
+                clock(*event.data)
+            elif event.kind == "error":
+                raise event.data
+        latencies.append(time.perf_counter() - run_started)
+        clocks.append(clock)
+        first_output.append(stream.first_output)
+        first_fields.append(stream.first_fields)
+    result = summarize(latencies, time.perf_counter() - started, clocks)
+    result["first_output_p50"] = round(statistics.median(first_output), 4)
+    result["first_fields_p50"] = round(statistics.median(first_fields), 4)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path, threshold):
+    """Print changes against a baseline result file; return the regressions found."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f"\nCompared with {baseline_path} ({baseline.get('commit')}):")
+    for key, result in current["results"].items():
+        before = baseline.get("results", {}).get(key)
+        if before is None:
+            continue
+        latency = result["latency_p50"] / before["latency_p50"] - 1 if before["latency_p50"] else 0.0
+        throughput = result["throughput_per_min"] / before["throughput_per_min"] - 1 if before["throughput_per_min"] else 0.0
+        flag = ""
+        if latency > threshold or throughput < -threshold:
+            flag = "  ⚠️ regression"
+            regressions.append(key)
+        print(f"  {key:<24} p50 {latency:+7.1%}   throughput {throughput:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=8, help="analyses per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2, help="mock seconds to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=200, help="mock generation rate")
+    parser.add_argument("--modes", nargs="+", default=["prefetch", "sequential"])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    from mock_llm_server import start_mock_server
+    server, base_url = start_mock_server(latency=args.latency, tokens_per_second=args.tokens_per_sec)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(base_url, workdir)
+        patients = seed_patients(args.runs)
+        runners = {"single": scenario_single, "concurrent": scenario_concurrent,
+                   "async": scenario_async, "batch": scenario_batch, "stream": scenario_stream}
+
+        results = {}
+        print(f"{args.runs} runs per scenario, concurrency {args.concurrency}, "
+              f"mock latency {args.latency}s at {args.tokens_per_sec} tokens/s")
+        for mode in args.modes:
+            for scenario in args.scenarios:
+                key = f"{mode}/{scenario}"
+                result = results[key] = runners[scenario](patients, mode, args.concurrency)
+                print(f"  {key:<24} p50 {result['latency_p50']:7.3f}s  p95 {result['latency_p95']:7.3f}s  "
+                      f"{result['throughput_per_min']:8.1f}/min")
+                if "first_output_p50" in result:
+                    print(f"      first output {result['first_output_p50']:7.3f}s, "
+                          f"first assessment field {result['first_fields_p50']:7.3f}s")
+                for label, seconds in result["stages_mean"].items():
+                    print(f"      {label:<40} {seconds:7.3f}s")
+    server.shutdown()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "results": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"pipeline-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Saved {path}")
+
+    if args.compare and compare(report, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
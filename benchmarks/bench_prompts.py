@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark prompt size and the prefix a provider can cache, per stage
+
+Runs the pipeline with the offline FakeLLM for several different patients
+and records every LLM request (system and user messages) by stage. For
+each stage it reports the input tokens per analysis and how many tokens of
+the first request are a prefix shared by all patients, which is the part
+a provider's prompt cache can reuse. Tokens are estimated at about four
+characters per token, as in HistoryContext.
+
+Usage: python benchmarks/bench_prompts.py [--patients 4] [--modes prefetch sequential] [--report-mode template]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PATIENTS = [
+    ("Jane Doe", 34, "Female", "persistent dry cough and mild fever for three days",
+     ["Diagnosed with asthma in 2015, uses a salbutamol inhaler.", "Allergic to penicillin."]),
+    ("Omar Haddad", 61, "Male", "chest tightness when climbing stairs, swollen ankles",
+     ["Hypertension since 2009, on amlodipine.", "Type 2 diabetes, metformin twice daily.",
+      "Knee replacement surgery in 2019."]),
+    ("Li Wei", 8, "Female", "itchy rash on both arms after eating peanuts",
+     ["No chronic conditions.", "Allergic to peanuts, carries an epinephrine auto-injector."]),
+    ("Ana Souza", 47, "Female", "recurring migraines with nausea and light sensitivity",
+     ["Migraine diagnosed in 2012.", "Hypothyroidism, on levothyroxine.", "Allergic to sulfa drugs."]),
+]
+
+
+def configure_environment(workdir):
+    os.environ.update({
+        "LLM_MODE": "fake",
+        "LLM_CACHE": "off",
+        "STAGE_REUSE": "off",
+        # Agent 1 must run to be measured
+        "LOCAL_EXTRACTION": "off",
+        "METRICS_LOG": "off",
+        "OUTPUT_ROOT": os.path.join(workdir, "Output"),
+    })
+    import db
+    db.DB_PATH = os.path.join(workdir, "bench.db")
+    with contextlib.redirect_stdout(io.StringIO()):
+        db.init_database()
+
+
+def record_requests():
+    """Route the shared LLM through a FakeLLM that records (stage, prompt) of every call."""
+    from Agents import get_shared_llm
+    from FakeLLM import FakeLLM, prompt_text
+    from Metrics import current_run
+
+    requests = []
+
+    class RecordingLLM(FakeLLM):
+        def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+            requests.append((current_run.get().stage, prompt_text(messages)))
+            return super().call(messages, tools, callbacks, available_functions, **kwargs)
+
+    get_shared_llm().llm = RecordingLLM(model="fake")
+    return requests
+
+
+def seed(patients):
+    import db
+    for i, (name, age, gender, _, history) in enumerate(patients):
+        national_id = f"PROMPT{i:03d}"
+        db.create_patient(name, national_id, age, gender)
+        for entry in history:
+            db.add_medical_history(national_id, entry)
+
+
+def shared_prefix(texts):
+    return os.path.commonprefix(texts) if len(texts) > 1 else ""
+
+
+def measure(patients, mode, report_mode, requests):
+    from HistoryContext import estimate_tokens
+    from Pipeline import run_medical_analysis
+
+    runs = []
+    for i, (name, age, gender, symptoms, _) in enumerate(patients):
+        del requests[:]
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_medical_analysis(name, age, gender, symptoms, f"PROMPT{i:03d}",
+                                 mode=mode, report_mode=report_mode)
+        runs.append(list(requests))
+
+    stages = []
+    for run in runs:
+        for stage, _ in run:
+            if stage not in stages:
+                stages.append(stage)
+    rows = []
+    for stage in stages:
+        per_run = [[text for s, text in run if s == stage] for run in runs]
+        tokens = sum(estimate_tokens(text) for texts in per_run for text in texts) / len(runs)
+        calls = sum(len(texts) for texts in per_run) / len(runs)
+        firsts = [texts[0] for texts in per_run if texts]
+        prefix = estimate_tokens(shared_prefix(firsts)) if len(firsts) > 1 else 0
+        first = sum(estimate_tokens(text) for text in firsts) / len(firsts)
+        rows.append((stage, calls, tokens, prefix, first))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--patients", type=int, default=len(PATIENTS), choices=range(2, len(PATIENTS) + 1))
+    parser.add_argument("--modes", nargs="+", default=["prefetch", "sequential"])
+    parser.add_argument("--report-mode", default="llm", choices=["template", "llm"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir)
+        patients = PATIENTS[:args.patients]
+        seed(patients)
+        requests = record_requests()
+        for mode in args.modes:
+            rows = measure(patients, mode, args.report_mode, requests)
+            print(f"\n{mode} mode, {args.report_mode} report, {len(patients)} patients "
+                  f"(tokens per analysis; cacheable = prefix of the first request shared by all patients)")
+            print(f"  {'stage':<12} {'calls':>6} {'input tokens':>13} {'first request':>14} {'cacheable':>10}")
+            for stage, calls, tokens, prefix, first in rows:
+                share = prefix / first if first else 0.0
+                print(f"  {stage:<12} {calls:>6.1f} {tokens:>13,.0f} {first:>14,.0f} {prefix:>6,} {share:>4.0%}")
+            total = sum(row[2] for row in rows)
+            cacheable = sum(row[3] for row in rows)
+            print(f"  {'total':<12} {sum(row[1] for row in rows):>6.1f} {total:>13,.0f} {'':>14} {cacheable:>6,}")
+
+
+if __name__ == "__main__":
+    main()
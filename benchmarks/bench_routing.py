@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-agent model routing, hedged requests and fallback against local stub endpoints
+
+Starts mock LLM servers (benchmarks/mock_llm_server.py) standing in for
+providers and checks the routed LLM stack end to end:
+
+- routing:  every agent's LLM_ROUTE_* points at its own stub; one analysis
+            must send each agent's calls to its stub and nowhere else
+- tail:     both endpoints answer --slow-rate of calls --slow-latency
+            seconds late; latency percentiles without and with hedging,
+            synchronous and asyncio calls. Hedging at p95 trims the tail
+            beyond it, so the slow rate should stay under 5%
+- fallback: the primary fails --error-rate of calls with HTTP 404; every
+            call must still be answered, by the next endpoint
+- timeout:  the primary hangs; calls must move on after LLM_ROUTE_TIMEOUT
+
+Exits with status 1 if a check fails. The scheduler's own retries are off
+(LLM_MAX_RETRIES=0) so a failed attempt falls back at once.
+
+Usage: python benchmarks/bench_routing.py [--calls 200] [--latency 0.05] [--slow-rate 0.03] [--slow-latency 1.5]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# A distinct prompt per call: identical ones would be coalesced by the
+# scheduler onto a request still in flight, such as an abandoned hedge loser
+_requests = itertools.count()
+
+
+def prompt():
+    return [{"role": "user", "content": f"Request {next(_requests)}: answer with an empty JSON object."}]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def routed_llm(agent, *base_urls, hedge=False, timeout=0.0):
+    """create_llm(agent) for a route over the given stubs, with hedging and timeout set."""
+    from Agents import create_llm
+    from LLMRouter import RoutedLLM
+
+    os.environ[f"LLM_ROUTE_{agent.upper()}"] = ",".join(f"openai/mock@{url}" for url in base_urls)
+    llm = create_llm(agent)
+    routed = llm
+    while not isinstance(routed, RoutedLLM):
+        routed = routed.llm
+    routed.hedge = hedge
+    routed.timeout = timeout
+    return llm
+
+
+def timed_calls(llm, calls, warmup=0):
+    """(latency of each call after the first `warmup`, route counts when they started)."""
+    for _ in range(warmup):
+        llm.call(prompt())
+    before, latencies = route_counts(), []
+    for _ in range(calls):
+        started = time.perf_counter()
+        llm.call(prompt())
+        latencies.append(time.perf_counter() - started)
+    return latencies, before
+
+
+def timed_calls_async(llm, calls, warmup=0):
+    """timed_calls() with asyncio calls, all on one event loop."""
+    async def run():
+        for _ in range(warmup):
+            await llm.acall(prompt())
+        before, latencies = route_counts(), []
+        for _ in range(calls):
+            started = time.perf_counter()
+            await llm.acall(prompt())
+            latencies.append(time.perf_counter() - started)
+        return latencies, before
+    return asyncio.run(run())
+
+
+def route_counts():
+    from Metrics import llm_route_counts
+    return dict(llm_route_counts())
+
+
+def counted(before, after, kind, outcome):
+    return after.get((kind, outcome), 0) - before.get((kind, outcome), 0)
+
+
+def check_routing(start_mock_server, failures):
+    """One analysis with every agent on its own stub."""
+    from LLMRouter import ROUTE_AGENTS
+    from Pipeline import run_medical_analysis
+    from bench_pipeline import seed_patients
+
+    servers = {}
+    for agent in ROUTE_AGENTS:
+        servers[agent], base_url = start_mock_server()
+        os.environ[f"LLM_ROUTE_{agent.upper()}"] = f"openai/mock-{agent}@{base_url}"
+    patient = seed_patients(1)[0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_medical_analysis(**patient, mode="sequential", report_mode="llm")
+
+    print("Routing: one analysis, each agent on its own stub")
+    for agent, server in servers.items():
+        models = set(server.served)
+        ok = models == {f"mock-{agent}"}
+        print(f"  {agent:<10} {len(server.served):>3} requests to {', '.join(sorted(models)) or 'none'} "
+              f"{'✅' if ok else '⚠️'}")
+        if not ok:
+            failures.append(f"{agent} calls went to {sorted(models) or 'no stub'}")
+        server.shutdown()
+    for agent in ROUTE_AGENTS:
+        del os.environ[f"LLM_ROUTE_{agent.upper()}"]
+
+
+def check_tail(args, start_mock_server, failures):
+    print(f"\nTail latency: {args.slow_rate:.0%} of calls to each endpoint are {args.slow_latency}s late, "
+          f"{args.calls} calls")
+    print(f"  {'':<24} {'p50':>7} {'p95':>7} {'p99':>7} {'hedges':>7} {'cancelled':>10}")
+    rows = {}
+    for name, hedge, run in (("sync, no hedging", False, timed_calls),
+                             ("sync, hedged", True, timed_calls),
+                             ("async, hedged", True, timed_calls_async)):
+        stubs = [start_mock_server(latency=args.latency, slow_rate=args.slow_rate,
+                                   slow_latency=args.slow_latency) for _ in range(2)]
+        llm = routed_llm("evaluator", *(url for _, url in stubs), hedge=hedge)
+        # The warm-up fills the latency window the hedge threshold (p95) is taken from
+        latencies, before = run(llm, args.calls, warmup=50)
+        after = route_counts()
+        hedges = counted(before, after, "hedge", "won") + counted(before, after, "hedge", "failed") \
+            + counted(before, after, "hedge", "cancelled")
+        cancelled = sum(counted(before, after, kind, "cancelled") for kind in ("primary", "hedge"))
+        rows[name] = latencies
+        print(f"  {name:<24} {percentile(latencies, 0.5):7.3f} {percentile(latencies, 0.95):7.3f} "
+              f"{percentile(latencies, 0.99):7.3f} {hedges / args.calls:7.0%} {cancelled:>10}")
+        for server, _ in stubs:
+            server.shutdown()
+
+    for name in ("sync, hedged", "async, hedged"):
+        plain, hedged = percentile(rows["sync, no hedging"], 0.99), percentile(rows[name], 0.99)
+        if hedged > plain / 2:
+            failures.append(f"{name}: p99 latency not cut ({plain:.3f}s -> {hedged:.3f}s)")
+
+
+def check_fallback(args, start_mock_server, failures):
+    primary, primary_url = start_mock_server(latency=args.latency, error_rate=args.error_rate, error_status=404)
+    backup, backup_url = start_mock_server(latency=args.latency)
+    llm = routed_llm("extractor", primary_url, backup_url)
+    before = route_counts()
+    answered = 0
+    for _ in range(args.calls):
+        try:
+            llm.call(prompt())
+            answered += 1
+        except Exception:
+            pass
+    after = route_counts()
+    fallbacks = counted(before, after, "fallback", "won")
+    print(f"\nFallback: primary fails {args.error_rate:.0%} of calls with HTTP 404")
+    print(f"  answered {answered}/{args.calls}, {fallbacks} by the fallback endpoint "
+          f"({len(primary.served)} primary / {len(backup.served)} fallback answers)")
+    if answered != args.calls or not fallbacks:
+        failures.append(f"fallback answered {answered}/{args.calls} calls ({fallbacks} by the fallback)")
+    primary.shutdown()
+    backup.shutdown()
+
+
+def check_timeout(args, start_mock_server, failures):
+    hang = args.slow_latency * 2
+    primary, primary_url = start_mock_server(latency=args.latency, slow_rate=1.0, slow_latency=hang)
+    backup, backup_url = start_mock_server(latency=args.latency)
+    timeout = args.slow_latency / 3
+    calls = max(3, args.calls // 40)
+    print(f"\nTimeout: primary hangs {hang}s, LLM_ROUTE_TIMEOUT={timeout:.2f}s, {calls} calls")
+    for name, run in (("sync", timed_calls), ("async", timed_calls_async)):
+        llm = routed_llm("reporter", primary_url, backup_url, timeout=timeout)
+        latencies, _ = run(llm, calls)
+        print(f"  {name:<6} p50 {percentile(latencies, 0.5):.3f}s  max {max(latencies):.3f}s")
+        if max(latencies) >= hang:
+            failures.append(f"{name} calls waited for the hung endpoint ({max(latencies):.3f}s)")
+    primary.shutdown()
+    backup.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200, help="calls per measurement")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub seconds to answer")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="share of slow calls per endpoint")
+    parser.add_argument("--slow-latency", type=float, default=1.5, help="extra seconds of a slow call")
+    parser.add_argument("--error-rate", type=float, default=0.3, help="share of failing primary calls")
+    args = parser.parse_args()
+
+    from mock_llm_server import start_mock_server
+    from bench_pipeline import configure_environment
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["LLM_MAX_RETRIES"] = "0"
+        with contextlib.redirect_stdout(io.StringIO()):
+            configure_environment("http://127.0.0.1:9/v1", workdir)
+
+        failures = []
+        check_routing(start_mock_server, failures)
+        check_tail(args, start_mock_server, failures)
+        check_fallback(args, start_mock_server, failures)
+        check_timeout(args, start_mock_server, failures)
+
+    print()
+    for failure in failures:
+        print(f"⚠️ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ Routing, hedging and fallback behave as configured")
+
+
+if __name__ == "__main__":
+    main()
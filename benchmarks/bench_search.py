@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark history search: FTS5 index vs LIKE scan
+
+Seeds synthetic histories of increasing size and times
+search_patients_by_history() for a rare and a common term, through the
+migration-6 full-text index and through the LIKE scan it replaces.
+
+Usage: python benchmarks/bench_search.py [--sizes 10000 100000 1000000] [--queries 50]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+NOTES = (
+    "Follow-up visit, blood pressure reviewed",
+    "Routine check, all normal",
+    "Seasonal asthma, inhaler refilled",
+    "Lab work: HbA1c within target range",
+    "Knee pain after running, physiotherapy advised",
+)
+RARE_NOTE = "Allergic to penicillin, rash after amoxicillin"
+LIKE_SQL = (
+    "SELECT h.national_id, COUNT(*) FROM medical_history h "
+    "WHERE h.description LIKE ? GROUP BY h.national_id"
+)
+
+
+def seed(rows, per_patient=20):
+    db.init_database()
+    patients = max(1, rows // per_patient)
+    conn = db.get_db_connection()
+    with conn:
+        conn.executemany(
+            db.INSERT_PATIENT_SQL,
+            ((f"ID{i:08d}", f"Patient {i}", 20 + i % 60, "Female") for i in range(patients))
+        )
+        conn.executemany(
+            db.INSERT_HISTORY_SQL,
+            ((f"ID{random.randrange(patients):08d}", RARE_NOTE if i % 1000 == 0 else NOTES[i % len(NOTES)])
+             for i in range(rows))
+        )
+
+
+def mean_ms(func, queries):
+    started = time.perf_counter()
+    for _ in range(queries):
+        func()
+    return (time.perf_counter() - started) * 1000 / queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'term':>11} {'fts ms':>9} {'like ms':>9}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db.DB_PATH = os.path.join(tmp, "bench.db")
+            seed(size)
+            conn = db.get_db_connection()
+            for term in ("penicillin", "asthma"):
+                fts = mean_ms(lambda: db.search_patients_by_history(term, limit=1000), args.queries)
+                like = mean_ms(lambda: conn.execute(LIKE_SQL, (f"%{term}%",)).fetchall(), max(1, args.queries // 10))
+                print(f"{size:>10,} {term:>11} {fts:>9.3f} {like:>9.3f}")
+            db.close_db_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Benchmark the near-duplicate cache of Agent 3's assessments (SemanticCache)
+
+1. Index: nearest-neighbour lookup time against indexes of growing size,
+   NumPy matrix-vector product vs a pure-Python loop over the same vectors,
+   and the on-disk size per entry.
+2. Pipeline: a cohort of patients from a few backgrounds (history), each
+   describing the same clinical pictures in different words ("bad cough and
+   hard to breathe", "persistent cough, shortness of breath"), analyzed
+   with the offline FakeLLM with the cache off and on. Reports Agent 3 calls
+   and wall time.
+
+Exits with status 1 if the cache reuses an assessment across backgrounds or
+clinical pictures, misses a paraphrase, or a reused report carries the
+wrong patient.
+
+Usage: python benchmarks/bench_semantic_cache.py [--sizes 1000 10000 50000] [--latency 0.1]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# (name prefix, age, gender, history entries): patients sharing a background
+BACKGROUNDS = [
+    ("Asthma", 34, "Female", ["Diagnosed with asthma in 2015, uses a salbutamol inhaler.",
+                              "Allergic to penicillin."]),
+    ("Cardiac", 68, "Male", ["Hypertension since 2009, on amlodipine.", "Type 2 diabetes, metformin twice daily."]),
+    ("Child", 8, "Female", ["Allergic to peanuts, carries an epinephrine auto-injector."]),
+]
+
+# Clinical picture -> the same symptoms in different words
+PICTURES = {
+    "respiratory": ["bad cough and hard to breathe", "persistent cough, shortness of breath",
+                    "coughing, short of breath", "hacking cough and breathlessness"],
+    "gastro": ["tummy ache and threw up", "stomach pain, vomiting", "belly ache with throwing up"],
+    "flu": ["running a temperature, body aches, tired", "fever, muscle aches and fatigue",
+            "feverish with aching muscles, exhausted"],
+}
+
+
+def configure_environment(workdir, latency):
+    os.environ.update({
+        "LLM_MODE": "fake",
+        "FAKE_LLM_LATENCY": str(latency),
+        "LLM_CACHE": "off",
+        "STAGE_REUSE": "off",
+        "SEMANTIC_CACHE": "off",
+        "SEMANTIC_CACHE_PATH": os.path.join(workdir, "semantic_cache.db"),
+        "METRICS_LOG": "off",
+        "OUTPUT_ROOT": os.path.join(workdir, "Output"),
+    })
+    import db
+    db.DB_PATH = os.path.join(workdir, "bench.db")
+    with contextlib.redirect_stdout(io.StringIO()):
+        db.init_database()
+
+
+def bench_index(sizes, workdir, lookups=200):
+    import numpy as np
+    from SemanticCache import SemanticCache, symptom_vector, DIMENSIONS
+    from SymptomNormalizer import SYMPTOM_SYNONYMS
+
+    terms = list(SYMPTOM_SYNONYMS)
+    rng = random.Random(7)
+    print(f"Index lookups ({DIMENSIONS} dimensions, median of {lookups})")
+    print(f"  {'entries':>8} {'numpy':>10} {'python loop':>12} {'speedup':>8} {'bytes/entry':>12}")
+    for size in sizes:
+        path = os.path.join(workdir, f"index-{size}.db")
+        cache = SemanticCache(path=path, max_entries=size)
+        vectors = [symptom_vector(rng.sample(terms, rng.randint(1, 4))) for _ in range(size)]
+        with cache._connection() as conn:
+            conn.executemany(
+                "INSERT INTO assessments (fingerprint, vector, patient_name, assessment, created_at) "
+                "VALUES ('bench', ?, '', '{}', 0)",
+                [(vector.astype(np.float16).tobytes(),) for vector in vectors]
+            )
+        cache._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        cache._connection().execute("VACUUM")
+        cache.nearest("bench", vectors[0])  # load the index
+        rows = [list(map(float, vector)) for vector in vectors]
+        queries = [symptom_vector(rng.sample(terms, rng.randint(1, 4))) for _ in range(lookups)]
+
+        numpy_times, python_times = [], []
+        for query in queries:
+            started = time.perf_counter()
+            cache.nearest("bench", query)
+            numpy_times.append(time.perf_counter() - started)
+        query_list = list(map(float, queries[0]))
+        for _ in range(max(3, lookups // 20)):
+            started = time.perf_counter()
+            max(range(len(rows)), key=lambda i: sum(a * b for a, b in zip(rows[i], query_list)))
+            python_times.append(time.perf_counter() - started)
+        numpy_ms, python_ms = statistics.median(numpy_times) * 1000, statistics.median(python_times) * 1000
+        print(f"  {size:>8,} {numpy_ms:>8.3f}ms {python_ms:>10.1f}ms {python_ms / numpy_ms:>7.0f}x "
+              f"{os.path.getsize(path) / size:>12.0f}")
+
+
+def cohort():
+    """Patients (dict for run_medical_analysis) with their background and clinical picture."""
+    import db
+    patients = []
+    for background, age, gender, history in BACKGROUNDS:
+        for picture, phrasings in PICTURES.items():
+            for i, symptoms in enumerate(phrasings):
+                name = f"{background} {picture.capitalize()} Patient{i}"
+                national_id = f"SEM-{background}-{picture}-{i}".upper()
+                db.create_patient(name, national_id, age + i, gender)
+                for entry in history:
+                    db.add_medical_history(national_id, entry)
+                patients.append(({
+                    "patient_name": name,
+                    "patient_age": age + i,
+                    "patient_gender": gender,
+                    "symptoms": symptoms,
+                    "national_id": national_id,
+                }, background, picture))
+    return patients
+
+
+def count_evaluations():
+    """Route the shared LLM through a FakeLLM that counts Agent 3's calls."""
+    from Agents import get_shared_llm
+    from FakeLLM import FakeLLM
+    from Metrics import current_run
+
+    calls = []
+
+    class CountingLLM(FakeLLM):
+        def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+            if current_run.get().stage == "evaluation":
+                calls.append(current_run.get().run_id)
+            return super().call(messages, tools, callbacks, available_functions, **kwargs)
+
+    shared = get_shared_llm()
+    shared.llm = CountingLLM(model="fake", latency=shared.llm.latency)
+    return calls
+
+
+def run_cohort(patients, calls, mode):
+    from Pipeline import run_medical_analysis
+    from Workspace import RunWorkspace
+
+    before, evaluated, reports = len(calls), set(), []
+    started = time.perf_counter()
+    for patient, background, picture in patients:
+        workspace = RunWorkspace()
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = run_medical_analysis(**patient, mode=mode, workspace=workspace)
+        if workspace.run_id in calls[before:]:
+            evaluated.add(workspace.run_id)
+        reports.append((patient, background, picture, workspace.run_id in evaluated, report))
+    return time.perf_counter() - started, len(calls) - before, reports
+
+
+def bench_pipeline(args, failures):
+    import SemanticCache
+    from Metrics import semantic_cache_counts
+
+    patients = cohort()
+    calls = count_evaluations()
+    pictures = {(background, picture) for _, background, picture in patients}
+    print(f"\nPipeline: {len(patients)} patients, {len(BACKGROUNDS)} backgrounds x {len(PICTURES)} clinical "
+          f"pictures worded {min(map(len, PICTURES.values()))}-{max(map(len, PICTURES.values()))} ways, "
+          f"FakeLLM {args.latency}s per call, {args.mode} mode")
+    print(f"  {'semantic cache':<16} {'Agent 3 calls':>14} {'total':>9} {'per patient':>12}")
+    for enabled in (False, True):
+        SemanticCache.SEMANTIC_CACHE = enabled
+        seconds, evaluations, reports = run_cohort(patients, calls, args.mode)
+        print(f"  {'on' if enabled else 'off':<16} {evaluations:>14} {seconds:>8.2f}s "
+              f"{seconds / len(patients):>11.3f}s")
+    counts = semantic_cache_counts()
+    print(f"  hit rate {counts['hit_rate']:.0%} (threshold {SemanticCache.SEMANTIC_CACHE_THRESHOLD})")
+
+    if evaluations != len(pictures):
+        failures.append(f"Agent 3 ran {evaluations} times for {len(pictures)} distinct backgrounds x pictures")
+    first = {}
+    for patient, background, picture, evaluated, report in reports:
+        if evaluated and (background, picture) in first:
+            failures.append(f"{patient['symptoms']!r} ({background}) was not matched to an earlier paraphrase")
+        first.setdefault((background, picture), patient)
+        if not evaluated and patient["patient_name"] not in report:
+            failures.append(f"reused report for {patient['patient_name']} does not name the patient")
+        if not evaluated and first[(background, picture)] is patient:
+            failures.append(f"first {background} {picture} patient reused an assessment from elsewhere")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--latency", type=float, default=0.1, help="FakeLLM seconds per call")
+    parser.add_argument("--mode", default="prefetch", choices=["prefetch", "sequential"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir, args.latency)
+        failures = []
+        bench_index(args.sizes, workdir)
+        bench_pipeline(args, failures)
+
+    print()
+    for failure in failures:
+        print(f"⚠️ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ Paraphrased intakes reuse assessments only within the same background and clinical picture")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-run setup: fresh LLM clients and agents vs the agent registry
+
+Measures only what happens before kickoff (LLM clients, agents, tasks); no
+LLM calls are made.
+
+Usage: python benchmarks/bench_setup.py [--runs 200] [--fake-llm]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_tasks(agents):
+    from Tasks import (
+        create_symptom_extraction_task,
+        create_medical_history_task,
+        create_symptom_evaluation_task,
+    )
+    extractor, history, evaluator = agents
+    return [
+        create_symptom_extraction_task("Jane Doe", 40, "Female", "cough, fever", extractor, output_dir=None),
+        create_medical_history_task("123", history, output_dir=None),
+        create_symptom_evaluation_task(evaluator, output_dir=None),
+    ]
+
+
+def fresh_setup():
+    """The original pattern: every factory builds its own LLM client."""
+    from Agents import (
+        create_symptom_extractor_agent,
+        create_medical_history_agent,
+        create_symptom_evaluator_agent,
+    )
+    build_tasks([create_symptom_extractor_agent(), create_medical_history_agent(), create_symptom_evaluator_agent()])
+
+
+def registry_setup():
+    from Agents import agent_registry
+    with agent_registry.lease() as lease:
+        build_tasks([lease.get("extractor"), lease.get("history"), lease.get("evaluator")])
+
+
+def run(setup, runs):
+    """Return mean milliseconds per call of setup()."""
+    setup()  # warm-up: imports, and the registry's first build
+    start = time.perf_counter()
+    for _ in range(runs):
+        setup()
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--fake-llm", action="store_true", help="use the offline FakeLLM")
+    args = parser.parse_args()
+
+    if args.fake_llm:
+        os.environ["LLM_MODE"] = "fake"
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")  # clients are built, never called
+
+    before = run(fresh_setup, args.runs)
+    after = run(registry_setup, args.runs)
+    print(f"{args.runs} runs, LLM_MODE={os.getenv('LLM_MODE', 'openrouter')}")
+    print(f"  fresh agents: {before:8.2f} ms/run   registry: {after:8.2f} ms/run   speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Startup profile: import time of the modules MainApp loads before drawing the form
+
+Reads MainApp.py's top-level imports of local modules and imports them in a
+fresh interpreter with `python -X importtime`, then reports the cumulative
+time of each local module and the packages that cost the most. Streamlit
+itself is the host process and is not counted.
+
+It doubles as a regression check: the run fails (exit 1) when the total
+exceeds --budget seconds or a framework that should load lazily (CrewAI,
+LangChain, the LLM clients) is imported at startup.
+
+Usage: python benchmarks/bench_startup.py [--runs 3] [--budget 1.5] [--top 10] [--forbid crewai ...]
+"""
+
+import argparse
+import ast
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY = os.path.join(ROOT, "MainApp.py")
+
+# Frameworks the first analysis loads; none of them may be imported at startup
+LAZY_PACKAGES = ("crewai", "langchain", "langchain_core", "litellm", "openai")
+
+
+def startup_modules(path=ENTRY):
+    """Local modules the entry script imports at its top level, in order."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            top = name.split(".")[0]
+            if os.path.exists(os.path.join(ROOT, f"{top}.py")) and top not in modules:
+                modules.append(top)
+    return modules
+
+
+def profile_imports(modules):
+    """{package: (self_us, cumulative_us, depth)} from one `-X importtime` run."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {modules} failed:\n{result.stderr[-2000:]}")
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        timings[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters; the fastest is reported")
+    parser.add_argument("--budget", type=float, default=1.5, help="allowed total import seconds")
+    parser.add_argument("--top", type=int, default=10, help="heaviest top-level packages to list")
+    parser.add_argument("--forbid", nargs="*", default=list(LAZY_PACKAGES),
+                        help="packages that must not be imported at startup")
+    args = parser.parse_args()
+
+    modules = startup_modules()
+    runs = [profile_imports(modules) for _ in range(args.runs)]
+    # Total: everything imported at the top level of the fresh interpreter
+    totals = [sum(cum for _, cum, depth in run.values() if depth == 0) for run in runs]
+    timings = runs[totals.index(min(totals))]
+    total = min(totals) / 1e6
+
+    print(f"Startup imports of {os.path.basename(ENTRY)} ({args.runs} runs, fastest shown)")
+    for module in modules:
+        print(f"  {module:<24} {timings.get(module, (0, 0, 0))[1] / 1e6:7.3f}s")
+
+    packages = {}
+    for name, (self_us, _, _) in timings.items():
+        top = name.split(".")[0]
+        packages[top] = packages.get(top, 0) + self_us
+    print("\nHeaviest packages (own import time, submodules included):")
+    for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<24} {self_us / 1e6:7.3f}s")
+    print(f"\nTotal {total:.3f}s (budget {args.budget:.3f}s)")
+
+    failures = []
+    if total > args.budget:
+        failures.append(f"startup imports take {total:.3f}s, over the {args.budget:.3f}s budget")
+    loaded = [name for name in args.forbid if name in packages]
+    if loaded:
+        failures.append(f"loaded at startup instead of on first analysis: {', '.join(loaded)}")
+    for failure in failures:
+        print(f"⚠️ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ Startup within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Local OpenAI-compatible chat completions server for offline benchmarks
+
+Answers POST /v1/chat/completions with FakeLLM's canned completions, which
+follow the PatientDataOutput, MedicalHistoryOutput and Agent 3 schemas.
+The first token arrives after --latency seconds and the rest at
+--tokens-per-sec, both with and without "stream": true. Requests with a
+response_format get the bare JSON answer, as from a structured-output model. Token counts in
+`usage` are estimated at 4 characters per token.
+
+To stand in for a flaky or slow provider, a share of requests can wait an
+extra --slow-latency seconds first (--slow-rate) or fail with HTTP
+--error-status (--error-rate). `served` counts the requests answered.
+
+Point the app at it with:
+    LLM_MODEL=openai/mock LLM_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock
+
+Usage: python benchmarks/mock_llm_server.py [--port 8765] [--latency 0.3] [--tokens-per-sec 80]
+       [--slow-rate 0.1 --slow-latency 3] [--error-rate 0.2 --error-status 503]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FakeLLM import canned_answer, fake_completion, prompt_text
+
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def split_tokens(text):
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)] or [""]
+
+
+def apply_stop(text, stop):
+    for word in stop or []:
+        index = text.find(word)
+        if index != -1:
+            text = text[:index]
+    return text
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    tokens_per_second = 0.0
+    slow_rate = 0.0
+    slow_latency = 0.0
+    error_rate = 0.0
+    error_status = 503
+    served = None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.error_rate and random.random() < self.error_rate:
+            self._send_json(self.error_status, {"error": {"message": "mock provider failure",
+                                                          "code": self.error_status}})
+            return
+        prompt = prompt_text(request.get("messages", []))
+        stop = request.get("stop")
+        if request.get("response_format"):
+            # Structured output: answer with the bare JSON object, as providers do
+            text = canned_answer(prompt)
+        else:
+            text = apply_stop(fake_completion(prompt), [stop] if isinstance(stop, str) else stop)
+        usage = {
+            "prompt_tokens": count_tokens(prompt),
+            "completion_tokens": count_tokens(text),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = request.get("model", "mock")
+
+        slow = self.slow_rate and random.random() < self.slow_rate
+        time.sleep(self.latency + (self.slow_latency if slow else 0.0))
+        if self.served is not None:
+            self.served.append(model)
+        delay = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        if request.get("stream"):
+            self._stream(completion_id, model, text, usage, delay)
+            return
+
+        time.sleep(delay * (usage["completion_tokens"] - 1))
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    def _stream(self, completion_id, model, text, usage, delay):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def event(delta, finish_reason=None, **extra):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for i, token in enumerate(split_tokens(text)):
+            if i and delay:
+                time.sleep(delay)
+            event({"role": "assistant", "content": token} if i == 0 else {"content": token})
+        event({}, "stop", usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up mid-answer on purpose (cancelled hedges, route timeouts)
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def start_mock_server(port=0, latency=0.0, tokens_per_second=0.0, host="127.0.0.1",
+                      slow_rate=0.0, slow_latency=0.0, error_rate=0.0, error_status=503):
+    """Start the server in a daemon thread; return (server, base_url).
+
+    server.served lists the model of every request answered so far.
+    """
+    served = []
+    handler = type("ConfiguredMockLLMHandler", (MockLLMHandler,), {
+        "latency": latency,
+        "tokens_per_second": tokens_per_second,
+        "slow_rate": slow_rate,
+        "slow_latency": slow_latency,
+        "error_rate": error_rate,
+        "error_status": error_status,
+        "served": served,
+    })
+    server = MockLLMServer((host, port), handler)
+    server.served = served
+    threading.Thread(target=server.serve_forever, daemon=True, name="mock-llm").start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=80, help="generation rate (0 = instant)")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of requests delayed by --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="extra seconds of a slow request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of a failed request")
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(args.port, args.latency, args.tokens_per_sec,
+                                         slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                                         error_rate=args.error_rate, error_status=args.error_status)
+    print(f"🧪 Mock LLM at {base_url} (latency {args.latency}s, {args.tokens_per_sec} tokens/s)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
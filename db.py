@@ -1,145 +1,782 @@
 #!/usr/bin/env python3
 """
 Database module for simplified medical assistant system
-Contains only patients and medical_history tables
+Contains the patients and medical_history tables plus the jobs queue
+the stage results reused by incremental re-analysis, the rolling
+summaries of long medical histories and a full-text index over them,
+plus the bulk insert and export primitives used by BulkIO.py
 """
 
+import asyncio
+import functools
+import re
 import sqlite3
 import os
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+
+from Metrics import observe_db, observe_db_cache
 
 DB_PATH = "medical_assistant.db"
 
-def init_database():
-    """Initialize SQLite database with existing data preservation."""
-    # Only create new database if it doesn't exist
-    if not os.path.exists(DB_PATH):
-        # Create new database with correct schema
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Patients table with national_id as primary key
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS patients (
-                national_id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                age INTEGER NOT NULL,
-                gender TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Medical history table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS medical_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                national_id TEXT NOT NULL,
-                description TEXT NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (national_id) REFERENCES patients (national_id)
+# Pragmas applied to every connection handed out by get_db_connection().
+# WAL lets readers proceed while a writer commits; NORMAL sync is durable
+# across application crashes and much cheaper than FULL in WAL mode.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+# Number of compiled statements sqlite3 keeps per connection
+STATEMENT_CACHE_SIZE = 128
+
+# SQL used by the data layer. Keeping each statement as a single constant
+# means every call hits the connection's prepared-statement cache.
+SELECT_PATIENT_SQL = "SELECT national_id, name, age, gender FROM patients WHERE national_id = ?"
+SELECT_PATIENT_LEGACY_SQL = "SELECT national_id FROM patients WHERE name = ? AND age = ? AND gender = ?"
+INSERT_PATIENT_SQL = "INSERT INTO patients (national_id, name, age, gender) VALUES (?, ?, ?, ?)"
+INSERT_HISTORY_SQL = "INSERT INTO medical_history (national_id, description) VALUES (?, ?)"
+SELECT_HISTORY_SQL = "SELECT description, timestamp FROM medical_history WHERE national_id = ? ORDER BY timestamp DESC"
+COUNT_HISTORY_SQL = "SELECT COUNT(*) FROM medical_history WHERE national_id = ?"
+SELECT_HISTORY_PAGE_SQL = (
+    "SELECT id, description, timestamp FROM medical_history WHERE national_id = ? "
+    "ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?"
+)
+SELECT_HISTORY_PAGE_BEFORE_SQL = (
+    "SELECT id, description, timestamp FROM medical_history WHERE national_id = ? "
+    "AND (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT ?"
+)
+COUNT_HISTORY_THROUGH_SQL = (
+    "SELECT COUNT(*) FROM medical_history WHERE national_id = ? "
+    "AND (timestamp < ? OR (timestamp = ? AND id <= ?))"
+)
+SELECT_HISTORY_SUMMARY_SQL = (
+    "SELECT summary, covered_count, last_timestamp, last_id FROM history_summaries WHERE national_id = ?"
+)
+UPSERT_HISTORY_SUMMARY_SQL = (
+    "INSERT OR REPLACE INTO history_summaries "
+    "(national_id, summary, covered_count, last_timestamp, last_id, updated_at) "
+    "VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)"
+)
+SEARCH_HISTORY_FTS_SQL = (
+    "SELECT h.national_id, p.name, h.description, h.timestamp, "
+    "snippet(medical_history_fts, 0, '[', ']', '…', 16) "
+    "FROM medical_history_fts JOIN medical_history h ON h.id = medical_history_fts.rowid "
+    "LEFT JOIN patients p ON p.national_id = h.national_id "
+    "WHERE medical_history_fts MATCH ? AND (? IS NULL OR h.national_id = ?) "
+    "ORDER BY medical_history_fts.rank LIMIT ?"
+)
+SEARCH_PATIENTS_FTS_SQL = (
+    "SELECT h.national_id, p.name, p.age, p.gender, COUNT(*) AS matches, MAX(h.timestamp) AS latest "
+    "FROM medical_history_fts JOIN medical_history h ON h.id = medical_history_fts.rowid "
+    "LEFT JOIN patients p ON p.national_id = h.national_id "
+    "WHERE medical_history_fts MATCH ? "
+    "GROUP BY h.national_id ORDER BY matches DESC, latest DESC LIMIT ?"
+)
+INSERT_PATIENT_IGNORE_SQL = "INSERT OR IGNORE INTO patients (national_id, name, age, gender) VALUES (?, ?, ?, ?)"
+INSERT_HISTORY_AT_SQL = (
+    "INSERT INTO medical_history (national_id, description, timestamp) "
+    "VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP))"
+)
+EXPORT_SQL = (
+    "SELECT p.national_id, p.name, p.age, p.gender, h.description, h.timestamp "
+    "FROM patients p LEFT JOIN medical_history h ON h.national_id = p.national_id "
+    "ORDER BY p.national_id, h.timestamp, h.id"
+)
+UPSERT_STAGE_RESULT_SQL = (
+    "INSERT OR REPLACE INTO stage_results (input_hash, national_id, stage, output) VALUES (?, ?, ?, ?)"
+)
+
+# Process-wide cache of patient and history reads (see ReadCache)
+READ_CACHE = os.getenv("DB_READ_CACHE", "on") == "on"
+READ_CACHE_TTL = float(os.getenv("DB_READ_CACHE_TTL", 30))
+READ_CACHE_ENTRIES = int(os.getenv("DB_READ_CACHE_ENTRIES", 10000))
+
+# One connection per (thread, database path); sqlite3 connections must not
+# be shared across threads, and Streamlit/crewai run us on several.
+_local = threading.local()
+
+def _table_columns(conn, table):
+    """Return the column names of table (empty if it does not exist)."""
+    return [column[1] for column in conn.execute(f"PRAGMA table_info({table})")]
+
+def _migrate_base_schema(conn):
+    """Migration 1: patients and medical_history keyed by national_id."""
+    # Databases from before the national_id schema are kept, not dropped:
+    # their tables are renamed aside so the data can be recovered by hand.
+    for table in ("patients", "medical_history"):
+        columns = _table_columns(conn, table)
+        if columns and 'national_id' not in columns:
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+            print(f"⚠️ Old '{table}' table kept as '{table}_legacy'")
+
+    # Patients table with national_id as primary key
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS patients (
+            national_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            age INTEGER NOT NULL,
+            gender TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Medical history table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS medical_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            national_id TEXT NOT NULL,
+            description TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (national_id) REFERENCES patients (national_id)
+        )
+    ''')
+
+def _migrate_history_fts(conn):
+    """Migration 6: FTS5 index over medical_history.description, kept in sync by triggers."""
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS medical_history_fts USING fts5(
+                description,
+                content='medical_history',
+                content_rowid='id',
+                tokenize='porter unicode61'
             )
         ''')
-        
-        conn.commit()
-        conn.close()
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: search falls back to LIKE scans
+        print(f"⚠️ Full-text search unavailable ({e}); history search will scan")
+        return
+    _create_history_fts_triggers(conn)
+    # Index the rows that existed before the triggers
+    conn.execute("INSERT INTO medical_history_fts (medical_history_fts) VALUES ('rebuild')")
+
+HISTORY_FTS_TRIGGERS = ("medical_history_fts_insert", "medical_history_fts_delete", "medical_history_fts_update")
+
+def _create_history_fts_triggers(conn):
+    """Triggers that keep medical_history_fts in step with medical_history."""
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS medical_history_fts_insert AFTER INSERT ON medical_history BEGIN
+            INSERT INTO medical_history_fts (rowid, description) VALUES (new.id, new.description);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS medical_history_fts_delete AFTER DELETE ON medical_history BEGIN
+            INSERT INTO medical_history_fts (medical_history_fts, rowid, description)
+            VALUES ('delete', old.id, old.description);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS medical_history_fts_update AFTER UPDATE OF description ON medical_history BEGIN
+            INSERT INTO medical_history_fts (medical_history_fts, rowid, description)
+            VALUES ('delete', old.id, old.description);
+            INSERT INTO medical_history_fts (rowid, description) VALUES (new.id, new.description);
+        END
+    ''')
+
+# Serves get_patient_medical_history without a scan or a sort
+HISTORY_PATIENT_TIME_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_medical_history_patient_time "
+    "ON medical_history (national_id, timestamp DESC)"
+)
+# Serves the legacy check_patient lookup
+PATIENTS_NAME_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_patients_name_age_gender "
+    "ON patients (name, age, gender)"
+)
+
+# Schema migrations as (version, description, step). A step is either a
+# callable taking the connection or a list of SQL statements. The last
+# applied version is stored in PRAGMA user_version; append new entries,
+# never edit applied ones.
+MIGRATIONS = [
+    (1, "base patients/medical_history schema", _migrate_base_schema),
+    (2, "history and patient lookup indexes", [
+        HISTORY_PATIENT_TIME_INDEX_SQL,
+        PATIENTS_NAME_INDEX_SQL,
+    ]),
+    (3, "background analysis job queue", [
+        '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            priority INTEGER NOT NULL DEFAULT 0,
+            payload TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            heartbeat_at REAL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            started_at DATETIME,
+            finished_at DATETIME
+        )
+        ''',
+        # Serves the worker's "next queued job" query
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_priority ON jobs (status, priority DESC, id)",
+    ]),
+    (4, "pipeline stage results keyed by input hash", [
+        '''
+        CREATE TABLE IF NOT EXISTS stage_results (
+            input_hash TEXT PRIMARY KEY,
+            national_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            output TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Serves delete_stage_results
+        "CREATE INDEX IF NOT EXISTS idx_stage_results_patient ON stage_results (national_id)",
+    ]),
+    (5, "rolling summaries of older medical history", [
+        '''
+        CREATE TABLE IF NOT EXISTS history_summaries (
+            national_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            covered_count INTEGER NOT NULL,
+            last_timestamp DATETIME,
+            last_id INTEGER,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (6, "full-text index over medical history", _migrate_history_fts),
+    (7, "stage results retention index", [
+        # Serves prune_stage_results
+        "CREATE INDEX IF NOT EXISTS idx_stage_results_created ON stage_results (created_at)",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version():
+    """Return the schema version recorded in the database."""
+    return get_db_connection().execute("PRAGMA user_version").fetchone()[0]
+
+def migrate_database():
+    """Apply pending migrations in place and return the applied versions."""
+    conn = get_db_connection()
+    applied = []
+    for version, description, step in MIGRATIONS:
+        # Each migration runs in its own write transaction; re-reading the
+        # version under the lock keeps concurrent starters from racing.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                conn.rollback()
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                for statement in step:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+        print(f"🔄 Applied database migration {version}: {description}")
+    if applied:
+        conn.execute("PRAGMA optimize")
+    return applied
+
+def init_database():
+    """Initialize SQLite database with existing data preservation."""
+    is_new = not os.path.exists(DB_PATH)
+    try:
+        migrate_database()
+    except Exception as e:
+        print(f"⚠️ Database migration error: {e}")
+        raise
+    if is_new:
         print("✅ New database initialized successfully")
     else:
-        # Database exists - check if it has the correct schema
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
+        print(f"✅ Existing database schema is up to date (version {SCHEMA_VERSION})")
+
+def _open_connection(db_path):
+    """Open a tuned connection to db_path."""
+    conn = sqlite3.connect(db_path, timeout=5.0, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_db_connection():
+    """Get this thread's database connection, opening it on first use."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(DB_PATH)
+    if conn is None:
+        conn = connections[DB_PATH] = _open_connection(DB_PATH)
+    return conn
+
+def close_db_connections():
+    """Close every connection opened by the current thread."""
+    connections = getattr(_local, "connections", {})
+    while connections:
+        _, conn = connections.popitem()
+        conn.close()
+
+def _timed(func):
+    """Record the call's duration in healthcrew_db_query_seconds{query=<name>}."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
         try:
-            # Check if patients table has national_id column
-            cursor.execute("PRAGMA table_info(patients)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            if 'national_id' not in columns:
-                print("⚠️ Database schema needs migration - please backup and recreate database")
-            else:
-                print("✅ Existing database schema is correct")
-                
-        except Exception as e:
-            print(f"⚠️ Database check error: {e}")
+            return func(*args, **kwargs)
         finally:
-            conn.close()
+            observe_db(func.__name__, time.perf_counter() - started)
+    return wrapper
 
-def get_db_connection():
-    """Get a database connection."""
-    return sqlite3.connect(DB_PATH)
+class ReadCache:
+    """LRU of patient and history lookups, keyed by (database, kind, national_id).
+
+    Streamlit reruns MainApp.py on every interaction, so the same patient is
+    looked up again and again. Writes through this module invalidate the
+    keys they touch; the TTL bounds how long writes made by other processes
+    (job workers, BulkIO imports) can go unseen.
+    """
+
+    def __init__(self, max_entries=READ_CACHE_ENTRIES, ttl=READ_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation; a read that raced one is not stored
+        self.generation = 0
 
+    def get(self, key):
+        """(True, value) for a fresh entry, else (False, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, stored_at = entry
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def put(self, key, value, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kind, national_id):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop((DB_PATH, kind, str(national_id)), None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+read_cache = ReadCache()
+
+def _read_through(kind):
+    """Serve func(national_id) from read_cache, querying only on a miss."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(national_id):
+            if not READ_CACHE:
+                return func(national_id)
+            key = (DB_PATH, kind, str(national_id))
+            hit, value = read_cache.get(key)
+            observe_db_cache(kind, hit)
+            if not hit:
+                generation = read_cache.generation
+                value = func(national_id)
+                read_cache.put(key, value, generation)
+            # Callers get their own list to modify
+            return list(value) if isinstance(value, list) else value
+        return wrapper
+    return decorator
+
+@_read_through("patient")
+@_timed
 def check_patient_by_national_id(national_id):
     """Check if patient exists by national ID."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT national_id, name, age, gender FROM patients WHERE national_id = ?",
+    patient = conn.execute(
+        SELECT_PATIENT_SQL,
         (str(national_id),)  # Convert to string to handle number input
-    )
-    patient = cursor.fetchone()
-    conn.close()
+    ).fetchone()
     return patient  # Returns None if not found
 
+@_timed
 def check_patient(name, age, gender):
     """Check if patient exists by name, age, and gender (legacy function)."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT national_id FROM patients WHERE name = ? AND age = ? AND gender = ?",
-        (name, age, gender)
-    )
-    patient = cursor.fetchone()
-    conn.close()
+    patient = conn.execute(SELECT_PATIENT_LEGACY_SQL, (name, age, gender)).fetchone()
     return patient  # Returns None if not found
 
+@_timed
 def create_patient(name, national_id, age, gender):
     """Create a new patient with national ID as primary key."""
     conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute(
-            "INSERT INTO patients (national_id, name, age, gender) VALUES (?, ?, ?, ?)",
-            (str(national_id), name, age, gender)  # Convert to string to handle number input
-        )
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute(
+                INSERT_PATIENT_SQL,
+                (str(national_id), name, age, gender)  # Convert to string to handle number input
+            )
         return str(national_id)  # Return national_id as the identifier
     except sqlite3.IntegrityError:
-        conn.close()
         return None  # National ID already exists
+    finally:
+        read_cache.invalidate("patient", national_id)
 
+@_timed
 def add_medical_history(national_id, description):
     """Add medical history entry for a patient using national_id."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO medical_history (national_id, description) VALUES (?, ?)",
-        (str(national_id), description)  # Convert to string to handle number input
-    )
-    history_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return history_id
+    with conn:
+        cursor = conn.execute(
+            INSERT_HISTORY_SQL,
+            (str(national_id), description)  # Convert to string to handle number input
+        )
+    read_cache.invalidate("history", national_id)
+    return cursor.lastrowid
 
+@_read_through("history")
+@_timed
 def get_patient_medical_history(national_id):
     """Get all medical history entries for a patient using national_id."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT description, timestamp FROM medical_history WHERE national_id = ? ORDER BY timestamp DESC",
+    history = conn.execute(
+        SELECT_HISTORY_SQL,
         (str(national_id),)  # Convert to string to handle number input
-    )
-    history = cursor.fetchall()
-    conn.close()
+    ).fetchall()
     return history
 
+@_read_through("patient")
+@_timed
 def get_patient_by_national_id(national_id):
     """Get patient information by national_id."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT national_id, name, age, gender FROM patients WHERE national_id = ?",
+    patient = conn.execute(
+        SELECT_PATIENT_SQL,
         (str(national_id),)  # Convert to string to handle number input
-    )
-    patient = cursor.fetchone()
-    conn.close()
+    ).fetchone()
     return patient
+
+@_timed
+def count_medical_history(national_id):
+    """Number of medical history entries a patient has."""
+    conn = get_db_connection()
+    return conn.execute(COUNT_HISTORY_SQL, (str(national_id),)).fetchone()[0]
+
+@_timed
+def get_medical_history_page(national_id, limit, offset=0, before=None):
+    """(id, description, timestamp) rows of a patient's history, newest first, one page at a time.
+
+    Pass the previous page's last (timestamp, id) as `before` to continue
+    from it without re-reading the skipped rows the way OFFSET does.
+    """
+    conn = get_db_connection()
+    if before is not None:
+        return conn.execute(
+            SELECT_HISTORY_PAGE_BEFORE_SQL,
+            (str(national_id), before[0], before[1], limit)
+        ).fetchall()
+    return conn.execute(SELECT_HISTORY_PAGE_SQL, (str(national_id), limit, offset)).fetchall()
+
+@_timed
+def count_medical_history_through(national_id, timestamp, entry_id):
+    """Number of history entries at or before (timestamp, entry_id) in history order."""
+    conn = get_db_connection()
+    return conn.execute(
+        COUNT_HISTORY_THROUGH_SQL,
+        (str(national_id), timestamp, timestamp, entry_id)
+    ).fetchone()[0]
+
+@_timed
+def get_history_summary(national_id):
+    """Stored (summary, covered_count, last_timestamp, last_id) for a patient, or None."""
+    conn = get_db_connection()
+    return conn.execute(SELECT_HISTORY_SUMMARY_SQL, (str(national_id),)).fetchone()
+
+@_timed
+def save_history_summary(national_id, summary, covered_count, last_timestamp, last_id):
+    """Store the rolling summary of a patient's oldest covered_count history entries."""
+    conn = get_db_connection()
+    with conn:
+        conn.execute(
+            UPSERT_HISTORY_SUMMARY_SQL,
+            (str(national_id), summary, covered_count, last_timestamp, last_id)
+        )
+
+_SEARCH_TERM = re.compile(r"\w+", re.UNICODE)
+
+def _search_terms(query):
+    return _SEARCH_TERM.findall(str(query))
+
+def fts_query(query, match_all=True):
+    """Turn free text into an FTS5 query: every word as a quoted prefix term.
+
+    Quoting keeps user input from being read as FTS5 syntax, so "penicillin"
+    or "type-2 diabetes" can be typed as is. Returns None if there are no words.
+    """
+    terms = [f'"{term}"*' for term in _search_terms(query)]
+    if not terms:
+        return None
+    return (" AND " if match_all else " OR ").join(terms)
+
+def has_history_fts():
+    """Whether the medical_history_fts index exists (SQLite built with FTS5)."""
+    conn = get_db_connection()
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'medical_history_fts'"
+    ).fetchone() is not None
+
+def _like_filter(query, match_all):
+    terms = _search_terms(query)
+    joiner = " AND " if match_all else " OR "
+    return joiner.join("h.description LIKE ?" for _ in terms), [f"%{term}%" for term in terms]
+
+@_timed
+def search_medical_history(query, national_id=None, limit=50, match_all=True):
+    """History entries matching query, best matches first.
+
+    Returns (national_id, patient name, description, timestamp, snippet)
+    rows; the snippet marks matched words with [brackets]. Pass national_id
+    to search one patient's record only.
+    """
+    match = fts_query(query, match_all)
+    if match is None:
+        return []
+    national_id = None if national_id is None else str(national_id)
+    conn = get_db_connection()
+    if has_history_fts():
+        return conn.execute(SEARCH_HISTORY_FTS_SQL, (match, national_id, national_id, limit)).fetchall()
+
+    where, params = _like_filter(query, match_all)
+    return conn.execute(
+        "SELECT h.national_id, p.name, h.description, h.timestamp, h.description "
+        "FROM medical_history h LEFT JOIN patients p ON p.national_id = h.national_id "
+        f"WHERE ({where}) AND (? IS NULL OR h.national_id = ?) ORDER BY h.timestamp DESC LIMIT ?",
+        params + [national_id, national_id, limit]
+    ).fetchall()
+
+@_timed
+def search_patients_by_history(query, limit=100, match_all=True):
+    """Patients whose history matches query, with how many entries match.
+
+    Returns (national_id, name, age, gender, matches, latest match timestamp)
+    rows, patients with the most matching entries first.
+    """
+    match = fts_query(query, match_all)
+    if match is None:
+        return []
+    conn = get_db_connection()
+    if has_history_fts():
+        return conn.execute(SEARCH_PATIENTS_FTS_SQL, (match, limit)).fetchall()
+
+    where, params = _like_filter(query, match_all)
+    return conn.execute(
+        "SELECT h.national_id, p.name, p.age, p.gender, COUNT(*) AS matches, MAX(h.timestamp) AS latest "
+        "FROM medical_history h LEFT JOIN patients p ON p.national_id = h.national_id "
+        f"WHERE {where} GROUP BY h.national_id ORDER BY matches DESC, latest DESC LIMIT ?",
+        params + [limit]
+    ).fetchall()
+
+@_timed
+def get_stage_results(input_hashes):
+    """Return {input_hash: output} for the stored stage results among input_hashes."""
+    input_hashes = list(input_hashes)
+    if not input_hashes:
+        return {}
+    conn = get_db_connection()
+    placeholders = ", ".join("?" * len(input_hashes))
+    rows = conn.execute(
+        f"SELECT input_hash, output FROM stage_results WHERE input_hash IN ({placeholders})",
+        input_hashes
+    ).fetchall()
+    return dict(rows)
+
+@_timed
+def save_stage_result(input_hash, national_id, stage, output):
+    """Store a pipeline stage's output under the hash of its inputs."""
+    conn = get_db_connection()
+    with conn:
+        conn.execute(UPSERT_STAGE_RESULT_SQL, (input_hash, str(national_id), stage, output))
+
+@_timed
+def prune_stage_results(max_age_days, max_entries):
+    """Drop stage results older than max_age_days, then the oldest beyond max_entries (0 = no limit)."""
+    conn = get_db_connection()
+    removed = 0
+    with conn:
+        if max_age_days:
+            removed += conn.execute(
+                "DELETE FROM stage_results WHERE created_at < datetime('now', ?)", (f"-{max_age_days:g} days",)
+            ).rowcount
+        if max_entries:
+            overflow = conn.execute("SELECT COUNT(*) FROM stage_results").fetchone()[0] - max_entries
+            if overflow > 0:
+                removed += conn.execute(
+                    "DELETE FROM stage_results WHERE input_hash IN "
+                    "(SELECT input_hash FROM stage_results ORDER BY created_at LIMIT ?)",
+                    (overflow,)
+                ).rowcount
+    return removed
+
+@_timed
+def delete_stage_results(national_id):
+    """Forget a patient's stored stage results; return how many were removed."""
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute("DELETE FROM stage_results WHERE national_id = ?", (str(national_id),))
+    return cursor.rowcount
+
+# Bulk import support. IN lists are split so no statement exceeds the
+# SQLite builds that still cap host parameters at 999.
+MAX_IN_PARAMS = 500
+
+def _in_batches(values):
+    values = list(values)
+    for start in range(0, len(values), MAX_IN_PARAMS):
+        batch = values[start:start + MAX_IN_PARAMS]
+        yield batch, ", ".join("?" * len(batch))
+
+def has_medical_history():
+    """Whether any patient has a medical history entry."""
+    conn = get_db_connection()
+    return conn.execute("SELECT EXISTS (SELECT 1 FROM medical_history)").fetchone()[0] == 1
+
+@_timed
+def existing_patient_ids(national_ids):
+    """The subset of national_ids that already have a patient record."""
+    conn = get_db_connection()
+    found = set()
+    for batch, placeholders in _in_batches(national_ids):
+        rows = conn.execute(f"SELECT national_id FROM patients WHERE national_id IN ({placeholders})", batch)
+        found.update(row[0] for row in rows)
+    return found
+
+@_timed
+def get_history_keys(national_ids):
+    """(national_id, description, timestamp) of every stored history entry of national_ids."""
+    conn = get_db_connection()
+    keys = []
+    for batch, placeholders in _in_batches(national_ids):
+        keys.extend(conn.execute(
+            f"SELECT national_id, description, timestamp FROM medical_history WHERE national_id IN ({placeholders})",
+            batch
+        ))
+    return keys
+
+@_timed
+def bulk_insert(patients, history):
+    """Insert a chunk of rows with one executemany per table, in one transaction.
+
+    patients are (national_id, name, age, gender) tuples; existing national
+    IDs are left untouched. history entries are (national_id, description,
+    timestamp) tuples; a None timestamp means now. Returns the number of
+    patients actually inserted.
+    """
+    conn = get_db_connection()
+    with conn:
+        before = conn.total_changes
+        conn.executemany(INSERT_PATIENT_IGNORE_SQL, patients)
+        inserted = conn.total_changes - before
+        conn.executemany(INSERT_HISTORY_AT_SQL, history)
+    read_cache.clear()
+    return inserted
+
+def defer_history_indexes(keep_history_index=True):
+    """Stop index maintenance on patients and medical_history for a bulk load.
+
+    Drops the legacy patient lookup index, the FTS triggers and, unless
+    keep_history_index, the history index; restore_history_indexes() puts
+    them back. Returns the state restore_history_indexes() needs.
+    """
+    conn = get_db_connection()
+    with conn:
+        state = {
+            "last_id": conn.execute("SELECT COALESCE(MAX(id), 0) FROM medical_history").fetchone()[0],
+            "fts": has_history_fts(),
+        }
+        conn.execute("DROP INDEX IF EXISTS idx_patients_name_age_gender")
+        if not keep_history_index:
+            conn.execute("DROP INDEX IF EXISTS idx_medical_history_patient_time")
+        if state["fts"]:
+            for trigger in HISTORY_FTS_TRIGGERS:
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    return state
+
+def restore_history_indexes(state):
+    """Rebuild what defer_history_indexes() dropped, in one pass per index.
+
+    Only history rows added since the deferral are added to the FTS index,
+    whoever inserted them.
+    """
+    conn = get_db_connection()
+    with conn:
+        conn.execute(PATIENTS_NAME_INDEX_SQL)
+        conn.execute(HISTORY_PATIENT_TIME_INDEX_SQL)
+        if state["fts"]:
+            conn.execute(
+                "INSERT INTO medical_history_fts (rowid, description) "
+                "SELECT id, description FROM medical_history WHERE id > ?",
+                (state["last_id"],)
+            )
+            _create_history_fts_triggers(conn)
+    conn.execute("PRAGMA optimize")
+
+def iter_patients_with_history():
+    """Yield (national_id, name, age, gender, [(description, timestamp), ...]) per patient.
+
+    Rows are streamed from one query in national_id order, each patient's
+    history oldest first, so memory holds one patient at a time.
+    """
+    conn = get_db_connection()
+    current, history = None, []
+    for national_id, name, age, gender, description, timestamp in conn.execute(EXPORT_SQL):
+        if current is not None and current[0] != national_id:
+            yield (*current, history)
+            history = []
+        current = (national_id, name, age, gender)
+        if description is not None:
+            history.append((description, timestamp))
+    if current is not None:
+        yield (*current, history)
+
+# Async variants for asyncio callers. Each runs the function above on the
+# default executor; every executor thread reuses its own pooled connection,
+# so the event loop never blocks on SQLite.
+async def check_patient_by_national_id_async(national_id):
+    return await asyncio.to_thread(check_patient_by_national_id, national_id)
+
+async def create_patient_async(name, national_id, age, gender):
+    return await asyncio.to_thread(create_patient, name, national_id, age, gender)
+
+async def add_medical_history_async(national_id, description):
+    return await asyncio.to_thread(add_medical_history, national_id, description)
+
+async def get_patient_medical_history_async(national_id):
+    return await asyncio.to_thread(get_patient_medical_history, national_id)
+
+async def get_patient_by_national_id_async(national_id):
+    return await asyncio.to_thread(get_patient_by_national_id, national_id)
+
+async def get_stage_results_async(input_hashes):
+    return await asyncio.to_thread(get_stage_results, input_hashes)
+
+async def search_medical_history_async(query, national_id=None, limit=50, match_all=True):
+    return await asyncio.to_thread(search_medical_history, query, national_id, limit, match_all)
+
+async def search_patients_by_history_async(query, limit=100, match_all=True):
+    return await asyncio.to_thread(search_patients_by_history, query, limit, match_all)